@@ -1,4 +1,5 @@
 from .shader import UniformManager
+from .render_state import RenderState
 
 class InternalData:
     def __init__(self):
@@ -9,6 +10,13 @@ class InternalData:
         self.current_shader = None
         self.current_scene = None
         self.uniform_manager = None
+        self.draw_calls = 0
+        # bumped whenever the static set or a static object's mesh, texture or render state changes
+        self.static_version = 0
+        # bumped when only the colours a static batch bakes into its vertices change
+        self.static_material_version = 0
+        self.headless = False
+        self.render_state = RenderState()
         
 internal_data = InternalData()
 
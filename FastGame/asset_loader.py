@@ -0,0 +1,117 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from .mesh_registry import mesh_registry
+from .texture_cache import load_texture_levels
+
+
+class AssetMetrics:
+    def __init__(self, kind, path):
+        self.kind = kind
+        self.path = path
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.ready_at = None
+        self.upload_time = 0.0
+
+    @property
+    def wait_time(self):
+        return self.started_at - self.queued_at if self.started_at is not None else None
+
+    @property
+    def decode_time(self):
+        return self.finished_at - self.started_at if self.finished_at is not None else None
+
+    @property
+    def total_time(self):
+        return self.ready_at - self.queued_at + self.upload_time if self.ready_at is not None else None
+
+    def as_dict(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 3)
+        return {'kind': self.kind, 'path': self.path, 'wait_ms': ms(self.wait_time), 'decode_ms': ms(self.decode_time),
+                'upload_ms': ms(self.upload_time), 'total_ms': ms(self.total_time)}
+
+
+class AssetLoader:
+    # decodes on worker threads, results are handed out on the main thread by poll
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._requests = {}
+        self.metrics = {}
+
+    def get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='FastGameAssets')
+        return self._executor
+
+    @property
+    def pending_count(self):
+        return len(self._requests)
+
+    def _run(self, function, path, metrics):
+        metrics.started_at = time.perf_counter()
+        try:
+            return function(path)
+        finally:
+            metrics.finished_at = time.perf_counter()
+
+    def load(self, kind, path, function, on_ready, asynchronous=False):
+        key = (kind, path)
+        request = self._requests.get(key)
+        if request is None:
+            metrics = AssetMetrics(kind, path)
+            self.metrics[path] = metrics
+            if not asynchronous:
+                result = self._run(function, path, metrics)
+                metrics.ready_at = time.perf_counter()
+                on_ready(result)
+                return None
+            future = self.get_executor().submit(self._run, function, path, metrics)
+            # the same file requested twice while in flight is decoded once
+            request = (future, [])
+            self._requests[key] = request
+        request[1].append(on_ready)
+        return request[0]
+
+    def load_texture(self, path, mode, mipmaps, flip, on_ready, asynchronous=False):
+        # decoded, flipped and mip-chained pixels, read from the disk cache when it is current
+        return self.load(f'texture:{mode}:{int(mipmaps)}{int(flip)}', path,
+                         lambda path: load_texture_levels(path, mode, mipmaps, flip), on_ready, asynchronous)
+
+    def load_mesh(self, filename, on_ready, asynchronous=False):
+        return self.load('mesh', filename, mesh_registry.get, on_ready, asynchronous)
+
+    def record_upload(self, path, seconds):
+        metrics = self.metrics.get(path)
+        if metrics is not None:
+            metrics.upload_time += seconds
+
+    def poll(self):
+        if not self._requests:
+            return
+        for key, (future, callbacks) in list(self._requests.items()):
+            if not future.done():
+                continue
+            del self._requests[key]
+            self.metrics[key[1]].ready_at = time.perf_counter()
+            # decode errors surface here, on the main thread
+            result = future.result()
+            for on_ready in callbacks:
+                on_ready(result)
+
+    def wait_all(self, timeout=None):
+        wait([future for future, _ in self._requests.values()], timeout=timeout)
+        self.poll()
+
+    def get_metrics(self):
+        return [metrics.as_dict() for metrics in self.metrics.values()]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+asset_loader = AssetLoader()
@@ -0,0 +1,116 @@
+import numpy as np
+from .transform_pool import get_shared_pool
+
+
+def sweep_and_prune(mins, maxs):
+    # index pairs whose boxes overlap, sweeping along the axis the boxes are most spread on
+    count = len(mins)
+    if count < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+    axis = int(np.argmax(np.var(mins + maxs, axis=0)))
+    order = np.argsort(mins[:, axis], kind='stable')
+    sorted_mins = mins[order]
+    sorted_maxs = maxs[order]
+
+    # after sorting only the boxes that start before this one ends can overlap it
+    ends = np.searchsorted(sorted_mins[:, axis], sorted_maxs[:, axis], side='right')
+    counts = np.maximum(ends - np.arange(count) - 1, 0)
+    first = np.repeat(np.arange(count), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    second = first + 1 + offsets
+
+    overlap = np.all((sorted_mins[first] <= sorted_maxs[second]) & (sorted_mins[second] <= sorted_maxs[first]), axis=1)
+    return np.stack([order[first[overlap]], order[second[overlap]]], axis=1)
+
+
+class CollisionWorld:
+    def __init__(self):
+        self.colliders = []
+        self._members = set()
+        self.pairs = np.zeros((0, 2), dtype=np.int64)
+        self.candidate_count = 0
+        self._candidates = {}
+        self._overlapping = set()
+
+    def add(self, collider):
+        if collider not in self._members:
+            self._members.add(collider)
+            self.colliders.append(collider)
+
+    def remove(self, collider):
+        if collider in self._members:
+            self._members.discard(collider)
+            self.colliders.remove(collider)
+            collider._last_colliding.clear()
+            self._candidates.pop(collider, None)
+            self._overlapping = {pair for pair in self._overlapping if collider not in pair}
+
+    def clear(self):
+        for collider in list(self.colliders):
+            self.remove(collider)
+
+    def get_bounds(self):
+        game_objects = [collider.game_object for collider in self.colliders]
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            positions = pool.global_positions[indices]
+            scales = pool.scales[indices]
+        else:
+            positions = np.array([game_object.transform.get_global_position() for game_object in game_objects], dtype=np.float32)
+            scales = np.array([game_object.transform.get_scale() for game_object in game_objects], dtype=np.float32)
+        sizes = np.array([collider.size for collider in self.colliders], dtype=np.float32)
+        half_sizes = sizes * scales * 0.5
+        return positions - half_sizes, positions + half_sizes
+
+    def get_swept_bounds(self, mins, maxs):
+        # moving bodies cover the whole step so nothing they can reach is missed
+        mins = mins.copy()
+        maxs = maxs.copy()
+        for index, collider in enumerate(self.colliders):
+            rigidbody = collider.game_object.components.get('rigidbody')
+            if rigidbody is None:
+                continue
+            motion = rigidbody.velocity * rigidbody.get_delta_time()
+            mins[index] += np.minimum(motion, 0)
+            maxs[index] += np.maximum(motion, 0)
+        return mins, maxs
+
+    def step(self):
+        if len(self.colliders) < 2:
+            self.pairs = np.zeros((0, 2), dtype=np.int64)
+            self.candidate_count = 0
+            self._candidates = {}
+            self._update_triggers(set())
+            return
+
+        mins, maxs = self.get_bounds()
+        self.pairs = np.sort(sweep_and_prune(*self.get_swept_bounds(mins, maxs)), axis=1)
+        self.candidate_count = len(self.pairs)
+
+        colliders = self.colliders
+        self._candidates = {}
+        for first, second in self.pairs.tolist():
+            self._candidates.setdefault(colliders[first], []).append(colliders[second])
+            self._candidates.setdefault(colliders[second], []).append(colliders[first])
+
+        # triggers only care about real overlaps, not the swept ones
+        first, second = self.pairs[:, 0], self.pairs[:, 1]
+        touching = np.all((maxs[first] >= mins[second]) & (mins[first] <= maxs[second]), axis=1)
+        self._update_triggers({(colliders[a], colliders[b]) for a, b in self.pairs[touching].tolist()})
+
+    def _update_triggers(self, overlapping):
+        entered = overlapping - self._overlapping
+        for first, second in self._overlapping - overlapping:
+            first._last_colliding.discard(second)
+            second._last_colliding.discard(first)
+        self._overlapping = overlapping
+        for first, second in entered:
+            first._last_colliding.add(second)
+            second._last_colliding.add(first)
+            if callable(first.on_trigger):
+                first.on_trigger(first, second)
+            if callable(second.on_trigger):
+                second.on_trigger(second, first)
+
+    def get_candidates(self, collider):
+        return self._candidates.get(collider, [])
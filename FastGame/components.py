@@ -1,11 +1,18 @@
 import ctypes
+import time
 import numpy as np
 import math
 from OpenGL.GL import *
 import pyglet
 
-from PIL import Image
 from .mesh_parser import MeshParser
+from .physics import BodyArrays, BodyField
+from .scheduler import ScheduledCall
+from .asset_loader import asset_loader
+from .texture_registry import texture_registry
+from .texture_cache import load_texture_levels
+from .mesh_registry import mesh_registry
+from .profiler import profiler
 from .utils import Color
 from .game_objects import GameObject, VisibleGameObject
 from pyglm import glm
@@ -18,6 +25,9 @@ from scipy.spatial.transform import Rotation
 
 
 class ComponentBase:
+    # components that need a GL context are not started in headless mode
+    uses_gpu = False
+
     def __init__(self, game_object=None):
         if game_object is not None:
             if not isinstance(game_object, GameObject):
@@ -32,6 +42,16 @@ class ComponentBase:
 
         
         
+def mark_static_changed(game_object, material=False):
+    # static batches bake meshes and material state, see static_batching.py
+    if game_object is None or not game_object.static:
+        return
+    if material:
+        internal_data.static_material_version += 1
+    else:
+        internal_data.static_version += 1
+
+        
 class ComponentManager:
     def __init__(self, game_object):
         if game_object is not None:
@@ -48,8 +68,15 @@ class ComponentManager:
             raise TypeError('component must be of type ComponentBase')
         component.game_object = self.game_object
         self._components[component_name] = component
+        if self.game_object is not None and self.game_object.scene is not None:
+            self.game_object.scene.register_component(component)
         if not self.start_lock:
-            component.start()
+            self.start_component(component)
+    
+    def start_component(self, component):
+        if internal_data.headless and component.uses_gpu:
+            return
+        component.start()
     
     def get(self, component_name : str):
         return self._components.get(component_name)
@@ -60,28 +87,50 @@ class ComponentManager:
         return [component for component in self._components.values() if isinstance(component, component_class)]
     
     def remove(self, component_name):
-        self._components.pop(component_name, None)
+        component = self._components.pop(component_name, None)
+        if component is not None and self.game_object is not None and self.game_object.scene is not None:
+            self.game_object.scene.unregister_component(component)
         
     def remove_all(self, component_class):
-        for key, value in self._components.items():
+        for key, value in list(self._components.items()):
             if isinstance(value, component_class):
-                self._components.pop(key)
+                self.remove(key)
     
     
     def update(self):
+        if profiler.enabled:
+            self.update_profiled()
+            return
+        for component in self._components.values():
+            # scripts in a scene are run by its scheduler
+            if isinstance(component, Script) and component.is_scheduled:
+                continue
+            component.update()
+
+    def update_profiled(self):
+        # one span per component, named by its class and tagged with the object
+        name = self.game_object.name if self.game_object is not None else None
         for component in self._components.values():
+            if isinstance(component, Script) and component.is_scheduled:
+                continue
+            start = profiler.begin()
             component.update()
+            profiler.end(type(component).__name__, start, name)
             
     def start(self):
         for component in self._components.values():
-            component.start()
+            self.start_component(component)
         
         
         
 
 class RenderedComponent(ComponentBase):
+    uses_gpu = True
+
     def set_uniforms(self):
         return {}
+    def set_block_uniforms(self):
+        return {}
     def setup(self):
         pass
     def post_setup(self):
@@ -95,58 +144,133 @@ class Transform(RenderedComponent):
         super().__init__(*args, **kwargs)
         self._position = glm.vec3(0, 0, 0)
         self._rotation = glm.quat(1, 0, 0, 0)
-        self._scale = glm.vec3(0, 0, 0)
+        self._scale = glm.vec3(1, 1, 1)
         self._model = glm.mat4(1.0)
-        self.set_position(glm.vec3(0, 0, 0))
-        self.set_rotation(glm.quat(1, 0, 0, 0))
-        self.set_scale(glm.vec3(1, 1, 1))
+        self._local_model = glm.mat4(1.0)
+        self._local_dirty = True
+        self._global_model = glm.mat4(1.0)
+        self._global_view = glm.mat4(1.0)
+        self._global_position = glm.vec3(0, 0, 0)
+        self._global_rotation = glm.quat(1, 0, 0, 0)
+        self._global_dirty = True
+        self._global_view_dirty = True
+        # set while a TransformPool owns the values, the fields above are then unused
+        self._pool = None
+        self._pool_index = -1
 
-    def get_global_model_matrix(self):
-        scale = glm.scale(glm.mat4(1.0), self.get_scale())
-        if self.game_object.parent is None:
-            return self.get_model_matrix() * scale
+    def _set_dirty(self):
+        self._local_dirty = True
+        self.invalidate()
+
+    def invalidate(self):
+        if self._pool is not None:
+            self._pool.mark_hierarchy_dirty()
+            return
+        # a clean transform always has clean ancestors, so a dirty one already
+        # has a dirty subtree and the walk can stop there
+        if self._global_dirty:
+            return
+        self._global_dirty = True
+        self._global_view_dirty = True
+        if self.game_object is not None:
+            for child in self.game_object.objects.get_all():
+                child.transform.invalidate()
+
+    def _update_local(self):
+        self._model = glm.translate(glm.mat4(1.0), self._position) * glm.mat4_cast(self._rotation)
+        self._local_model = glm.scale(self._model, self._scale)
+        self._local_dirty = False
+
+    def _update_global(self):
+        parent = self.game_object.parent if self.game_object is not None else None
+        if parent is None:
+            self._global_model = self.get_local_model_matrix()
+            self._global_position = glm.vec3(self._position)
+            self._global_rotation = glm.quat(self._rotation)
         else:
-            parent_model = self.game_object.parent.transform.get_global_model_matrix()
-            return parent_model * self.get_model_matrix() * scale
-        
+            parent_transform = parent.transform
+            self._global_model = parent_transform.get_global_model_matrix() * self.get_local_model_matrix()
+            self._global_position = parent_transform.get_global_position() + self._position
+            self._global_rotation = glm.normalize(parent_transform.get_global_rotation() * self._rotation)
+        self._global_dirty = False
+
+    def get_global_model_matrix(self):
+        if self._pool is not None:
+            return glm.mat4(*self.get_global_model_array().T.flat)
+        if self._global_dirty:
+            self._update_global()
+        return self._global_model
+        
+    def get_global_model_array(self):
+        if self._pool is not None:
+            self._pool.update()
+            return self._pool.world_matrices[self._pool_index]
+        return np.array(self.get_global_model_matrix(), dtype=np.float32)
+
     def get_global_view_matrix(self):
-        model = self.get_global_model_matrix()
-        return glm.inverse(model)
+        if self._pool is not None:
+            return glm.inverse(self.get_global_model_matrix())
+        if self._global_dirty or self._global_view_dirty:
+            self._global_view = glm.inverse(self.get_global_model_matrix())
+            self._global_view_dirty = False
+        return self._global_view
     
     def get_global_position(self):
-        if self.game_object.parent is None:
-            return self.get_position()
-        else:
-            parent_pos = self.game_object.parent.transform.get_global_position()
-            return parent_pos + self.get_position()
+        if self._pool is not None:
+            self._pool.update()
+            return glm.vec3(*self._pool.global_positions[self._pool_index])
+        if self._global_dirty:
+            self._update_global()
+        return self._global_position
     
     def get_global_rotation(self):
-        if self.game_object.parent is None:
-            return self.get_rotation()
-        else:
-            parent_rotation = self.game_object.parent.transform.get_global_rotation()
-            return glm.normalize(parent_rotation * self.get_rotation())
+        if self._pool is not None:
+            self._pool.update()
+            return glm.quat(*self._pool.global_rotations[self._pool_index])
+        if self._global_dirty:
+            self._update_global()
+        return self._global_rotation
         
     def get_model_matrix(self):
+        if self._pool is not None:
+            return glm.translate(glm.mat4(1.0), self.get_position()) * glm.mat4_cast(self.get_rotation())
+        if self._local_dirty:
+            self._update_local()
         return self._model
 
+    def get_local_model_matrix(self):
+        if self._pool is not None:
+            self._pool.update()
+            return glm.mat4(*self._pool.local_matrices[self._pool_index].T.flat)
+        if self._local_dirty:
+            self._update_local()
+        return self._local_model
+
     def get_position(self):
+        if self._pool is not None:
+            return glm.vec3(*self._pool.positions[self._pool_index])
         return self._position
 
     def set_position(self, vec3: glm.vec3):
-        scale = self.get_scale()
-        position = vec3 #* glm.vec3(1/scale.x if scale.x != 0 else 1, 1/scale.y if scale.y != 0 else 1, 1/scale.z if scale.z != 0 else 1)
-        # print(position)
-        self._translate_model_matrix(position - self._position)
-        self._position = glm.vec3(self.get_model_matrix()[3])
-        
+        if self._pool is not None:
+            self._pool.positions[self._pool_index] = vec3
+            self._pool.mark_dirty()
+            return
+        self._position = glm.vec3(vec3)
+        self._set_dirty()
 
     def get_rotation(self):
+        if self._pool is not None:
+            return glm.quat(*self._pool.rotations[self._pool_index])
         return self._rotation
 
     def set_rotation(self, quat: glm.quat):
-        self._rotate_model_matrix(glm.inverse(self._rotation) * glm.normalize(quat))
+        if self._pool is not None:
+            self._pool.rotations[self._pool_index] = glm.normalize(quat)
+            self._pool.mark_dirty()
+            return
         self._rotation = glm.normalize(quat)
+        self._set_dirty()
         
     def set_rotation_euler(self, vec3 : glm.vec3):
         rad = glm.radians(vec3)
@@ -154,38 +278,32 @@ class Transform(RenderedComponent):
         self.set_rotation(quat)
     
     def get_scale(self):
+        if self._pool is not None:
+            return glm.vec3(*self._pool.scales[self._pool_index])
         return self._scale
 
     def set_scale(self, vec3: glm.vec3):
-        # self._scale_model_matrix(vec3)
-        self._scale = vec3
+        if self._pool is not None:
+            self._pool.scales[self._pool_index] = vec3
+            self._pool.mark_dirty()
+            return
+        self._scale = glm.vec3(vec3)
+        self._set_dirty()
 
     def translate(self, vec3: glm.vec3):
-        scale = self.get_scale()
-        position = vec3 #* glm.vec3(1/scale.x if scale.x != 0 else 1, 1/scale.y if scale.y != 0 else 1, 1/scale.z if scale.z != 0 else 1)
-        self._translate_model_matrix(position)
-        self._position = glm.vec3(self.get_model_matrix()[3])
+        # translations are along the local axes
+        self.set_position(self.get_position() + self.get_rotation() * glm.vec3(vec3))
         
     def rotate(self, quat: glm.quat):
-        self._rotation = glm.normalize(self._rotation * glm.normalize(quat))
-        self._rotate_model_matrix(quat)
+        self.set_rotation(self.get_rotation() * glm.normalize(quat))
         
     def rotate_euler(self, vec3 : glm.vec3):
         rad = glm.radians(vec3)
         quat = glm.quat(rad)
         self.rotate(quat)
-        
-    def _rotate_model_matrix(self, quat: glm.quat):
-        rotation = glm.mat4_cast(quat)
-        self._model = self._model * rotation
-        
-    def _translate_model_matrix(self, vec3: glm.vec3):
-        translation = glm.translate(glm.mat4(1.0), vec3)
-        self._model = self._model * translation
-        
 
     def get_distance_from(self, vec3: glm.vec3):
-        return glm.distance(self._position, vec3)
+        return glm.distance(self.get_position(), vec3)
 
     def look_at(self, target: glm.vec3, up: glm.vec3):
         position = self.get_global_position()
@@ -201,33 +319,36 @@ class Transform(RenderedComponent):
         self.set_rotation(desired_local_rot)
 
     def set_uniforms(self):
-        model = self.get_global_model_matrix()
-        return {"model": np.array(model, dtype=np.float32)}
+        return {"model": self.get_global_model_array()}
 
     
     
 class DirectionalLightTransform(Transform):
     def set_uniforms(self):
-        # print(self.get_global_view_matrix())
-        # self.look_at(glm.vec3(0, 0, 0), glm.vec3(0, 1, 0))
+        return {}
+    
+    def set_block_uniforms(self):
         return {
-            'directional_light[n].direction': np.array(glm.normalize(self.get_rotation() * glm.vec3(0,0,-1)), dtype=np.float32),
-            'light_view': np.array(self.get_global_view_matrix(), dtype=np.float32)
-       
+            'direction': glm.normalize(self.get_rotation() * glm.vec3(0,0,-1)),
         }
         
 class PointLightTransform(Transform):
     def set_uniforms(self):
+        return {}
+    
+    def set_block_uniforms(self):
         return {
-            'point_light[n].position': np.array(list(self.get_global_position()), dtype=np.float32)
+            'position': self.get_global_position()
         }
         
 class SpotLightTransform(Transform):
     def set_uniforms(self):
+        return {}
+    
+    def set_block_uniforms(self):
         return {
-            'spot_light[n].position': np.array(list(self.get_global_position()), dtype=np.float32),
-            'spot_light[n].direction': np.array(glm.normalize(self.get_rotation() * glm.vec3(0,0,-1)), dtype=np.float32),
-            'light_view': np.array(self.get_global_view_matrix(), dtype=np.float32)
+            'position': self.get_global_position(),
+            'direction': glm.normalize(self.get_rotation() * glm.vec3(0,0,-1)),
         }
         
         
@@ -235,10 +356,16 @@ class SpotLightTransform(Transform):
         
 class CameraTransform(Transform):   
     def set_uniforms(self):
+        return {}
+    
+    def set_block_uniforms(self):
         return {"view": np.array(self.get_global_view_matrix(), dtype=np.float32),
-                "view_position": np.array(list(self.get_global_position()), dtype=np.float32)}
+                "view_position": self.get_global_position()}
         
 
+PLACEHOLDER_MESH = 'meshes/cuboid.obj'
+
+
 class Mesh(RenderedComponent):
     def __init__(self, mesh=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -256,6 +383,16 @@ class Mesh(RenderedComponent):
         if not isinstance(value, MeshParser):
             raise TypeError("mesh type must be MeshParser")
         self._mesh = value
+        mark_static_changed(self.game_object)
+    
+    def load(self, filename, asynchronous=False):
+        # asynchronous loads draw a unit cube until the mesh is parsed
+        if asynchronous and self._mesh is None:
+            self.mesh = mesh_registry.get(PLACEHOLDER_MESH)
+        return asset_loader.load_mesh(filename, self.set_mesh, asynchronous)
+    
+    def set_mesh(self, mesh):
+        self.mesh = mesh
         
     def set_buffers(self):
         # print(self.game_object, self.mesh.vertices)
@@ -265,16 +402,20 @@ class Mesh(RenderedComponent):
         }
         
     def setup(self):
+        render_state = internal_data.render_state
         if self._mesh.is_3d:
-            glEnable(GL_CULL_FACE)
-            glCullFace(GL_FRONT)
+            render_state.enable(GL_CULL_FACE)
+            render_state.cull_face(GL_FRONT)
         else:
-            glDisable(GL_CULL_FACE)
+            render_state.disable(GL_CULL_FACE)
 
 
 
 
 class Material(RenderedComponent):
+    # static batches keep these per vertex, changing them does not regroup the batches
+    VERTEX_ATTRIBUTES = ('color', 'ambient_light', 'diffuse_reflection', 'specular_reflection', 'shininess')
+    
     def __init__(self, color=None, alpha=1.0,
                  ambient_light=0.1, diffuse_reflection=0.7,
                  specular_reflection=0, shininess = 32, wireframe=False, *args, **kwargs):
@@ -291,6 +432,11 @@ class Material(RenderedComponent):
         self.shininess = shininess
         self.wireframe = wireframe
         
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            mark_static_changed(self.__dict__.get('game_object'), name in self.VERTEX_ATTRIBUTES)
+        
     @property
     def color(self):
         return self._color
@@ -311,32 +457,53 @@ class Material(RenderedComponent):
         }
         
     def setup(self):
+        render_state = internal_data.render_state
         if self.wireframe:
-            glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
+            render_state.polygon_mode(GL_FRONT_AND_BACK, GL_LINE)
         else:
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
+            render_state.polygon_mode(GL_FRONT_AND_BACK, GL_FILL)
             
         if self.alpha < 1:
-            glEnable(GL_BLEND)
-            glDepthMask(GL_FALSE)
+            render_state.enable(GL_BLEND)
+            render_state.depth_mask(GL_FALSE)
         else:
-            glDisable(GL_BLEND)
-            glDepthMask(GL_TRUE)
+            render_state.disable(GL_BLEND)
+            render_state.depth_mask(GL_TRUE)
+
+
 
 
+TEXTURE_SAMPLER = ((GL_TEXTURE_WRAP_S, GL_REPEAT), (GL_TEXTURE_WRAP_T, GL_REPEAT),
+                   (GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR), (GL_TEXTURE_MAG_FILTER, GL_LINEAR))
+SKYBOX_SAMPLER = ((GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE), (GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE), (GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE),
+                  (GL_TEXTURE_MIN_FILTER, GL_LINEAR), (GL_TEXTURE_MAG_FILTER, GL_LINEAR))
+MIPMAP_FILTERS = (GL_NEAREST_MIPMAP_NEAREST, GL_LINEAR_MIPMAP_NEAREST, GL_NEAREST_MIPMAP_LINEAR, GL_LINEAR_MIPMAP_LINEAR)
+
+
+def uses_mipmaps(sampler):
+    return dict(sampler).get(GL_TEXTURE_MIN_FILTER) in MIPMAP_FILTERS
 
 
 class Texture(RenderedComponent):
-    def __init__(self, repeat_x = 1, repeat_y = 1, *args, **kwargs):
+    def __init__(self, repeat_x = 1, repeat_y = 1, sampler=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
  
         self.repeat_x = repeat_x
         self.repeat_y = repeat_y
-        self._image_data = None
-        self._image = None
+        self.sampler = sampler if sampler is not None else TEXTURE_SAMPLER
+        self._levels = None
+        self._texture_path = None
+        self._texture = None
         self._texture_id = None
+        self._started = False
+        self._needs_upload = False
         self.active = False
         
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            mark_static_changed(self.__dict__.get('game_object'))
+        
     @property
     def texture_wrapping(self):
         return self._texture_wrapping
@@ -346,33 +513,61 @@ class Texture(RenderedComponent):
 
         
         
-    def load_texture(self, texture_path):
-        image = Image.open(texture_path)
-        self._image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        self._image_data = np.array(image.convert("RGBA"), dtype=np.uint8)
+    def load_texture(self, texture_path, asynchronous=False):
+        # asynchronous loads draw with the flat material colour until the image is decoded
+        self._texture_path = texture_path
+        self._levels = None
+        mark_static_changed(self.game_object)
+        if texture_registry.find(texture_registry.get_key(texture_path, self.sampler)) is not None:
+            self._needs_upload = True
+            return None
+        return asset_loader.load_texture(texture_path, "RGBA", uses_mipmaps(self.sampler), True, self.set_levels, asynchronous)
+    
+    def set_levels(self, levels):
+        self._levels = levels
+        self._needs_upload = True
+    
+    def get_levels(self):
+        if self._levels is None:
+            # the shared copy was released meanwhile, the disk cache makes reading it again cheap
+            self._levels = load_texture_levels(self._texture_path, "RGBA", uses_mipmaps(self.sampler), True)
+        return self._levels
         
     def start(self):
-
-        if self._image:
-            self._texture_id = glGenTextures(1)
-            glBindTexture(GL_TEXTURE_2D, self._texture_id)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self._image.width, self._image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, self._image_data)
-            glGenerateMipmap(GL_TEXTURE_2D)
-            glBindTexture(GL_TEXTURE_2D, 0)
+        self._started = True
+        if self._needs_upload:
+            self.upload()
+    
+    def upload(self):
+        key = texture_registry.get_key(self._texture_path, self.sampler)
+        if self._texture is None or self._texture.key != key:
+            start = time.perf_counter()
+            texture = texture_registry.acquire(key, GL_TEXTURE_2D, lambda: [self.get_levels()], unit=0)
+            self.release()
+            self._texture = texture
+            self._texture_id = texture.texture_id
             self.active = True
+            asset_loader.record_upload(self._texture_path, time.perf_counter() - start)
+        self._levels = None
+        self._needs_upload = False
+    
+    def release(self):
+        if self._texture is not None:
+            texture_registry.release(self._texture)
+            self._texture = None
+            self._texture_id = None
+            self.active = False
             
     def setup(self):
+        # images that finished decoding after start are uploaded on the next draw
+        if self._started and self._needs_upload:
+            self.upload()
+        # the texture stays bound afterwards, objects without one don't sample it
         if self.active:
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, self._texture_id)
-            
-    def post_setup(self):
-        glBindTexture(GL_TEXTURE_2D, 0)
-        pass
+            internal_data.render_state.bind_texture(0, GL_TEXTURE_2D, self._texture_id)
+    
+    def __del__(self):
+        self.release()
         
         
     def set_uniforms(self):
@@ -396,10 +591,9 @@ class DirectionalLightSource(RenderedComponent):
         else: 
             self.color = color
         
-    def set_uniforms(self):
+    def set_block_uniforms(self):
         return {
-            'directional_light[n].color': np.array(self.color.color_in_rgb, dtype=np.float32),
-            'directional_light_num': 'num(directional_light.color)',
+            'color': self.color.color_in_rgb,
         }
         
 class PointLightSource(RenderedComponent):
@@ -413,14 +607,12 @@ class PointLightSource(RenderedComponent):
         self.linear = linear
         self.quadratic =  quadratic
         
-    def set_uniforms(self):
+    def set_block_uniforms(self):
         return {
-            'use_point_light': True,
-            'point_light[n].color': np.array(self.color.color_in_rgb, dtype=np.float32),
-            'point_light[n].constant': float(self.constant),
-            'point_light[n].linear': float(self.linear),
-            'point_light[n].quadratic': float(self.quadratic),
-            'point_light_num': 'num(point_light.color)',
+            'color': self.color.color_in_rgb,
+            'constant': self.constant,
+            'linear': self.linear,
+            'quadratic': self.quadratic,
         }
         
         
@@ -437,34 +629,54 @@ class SpotLightSource(RenderedComponent):
         self.cutoff = cutoff
         self.outer_cutoff = outer_cutoff
         
-    def set_uniforms(self):
+    def set_block_uniforms(self):
         return {
-            'use_spot_light': True,
-            'spot_light[n].color': np.array(self.color.color_in_rgb, dtype=np.float32),
-            'spot_light[n].constant': float(self.constant),
-            'spot_light[n].linear': float(self.linear),
-            'spot_light[n].quadratic': float(self.quadratic),
-            'spot_light[n].cutOff': math.cos(math.radians(self.cutoff)),
-            'spot_light[n].outerCutOff': math.cos(math.radians(self.outer_cutoff)),
-            'spot_light_num': 'num(spot_light.color)',
+            'color': self.color.color_in_rgb,
+            'constant': self.constant,
+            'linear': self.linear,
+            'quadratic': self.quadratic,
+            'cutOff': math.cos(math.radians(self.cutoff)),
+            'outerCutOff': math.cos(math.radians(self.outer_cutoff)),
         }
         
         
+# a perspective shadow map can't see a full half space
+SHADOW_MAX_FOV = 170
+
+
 class LightSourceShadow(RenderedComponent):
-    def __init__(self, FOV=45, near=0.1, far=1000, orthographic_size=50, perspective=True, *args, **kwargs):
+    def __init__(self, FOV=None, near=0.1, far=1000, orthographic_size=50, perspective=True, resolution=1024,
+                 update_frames=1, bias=0.0002, enabled=True, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # None follows a spot light's outer cone
         self.FOV = FOV
         self.near = near
         self.far = far
         self.orthographic_size = orthographic_size
         self.perspective = perspective
+        # side of the light's square in the shadow atlas, rounded up to a power of two
+        self.resolution = resolution
+        # a changed shadow map is redrawn at most once every this many frames
+        self.update_frames = update_frames
+        self.bias = bias
+        self.enabled = enabled
     
     @property 
     def aspect_ratio(self):
-        return internal_data.window_width / internal_data.window_height
+        # shadow maps are square tiles of the atlas
+        return 1.0
+        
+    def get_FOV(self):
+        if self.FOV is not None:
+            return self.FOV
+        light_source = getattr(self.game_object, 'light_source', None)
+        if isinstance(light_source, SpotLightSource):
+            # outside its square a light casts no shadow, the square has to hold the whole cone
+            return min(2 * light_source.outer_cutoff, SHADOW_MAX_FOV)
+        return 45
         
     def compute_perspective_projection_matrix(self):
-        return np.array(glm.perspective(glm.radians(self.FOV), self.aspect_ratio, self.near, self.far), dtype=np.float32)
+        return np.array(glm.perspective(glm.radians(self.get_FOV()), self.aspect_ratio, self.near, self.far), dtype=np.float32)
     
     def compute_orthographic_projection_matrix(self):
         left = -self.orthographic_size 
@@ -478,11 +690,13 @@ class LightSourceShadow(RenderedComponent):
             return self.compute_perspective_projection_matrix()
         return self.compute_orthographic_projection_matrix()
     
+    def get_light_space_matrix(self):
+        view = np.array(self.game_object.transform.get_global_view_matrix(), dtype=np.float32)
+        return self.get_projection_matrix() @ view
+
     def set_uniforms(self):
-        # print(self.get_projection_matrix())
-        return {
-            'light_projection': self.get_projection_matrix()
-        }
+        # the shadow pass passes the light's matrices through the shadow block
+        return {}
     
     
     
@@ -515,7 +729,7 @@ class CameraLens(RenderedComponent):
             return self.compute_perspective_projection_matrix()
         return self.compute_orthographic_projection_matrix()  
         
-    def set_uniforms(self):
+    def set_block_uniforms(self):
         return {
             'projection': self.get_projection_matrix(),
             'perspective_projection': self.perspective,
@@ -526,49 +740,91 @@ class CameraLens(RenderedComponent):
 class SkyBoxTexture(RenderedComponent):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.sampler = SKYBOX_SAMPLER
+        self._texture = None
         self._texture_id = None
+        self._started = False
+        self._texture_paths = None
+        self._needs_upload = False
         self.active = False
-        self.image_data = None
-        self.images = None
+        self.faces = None
         
-    def load_texture(self, texture_paths):
+    def load_texture(self, texture_paths, asynchronous=False):
         if len(texture_paths) != 6:
             raise ValueError("Skybox texture must have 6 faces")
-        self.image_data = []
-        self.images = []
-        for texture_path in texture_paths:
-            image = Image.open(texture_path)
-            self.images.append(image.transpose(Image.FLIP_TOP_BOTTOM))
-            self.image_data.append(np.array(image.convert("RGB"), dtype=np.uint8))
+        self._texture_paths = tuple(texture_paths)
+        self.faces = [None] * 6
+        if texture_registry.find(texture_registry.get_key(self._texture_paths, self.sampler)) is not None:
+            # another scene already uploaded this cube map
+            self._needs_upload = True
+            return None
+        # the faces decode in parallel, the skybox stays off until all six are in
+        futures = []
+        for face, texture_path in enumerate(texture_paths):
+            futures.append(asset_loader.load_texture(texture_path, "RGB", uses_mipmaps(self.sampler), False,
+                                                     lambda levels, face=face: self.set_face(face, levels), asynchronous))
+        return futures if asynchronous else None
+    
+    def set_face(self, face, levels):
+        self.faces[face] = levels
+        self._needs_upload = self.faces_ready
+    
+    @property
+    def faces_ready(self):
+        return self.faces is not None and all(levels is not None for levels in self.faces)
+    
+    def get_faces(self):
+        for face, texture_path in enumerate(self._texture_paths):
+            if self.faces[face] is None:
+                self.faces[face] = load_texture_levels(texture_path, "RGB", uses_mipmaps(self.sampler), False)
+        for levels in self.faces:
+            if levels[0].shape != self.faces[0][0].shape:
+                raise ValueError("All skybox faces must have the same dimensions")
+        return self.faces
         
     def start(self):
-        self._texture_id = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_CUBE_MAP, self._texture_id)
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_WRAP_R, GL_CLAMP_TO_EDGE)
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-        glTexParameteri(GL_TEXTURE_CUBE_MAP, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-        i = 0
-        for image, data in zip(self.images, self.image_data):
-            if image.width != self.images[0].width or image.height != self.images[0].height:
-                raise ValueError("All skybox faces must have the same dimensions")
-            glTexImage2D(GL_TEXTURE_CUBE_MAP_POSITIVE_X + i, 0, GL_RGB, image.width, image.height, 0, GL_RGB, GL_UNSIGNED_BYTE, data)
-            i += 1
-            
-        glBindTexture(GL_TEXTURE_CUBE_MAP, 0)
-        self.active = True
+        self._started = True
+        if self._needs_upload:
+            self.upload()
+    
+    def upload(self):
+        key = texture_registry.get_key(self._texture_paths, self.sampler)
+        if self._texture is None or self._texture.key != key:
+            start = time.perf_counter()
+            texture = texture_registry.acquire(key, GL_TEXTURE_CUBE_MAP, self.get_faces, unit=1)
+            self.release()
+            self._texture = texture
+            self._texture_id = texture.texture_id
+            self.active = True
+            elapsed = time.perf_counter() - start
+            for texture_path in self._texture_paths:
+                asset_loader.record_upload(texture_path, elapsed / 6)
+        self.faces = [None] * 6
+        self._needs_upload = False
+    
+    def release(self):
+        if self._texture is not None:
+            texture_registry.release(self._texture)
+            self._texture = None
+            self._texture_id = None
+            self.active = False
         
     def setup(self):
+        if self._started and self._needs_upload:
+            self.upload()
         if self.active:
-            glDepthFunc(GL_LEQUAL)
-            glCullFace(GL_BACK)
-            glActiveTexture(GL_TEXTURE1)
-            glBindTexture(GL_TEXTURE_CUBE_MAP, self._texture_id)
+            render_state = internal_data.render_state
+            render_state.depth_func(GL_LEQUAL)
+            render_state.cull_face(GL_BACK)
+            render_state.bind_texture(1, GL_TEXTURE_CUBE_MAP, self._texture_id)
+    
+    def __del__(self):
+        self.release()
             
     def post_setup(self):
-        glDepthFunc(GL_LESS)
-        glCullFace(GL_FRONT)
+        render_state = internal_data.render_state
+        render_state.depth_func(GL_LESS)
+        render_state.cull_face(GL_FRONT)
         
     def post_uniforms(self):
         return {
@@ -591,18 +847,65 @@ class SkyBoxTexture(RenderedComponent):
 
 
 class Script(ComponentBase):
-    def __init__(self, *args, **kwargs):
+    # seconds between updates, or frames between updates, None and 1 update every frame
+    update_interval = None
+    update_frames = 1
+
+    def __init__(self, *args, update_interval=None, update_frames=None, **kwargs):
         super().__init__(*args, **kwargs)
+        if update_interval is not None:
+            if update_interval <= 0:
+                raise ValueError('update_interval must be positive')
+            self.update_interval = update_interval
+        if update_frames is not None:
+            if not isinstance(update_frames, int) or update_frames < 1:
+                raise ValueError('update_frames must be a positive integer')
+            self.update_frames = update_frames
+        self._scheduler = None
+        self._schedulers = []
+        self._calls = []
+        self._delta_time = None
 
     @property
     def delta_time(self):
+        if self._delta_time is not None:
+            return self._delta_time
         return internal_data.delta_time
     
     @property
     def input_axes(self):
         return internal_data.input_manager.input_axes
-        
-        
+    
+    @property
+    def is_scheduled(self):
+        return len(self._schedulers) > 0
+    
+    def has_update(self):
+        return type(self).update is not Script.update
+    
+    def _add_call(self, call):
+        # calls made before the script joins a scene wait here until it does
+        self._calls = [pending for pending in self._calls if not pending.cancelled]
+        self._calls.append(call)
+        if self._scheduler is not None:
+            self._scheduler.schedule(call)
+        return call
+    
+    def after(self, delay, callback):
+        return self._add_call(ScheduledCall(callback, delay=delay, owner=self))
+    
+    def every(self, interval, callback):
+        if interval <= 0:
+            raise ValueError('Timer interval must be positive')
+        return self._add_call(ScheduledCall(callback, delay=interval, interval=interval, owner=self))
+    
+    def start_coroutine(self, coroutine):
+        return self._add_call(ScheduledCall(None, coroutine=coroutine, owner=self))
+    
+    def cancel_timers(self):
+        for call in self._calls:
+            call.cancel()
+        self._calls = []
         
     def update(self):
         pass
@@ -636,32 +939,17 @@ class BoxCollider(ComponentBase):
         min_b, max_b = other.get_bounds()
         return all(max_a[i] >= min_b[i] and min_a[i] <= max_b[i] for i in range(3))
 
-    def update(self):
-       
-        all_objects = internal_data.current_scene.objects.get_all(VisibleGameObject)
-        other_colliders = []
-        for game_object in all_objects:
-            collider = game_object.components.get('collider')
-            if collider:
-                other_colliders.append(collider)
-       
-        for other in other_colliders:
-            if other is self:
-                continue
-            if self.check_collision(other):
-                if other not in self._last_colliding:
-                    self._last_colliding.add(other)
-                   
-                    if callable(self.on_trigger):
-                        # print(f"Trigger: {self.game_object.name} collided with {other.game_object.name}")
-                        print(self.get_bounds())
-                        print(other.get_bounds())
-                        self.on_trigger(self, other)
-            else:
-                if other in self._last_colliding:
-                    self._last_colliding.remove(other)
-
 class RigidBody(ComponentBase):
+    velocity = BodyField()
+    acceleration = BodyField()
+    gravity = BodyField()
+    mass = BodyField(scalar=True)
+    friction = BodyField(scalar=True)
+    bounciness = BodyField(scalar=True)
+    linear_damping = BodyField(scalar=True)
+    angular_damping = BodyField(scalar=True)
+    use_gravity = BodyField(scalar=True)
+
     def __init__(self,
                  mass: float = 1.0,
                  use_gravity: bool = True,
@@ -673,11 +961,15 @@ class RigidBody(ComponentBase):
                  *args,
                  **kwargs):
         super().__init__(*args, **kwargs)
+        # the values live in a row of the scene PhysicsWorld, or in a row of their own until then
+        self._world = None
+        self._arrays = BodyArrays(capacity=1)
+        self._arrays.bodies.append(self)
+        self._arrays.count = 1
+        self._index = 0
         self.mass = mass
         self.use_gravity = use_gravity
-        self.gravity = np.array(gravity, dtype=np.float32)
-        self.velocity = np.zeros(3, dtype=np.float32)
-        self.acceleration = np.zeros(3, dtype=np.float32)
+        self.gravity = gravity
         self.friction = np.clip(friction, 0.0, 1.0)
         self.bounciness = np.clip(bounciness, 0.0, 1.0)
         self.linear_damping = linear_damping
@@ -685,22 +977,21 @@ class RigidBody(ComponentBase):
 
     def apply_force(self, force: np.ndarray) -> None:
         self.acceleration += np.array(force, dtype=np.float32) / self.mass
-        # print(self.acceleration)
 
     def start(self):
         pass
 
-    def update(self):
-        dt = getattr(self, 'delta_time', 1.0 / 60.0)
+    def get_delta_time(self):
+        if self._world is not None:
+            return self._world.delta_time
+        return 1.0 / 60.0
+
+    def resolve_collisions(self, current, dt, collision_world):
+        # integration happens in PhysicsWorld.step, this only runs for bodies with broadphase candidates
         epsilon = 1e-4
-        self.velocity += self.acceleration * dt
-        self.velocity *= (1.0 - self.linear_damping * dt)
         if hasattr(self.game_object, 'transform'):
-            pos = self.game_object.transform.get_position()
-            current = np.array([pos.x, pos.y, pos.z], dtype=np.float32)
             collider = self.game_object.components.get('collider')
-            all_objects = internal_data.current_scene.objects.get_all(VisibleGameObject)
-            other_colliders = [obj.components.get('collider') for obj in all_objects if obj.components.get('collider') is not collider]
+            other_colliders = collision_world.get_candidates(collider) if collider is not None else []
             new_pos = current + self.velocity * dt
             hit = None
             hit_t = 1.0
@@ -709,9 +1000,7 @@ class RigidBody(ComponentBase):
                 if isinstance(collider, BoxCollider) and isinstance(other, BoxCollider):
                     
                     if collider.is_trigger or other.is_trigger:
-                        if collider.check_collision(other):
-                            if callable(collider.on_trigger):
-                                collider.on_trigger(collider, other)
+                        # trigger events come from the collision world
                         continue
                     temp_collider = collider
                     temp_collider.game_object.transform.set_position(glm.vec3(*new_pos))
@@ -762,12 +1051,12 @@ class RigidBody(ComponentBase):
                 if np.all(np.abs(self.velocity) < epsilon) and np.all(np.abs(self.acceleration) < epsilon):
                     self.velocity[:] = 0
                     self.acceleration[:] = 0
-                    return
             else:
                 self.game_object.transform.set_position(glm.vec3(*new_pos))
-        self.acceleration.fill(0.0)
 
 class TextDisplay(ComponentBase):
+    uses_gpu = True
+
     def __init__(self, text='', x=10, y=10, font_size=24, color=Color('#FFFFFF'), anchor_x='left', anchor_y='top', *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.text = text
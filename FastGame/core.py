@@ -6,6 +6,8 @@ from . import internal_data
 from .scene import Scene
 from .input_manager import InputManager
 from .shader import UniformManager
+from .render_state import RenderState
+from .profiler import profiler, ProfilerOverlay
 
 class Game:
     def __init__(self, input_manager=None, options=None, multi_windows=None):
@@ -26,14 +28,31 @@ class Game:
         self.options = options
         self.running = False
         self.input_manager = input_manager
-        self.display = options['display']
-        self.show_title_bar = options['show_title_bar']
-        self.title = options['title']
-        self.fps = options['fps']
+        self.display = options.get('display', (800, 600))
+        self.show_title_bar = options.get('show_title_bar', True)
+        self.title = options.get('title', 'FAST GAME')
+        self.fps = options.get('fps', 30)
+        # the simulation runs at a fixed rate, rendering interpolates between its steps
+        self.simulation_rate = options.get('simulation_rate', 60)
+        self.max_catch_up_steps = options.get('max_catch_up_steps', 5)
+        self.fixed_delta_time = 1.0 / self.simulation_rate
+        self.accumulator = 0.0
         self.window = None
         self.clock = pyglet.clock.Clock()
         self.multi_windows = multi_windows if multi_windows is not None else []
-        if not self.multi_windows:
+        # headless games never open a window or touch GL, they only simulate
+        self.headless = options.get('headless', False)
+        internal_data.headless = self.headless
+        self.simulated_steps = 0
+        self.steps_per_second = 0.0
+        # opt-in frame profiler, the trace is written when the game stops
+        if options.get('profile', False):
+            profiler.enable()
+        self.profile_trace = options.get('profile_trace', None)
+        self.profiler_overlay = ProfilerOverlay(profiler) if options.get('profile_overlay', False) and not self.headless else None
+        if self.headless:
+            self.init_headless()
+        elif not self.multi_windows:
             self.init_pyglet()
             self.input_manager.attach_window(self.window)
             self.init_opengl()
@@ -46,12 +65,13 @@ class Game:
                 win_input = win_opts.get('input_manager', InputManager())
                 win_options = win_opts.get('options', options)
                 scene_factory = win_opts.get('scene_factory', None)
-                config = gl.Config(double_buffer=True, depth_size=24, sample_buffers=1, samples=4, major_version=3, minor_version=3)
+                config, context = self.get_window_context()
                 win_window = pyglet.window.Window(
                     width=win_options['display'][0],
                     height=win_options['display'][1],
                     caption=win_options['title'],
                     config=config,
+                    context=context,
                     resizable=False,
                     visible=True
                 )
@@ -60,6 +80,9 @@ class Game:
          
                 internal_data.window_width = win_options['display'][0]
                 internal_data.window_height = win_options['display'][1]
+                # every window has its own context and therefore its own GL state
+                win_render_state = RenderState()
+                internal_data.render_state = win_render_state
             
              
                 self.init_opengl()
@@ -74,7 +97,29 @@ class Game:
                     win_scene.start()
               
                 win_uniform_manager = UniformManager()
-                self.windows.append({'window': win_window, 'input_manager': win_input, 'scene': win_scene, 'options': win_options, 'uniform_manager': win_uniform_manager})
+                # a label's vertex arrays only exist in the context that made them, so each window draws its own overlay
+                win_overlay = ProfilerOverlay(profiler) if self.profiler_overlay is not None else None
+                self.windows.append({'window': win_window, 'input_manager': win_input, 'scene': win_scene, 'options': win_options, 'uniform_manager': win_uniform_manager, 'render_state': win_render_state, 'profiler_overlay': win_overlay, 'accumulator': 0.0})
+
+    def get_window_context(self):
+        # later windows join the first one's share group, so buffers, textures and programs
+        # are uploaded once, only vertex arrays and framebuffers are made per window
+        if not self.windows:
+            return gl.Config(double_buffer=True, depth_size=24, sample_buffers=1, samples=4, major_version=3, minor_version=3), None
+        first_context = self.windows[0]['window'].context
+        return first_context.config, first_context.config.create_context(first_context)
+
+    def init_headless(self):
+        self.init_internal_data()
+        self.windows = []
+        for win_opts in self.multi_windows:
+            win_input = win_opts.get('input_manager', InputManager())
+            scene_factory = win_opts.get('scene_factory', None)
+            win_scene = scene_factory() if scene_factory else win_opts.get('scene', None)
+            if win_scene is not None:
+                internal_data.current_scene = win_scene
+                win_scene.start()
+            self.windows.append({'window': None, 'input_manager': win_input, 'scene': win_scene, 'options': win_opts.get('options', self.options), 'accumulator': 0.0})
 
     @property
     def scene(self):
@@ -83,6 +128,9 @@ class Game:
     def scene(self, value):
         if not isinstance(value, Scene):
             raise TypeError('Scene must be of type Scene')
+        # the replaced scene's shadow atlas and uniform buffers would otherwise stay allocated
+        if self._scene is not None and self._scene is not value:
+            self._scene.delete()
         self._scene = value
         self.init_scene()
 
@@ -94,12 +142,13 @@ class Game:
             caption=self.title,
             config=config,
             resizable=False,
-            visible=True
+            visible=self.options.get('visible', True)
         )
         self.window.set_vsync(True)
         @self.window.event
         def on_close():
             self.running = False
+            self.export_profile()
             self.window.close()
             sys.exit()
 
@@ -125,6 +174,7 @@ class Game:
         internal_data.input_manager = self.input_manager
         internal_data.current_scene = self.scene
         internal_data.uniform_manager = UniformManager()
+        internal_data.render_state = RenderState()
 
     def update_internal_data(self, dt):
         internal_data.delta_time = dt
@@ -133,29 +183,110 @@ class Game:
 
     def update(self, dt):
         self.update_internal_data(dt)
-        self.input_manager.update(dt)
-        self.scene.update()
+        if profiler.enabled:
+            start = profiler.begin()
+            self.input_manager.update(dt)
+            profiler.end('InputManager.update', start)
+        else:
+            self.input_manager.update(dt)
+        self.scene.update(dt)
+
+    def render(self, alpha=None):
+        self.scene.render(alpha)
+
+    def draw_profiler_overlay(self, overlay):
+        if overlay is not None and profiler.enabled:
+            overlay.draw()
+
+    def export_profile(self):
+        if self.profile_trace and profiler.count:
+            profiler.export_chrome_trace(self.profile_trace)
+
+    def run_fixed_steps(self, accumulator, frame_delta, step):
+        accumulator += frame_delta
+        steps = 0
+        while accumulator >= self.fixed_delta_time and steps < self.max_catch_up_steps:
+            step(self.fixed_delta_time)
+            accumulator -= self.fixed_delta_time
+            steps += 1
+        if accumulator >= self.fixed_delta_time:
+            # too far behind to catch up, drop the backlog instead of spiralling
+            accumulator %= self.fixed_delta_time
+        return accumulator, accumulator / self.fixed_delta_time
 
-    def render(self):
-        self.scene.render()
+    def fixed_step(self, dt):
+        profiling = profiler.enabled
+        if profiling:
+            start = profiler.begin()
+        if not self.headless:
+            self.scene.save_interpolation_state()
+        self.update(dt)
+        if profiling:
+            profiler.end('Game.fixed_step', start)
+
+    def step_window(self, win, dt):
+        profiling = profiler.enabled
+        if profiling:
+            start = profiler.begin()
+        internal_data.current_scene = win['scene']
+        internal_data.input_manager = win['input_manager']
+        internal_data.delta_time = dt
+        win['input_manager'].update(dt)
+        if win['scene']:
+            if not self.headless:
+                win['scene'].save_interpolation_state()
+            win['scene'].update(dt)
+        if profiling:
+            profiler.end('Game.step_window', start)
+
+    def run_headless(self, max_steps=None, max_time=None):
+        # steps back to back as fast as possible, without waiting for wall-clock time
+        self.running = True
+        steps = 0
+        start = time.perf_counter()
+        while self.running and (max_steps is None or steps < max_steps):
+            if self.multi_windows:
+                for win in self.windows:
+                    self.step_window(win, self.fixed_delta_time)
+            else:
+                self.fixed_step(self.fixed_delta_time)
+            steps += 1
+            if max_time is not None and time.perf_counter() - start >= max_time:
+                break
+        elapsed = time.perf_counter() - start
+        self.running = False
+        self.simulated_steps = steps
+        self.steps_per_second = steps / elapsed if elapsed > 0 else 0.0
+        self.export_profile()
+        return self.steps_per_second
 
     def run(self):
-        if not self.multi_windows:
+        if self.headless:
+            self.run_headless(self.options.get('max_steps'), self.options.get('max_time'))
+        elif not self.multi_windows:
             self.running = True
             last_time = time.time()
             def update_frame(dt):
                 if not self.running:
                     pyglet.app.exit()
                     return
+                profiling = profiler.enabled
+                if profiling:
+                    start = profiler.begin()
                 now = time.time()
                 delta = now - update_frame.last_time
                 update_frame.last_time = now
-                self.update(delta)
+                self.accumulator, alpha = self.run_fixed_steps(self.accumulator, delta, self.fixed_step)
                 gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-                self.render()
+                self.render(alpha)
+                if profiling:
+                    profiler.end('Game.update_frame', start)
+                    profiler.frames += 1
+                self.draw_profiler_overlay(self.profiler_overlay)
             update_frame.last_time = time.time()
             pyglet.clock.schedule_interval(update_frame, 1.0 / self.fps)
             pyglet.app.run()
+            self.export_profile()
         else:
             self.running = True
             last_times = [time.time() for _ in self.windows]
@@ -168,21 +299,28 @@ class Game:
                     delta = now - last_times[idx]
                     last_times[idx] = now
                     win = self.windows[idx]
+                    profiling = profiler.enabled
+                    if profiling:
+                        start = profiler.begin()
               
                     win['window'].switch_to()
 
                     internal_data.current_scene = win['scene']
                     internal_data.input_manager = win['input_manager']
-                    internal_data.delta_time = delta
     
                     internal_data.uniform_manager = win.get('uniform_manager', None)
-                    win['input_manager'].update(delta)
-                    if win['scene']:
-                        win['scene'].update()
+                    internal_data.render_state = win['render_state']
+
+                    win['accumulator'], alpha = self.run_fixed_steps(win['accumulator'], delta, lambda dt: self.step_window(win, dt))
                     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
                     if win['scene']:
-                        win['scene'].render()
+                        win['scene'].render(alpha)
+                    if profiling:
+                        profiler.end('Game.update_frame', start, win['options'].get('title'))
+                        profiler.frames += 1
+                    self.draw_profiler_overlay(win['profiler_overlay'])
                 return update_frame
             for idx, win in enumerate(self.windows):
                 pyglet.clock.schedule_interval(make_update_frame(idx), 1.0 / win['options']['fps'])
             pyglet.app.run()
+            self.export_profile()
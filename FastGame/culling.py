@@ -0,0 +1,89 @@
+import numpy as np
+from .game_objects import SkyBox
+from .transform_pool import get_shared_pool
+
+
+def get_frustum_planes(projection_view):
+    # rows of a row-major projection * view give the clip planes, w +- x, y, z
+    rows = np.asarray(projection_view, dtype=np.float32)
+    planes = np.array([
+        rows[3] + rows[0],
+        rows[3] - rows[0],
+        rows[3] + rows[1],
+        rows[3] - rows[1],
+        rows[3] + rows[2],
+        rows[3] - rows[2],
+    ], dtype=np.float32)
+    planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+    return planes
+
+
+def get_box_mask(bounds, planes):
+    # world space boxes, min and max corners, that reach inside every plane
+    bounds = np.asarray(bounds, dtype=np.float32).reshape(-1, 2, 3)
+    centers = (bounds[:, 0] + bounds[:, 1]) / 2
+    extents = (bounds[:, 1] - bounds[:, 0]) / 2
+    distances = centers @ planes[:, :3].T + planes[:, 3]
+    return np.all(distances >= -(extents @ np.abs(planes[:, :3]).T), axis=1)
+
+
+class FrustumCuller:
+    def __init__(self):
+        self.visible_count = 0
+        self.culled_count = 0
+
+    def get_world_matrices(self, game_objects):
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            return pool.world_matrices[indices]
+        return np.array([game_object.transform.get_global_model_array() for game_object in game_objects], dtype=np.float32)
+
+    def get_visible_mask(self, game_objects, planes, models=None):
+        if models is None:
+            models = self.get_world_matrices(game_objects)
+        # most objects share a handful of meshes, gather their bounds once
+        meshes = {}
+        mesh_indices = np.array([meshes.setdefault(id(game_object.mesh.mesh), (len(meshes), game_object.mesh.mesh))[0]
+                                 for game_object in game_objects], dtype=np.int64)
+        unique_meshes = [mesh for _, mesh in meshes.values()]
+        bounds = np.array([mesh.bounds for mesh in unique_meshes], dtype=np.float32)[mesh_indices]
+        sphere_centers = np.array([mesh.bounding_center for mesh in unique_meshes], dtype=np.float32)[mesh_indices]
+        sphere_radii = np.array([mesh.bounding_radius for mesh in unique_meshes], dtype=np.float32)[mesh_indices]
+
+        linear = models[:, :3, :3]
+        translation = models[:, :3, 3]
+        normals = planes[:, :3]
+        distances = planes[:, 3]
+
+        # world aabb of the transformed local box
+        box_centers = np.einsum('nij,nj->ni', linear, (bounds[:, 0] + bounds[:, 1]) / 2) + translation
+        box_extents = np.einsum('nij,nj->ni', np.abs(linear), (bounds[:, 1] - bounds[:, 0]) / 2)
+        box_distances = box_centers @ normals.T + distances
+        box_radii = box_extents @ np.abs(normals).T
+        inside_box = np.all(box_distances >= -box_radii, axis=1)
+
+        # world sphere, the radius grows with the largest axis scale
+        centers = np.einsum('nij,nj->ni', linear, sphere_centers) + translation
+        radii = sphere_radii * np.linalg.norm(linear, axis=1).max(axis=1)
+        inside_sphere = np.all(centers @ normals.T + distances >= -radii[:, None], axis=1)
+
+        # the two bounds are conservative in different ways, an object has to pass both
+        return inside_box & inside_sphere
+
+    def cull(self, game_objects, camera):
+        if camera is None:
+            self.visible_count = len(game_objects)
+            self.culled_count = 0
+            return game_objects
+        candidates = [game_object for game_object in game_objects
+                      if not isinstance(game_object, SkyBox) and game_object.mesh.mesh is not None]
+        if len(candidates) == 0:
+            visible = game_objects
+        else:
+            projection_view = camera.lens.get_projection_matrix() @ np.array(camera.transform.get_global_view_matrix(), dtype=np.float32)
+            mask = self.get_visible_mask(candidates, get_frustum_planes(projection_view))
+            culled = {id(game_object) for game_object, inside in zip(candidates, mask.tolist()) if not inside}
+            visible = [game_object for game_object in game_objects if id(game_object) not in culled]
+        self.visible_count = len(visible)
+        self.culled_count = len(game_objects) - len(visible)
+        return visible
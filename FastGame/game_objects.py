@@ -5,6 +5,10 @@ class GameObject:
         self.transform = Transform(game_object=self)
 
         self.parent = None
+        self.scene = None
+        self._static = False
+        # the object managers holding this object, more than one when it is shared between scenes
+        self._managers = []
         
         self.objects = ObjectManager(parent=self)
         
@@ -14,11 +18,23 @@ class GameObject:
         self.components.start_lock = True
         self.components.add('transform', self.transform)
         
+    @property
+    def static(self):
+        return self._static
+    
+    @static.setter
+    def static(self, value):
+        # static objects are merged into their scene's static batches, moving one afterwards
+        # only shows once it is marked static again
+        self._static = bool(value)
+        internal_data.static_version += 1
+        
     def start(self):
         self.components.start_lock = False
         self.components.start()
         self.objects.start()
-        self.renderer.setup()
+        if not internal_data.headless:
+            self.renderer.setup()
 
     def update(self):
         self.components.update()
@@ -30,83 +46,161 @@ class GameObject:
 
 class ObjectManager:
     def __init__(self, parent=None):
-        self._objects = []
+        # direct children in insertion order, dicts double as ordered sets
+        self._children = {}
+        # _children as a list, rebuilt on first use after a change
+        self._objects = None
         self.parent = parent
+        self.scene = None
         self.start_lock = False
+        # indexes over the whole subtree, kept up to date by add and remove. names only have
+        # to be unique within the manager an object is added to, so a name can map to several
+        self._by_name = {}
+        self._by_type = {}
+        self._flat = None
+        self._queries = {}
+        self.version = 0
         
     def add(self, game_object):
         if not isinstance(game_object, GameObject):
             raise TypeError('Object type must be GameObject')
-        if self.get(game_object.name) is not None:
+        if game_object.name in self._by_name:
             raise ValueError('Object name is used')
+        subtree = [game_object] + game_object.objects.get_all(GameObject)
         if isinstance(game_object, Camera):
             if len(self.get_all(Camera)) > 0:
                 raise ValueError('Only one camera is allowed')
             self._camera = game_object
 
-        self._objects.append(game_object)
+        self._children[game_object] = None
+        self._objects = None
+        game_object._managers.append(self)
+        self._index_subtree(subtree)
         if self.parent is not None:
             game_object.parent = self.parent
+            game_object.transform.invalidate()
+        scene = self.get_scene()
+        if scene is not None:
+            scene.register(game_object)
         if not self.start_lock:
             game_object.start()
+    
+    def get_scene(self):
+        return self.scene if self.parent is None else self.parent.scene
+    
+    def get_ancestor_managers(self):
+        managers = []
+        pending = [self]
+        while pending:
+            manager = pending.pop()
+            managers.append(manager)
+            if manager.parent is not None:
+                pending.extend(manager.parent._managers)
+        return managers
+    
+    def _index_subtree(self, subtree):
+        for manager in self.get_ancestor_managers():
+            for obj in subtree:
+                manager._by_name.setdefault(obj.name, {})[obj] = None
+                manager._by_type.setdefault(type(obj), {})[obj] = None
+            manager._hierarchy_changed()
+    
+    def _unindex_subtree(self, subtree):
+        for manager in self.get_ancestor_managers():
+            for obj in subtree:
+                named = manager._by_name.get(obj.name)
+                if named is not None:
+                    named.pop(obj, None)
+                    if not named:
+                        del manager._by_name[obj.name]
+                objects = manager._by_type.get(type(obj))
+                if objects is not None:
+                    objects.pop(obj, None)
+                    if not objects:
+                        del manager._by_type[type(obj)]
+            manager._hierarchy_changed()
+    
+    def _hierarchy_changed(self):
+        self._flat = None
+        self._queries = {}
+        self.version += 1
         
     def update(self):
-        for game_object in self._objects:
+        for game_object in self.get_all():
             game_object.update()
             
     def start(self):
-        for game_object in self._objects:
+        for game_object in self.get_all():
             game_object.start()
         
     def get(self, name):
-        for obj in self._objects:
-            if obj.name == name:
-                return obj
-            if obj.objects.get(name) is not None:
-                return obj
+        named = self._by_name.get(name)
+        return next(iter(named)) if named else None
+    
+    def get_flattened(self):
+        # every object of the subtree in depth-first order, rebuilt only when the hierarchy changes
+        if self._flat is None:
+            flat = []
+            for obj in self.get_all():
+                flat.append(obj)
+                flat.extend(obj.objects.get_flattened())
+            self._flat = flat
+        return self._flat
     
     def get_all(self, class_name=None, except_class_name=None):
+        # the returned lists are cached, callers must not modify them
         if class_name is None:
+            if self._objects is None:
+                self._objects = list(self._children)
             return self._objects
-        game_objects = []
-        for obj in self._objects:
-            if isinstance(obj, class_name):
-                if except_class_name is not None:
-                    if not isinstance(obj, except_class_name):
-                        game_objects.append(obj)
-                else:
-                    game_objects.append(obj)
-            game_objects.extend(obj.objects.get_all(class_name, except_class_name))
+        key = (class_name, except_class_name)
+        game_objects = self._queries.get(key)
+        if game_objects is None:
+            if not any(issubclass(object_type, class_name) for object_type in self._by_type):
+                game_objects = []
+            elif except_class_name is None:
+                game_objects = [obj for obj in self.get_flattened() if isinstance(obj, class_name)]
+            else:
+                game_objects = [obj for obj in self.get_flattened()
+                                if isinstance(obj, class_name) and not isinstance(obj, except_class_name)]
+            self._queries[key] = game_objects
         return game_objects
     
     def remove(self, name):
-        self._objects.pop(name, None)
+        game_object = name if isinstance(name, GameObject) else self.get(name)
+        if game_object is None or game_object not in self._by_name.get(game_object.name, ()):
+            return None
+        # the object may sit in a child's manager, detach it from the one holding it
+        holder = game_object.parent.objects if game_object.parent is not None else self
+        if game_object not in holder._children:
+            return None
+        del holder._children[game_object]
+        holder._objects = None
+        if holder in game_object._managers:
+            game_object._managers.remove(holder)
+        holder._unindex_subtree([game_object] + game_object.objects.get_all(GameObject))
+        if getattr(holder, '_camera', None) is game_object:
+            holder._camera = None
+        scene = holder.get_scene()
+        if scene is not None:
+            scene.unregister(game_object)
+        if holder.parent is not None:
+            game_object.parent = None
+            game_object.transform.invalidate()
+        return game_object
         
     def remove_all(self, class_name):
-        for obj in self._objects:
-            if isinstance(obj, class_name):
-                self._objects.pop(obj)
+        for game_object in list(self.get_all(class_name)):
+            self.remove(game_object)
                 
     def sort_backtofront(self, game_objects):
-        camera = self.get_all(Camera)[0]
-        length = len(game_objects)
-        for i in range(length):  
-            distance1 = game_objects[i].transform.get_distance_from(camera.transform.get_position())
-            for j in range(i+1, length):
-                distance2=  game_objects[i].transform.get_distance_from(camera.transform.get_position())
-                if distance1 > distance2:
-                    game_objects[i], game_objects[j] = game_objects[j], game_objects[i]
+        camera_position = self.get_all(Camera)[0].transform.get_global_position()
+        game_objects.sort(key=lambda game_object: glm.distance(game_object.transform.get_global_position(), camera_position), reverse=True)
         return game_objects
     
     def sort_fronttoback(self, game_objects):
-        camera = self.get_all(Camera)[0]
-        length = len(game_objects)
-        for i in range(length):  
-            distance1 = game_objects[i].transform.get_distance_from(camera.transform.get_position())
-            for j in range(i+1, length):
-                distance2=  game_objects[i].transform.get_distance_from(camera.transform.get_position())
-                if distance1 < distance2:
-                    game_objects[i], game_objects[j] = game_objects[j], game_objects[i]
+        camera_position = self.get_all(Camera)[0].transform.get_global_position()
+        game_objects.sort(key=lambda game_object: glm.distance(game_object.transform.get_global_position(), camera_position))
         return game_objects
     
     def get_transparent_opaque_objects(self, except_class_name=None):
@@ -123,8 +217,11 @@ class ObjectManager:
         
         
 class VisibleGameObject(GameObject):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, asynchronous=False, **kwargs):
         super().__init__(*args, **kwargs)
+        # meshes and textures load on worker threads, placeholders are drawn meanwhile
+        self.asynchronous = asynchronous
+        self.cast_shadows = True
         self.mesh = Mesh(game_object=self)
         self.material = Material(game_object=self)
         self.texture = Texture(game_object=self)
@@ -144,35 +241,36 @@ class InVisibleGameObject(GameObject):
 class Cuboid(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mesh.mesh = MeshParser('meshes/cuboid.obj')
+        self.mesh.load('meshes/cuboid.obj', self.asynchronous)
         
 
 
 class Plane(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mesh.mesh = MeshParser('meshes/plane.obj')
+        self.mesh.load('meshes/plane.obj', self.asynchronous)
        
 
 
 class Sphere(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mesh.mesh = MeshParser('meshes/sphere.obj')
+        self.mesh.load('meshes/sphere.obj', self.asynchronous)
        
 
 
 class Cylinder(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mesh.mesh  =  MeshParser('meshes/cylinder.obj')
+        self.mesh.load('meshes/cylinder.obj', self.asynchronous)
 
 
 class SkyBox(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.cast_shadows = False
         self.texture  =  SkyBoxTexture(game_object=self)
-        self.mesh.mesh = MeshParser('meshes/cuboid.obj')
+        self.mesh.load('meshes/cuboid.obj', self.asynchronous)
         
         self.components.add('texture', self.texture)
         
@@ -180,7 +278,7 @@ class SkyBox(VisibleGameObject):
 class FootballGoal(VisibleGameObject):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.mesh.mesh  =  MeshParser('meshes/football_goal.obj')
+        self.mesh.load('meshes/football_goal.obj', self.asynchronous)
       
 
 class Light(InVisibleGameObject):
@@ -189,6 +287,8 @@ class Light(InVisibleGameObject):
 
 
 class DirectionalLight(Light):
+    block_array = 'directional_light'
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
@@ -202,6 +302,8 @@ class DirectionalLight(Light):
 
 
 class PointLight(Light):
+    block_array = 'point_light'
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
@@ -213,12 +315,15 @@ class PointLight(Light):
         
         
 class SpotLight(Light):
+    block_array = 'spot_light'
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
         self.transform = SpotLightTransform(game_object=self)
         self.light_source = SpotLightSource(game_object=self)
-        self.shadows = LightSourceShadow(game_object=self, perspective=True)
+        # shadowed spot lights are shaded for every fragment instead of per cluster, so they are opt-in
+        self.shadows = LightSourceShadow(game_object=self, perspective=True, enabled=False)
 
         self.components.add('transform', self.transform)
         self.components.add('light_source', self.light_source)
@@ -256,4 +361,7 @@ class Text(GameObject):
 from .components import *
 from .renderer import Renderer
 from .mesh_parser import MeshParser
-from .shader import Shader
\ No newline at end of file
+from .mesh_registry import mesh_registry
+from .shader import Shader
+from . import internal_data
+from pyglm import glm
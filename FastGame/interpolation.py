@@ -0,0 +1,56 @@
+import numpy as np
+from pyglm import glm
+
+
+def capture_transforms(transforms):
+    if transforms and all(transform._pool is transforms[0]._pool for transform in transforms) and transforms[0]._pool is not None:
+        pool = transforms[0]._pool
+        indices = np.array([transform._pool_index for transform in transforms], dtype=np.int64)
+        return pool.positions[indices].copy(), pool.rotations[indices].copy()
+    positions = np.array([transform.get_position() for transform in transforms], dtype=np.float32).reshape(-1, 3)
+    rotations = np.array([transform.get_rotation() for transform in transforms], dtype=np.float32).reshape(-1, 4)
+    return positions, rotations
+
+
+class TransformInterpolator:
+    # blends the last two simulation states so rendering can run at its own rate
+    def __init__(self):
+        self.transforms = []
+        self.previous_positions = None
+        self.previous_rotations = None
+        self._restore = None
+
+    def save(self, transforms):
+        self.transforms = list(transforms)
+        self.previous_positions, self.previous_rotations = capture_transforms(self.transforms)
+
+    def apply(self, alpha):
+        if self.previous_positions is None or len(self.transforms) == 0:
+            return
+        positions, rotations = capture_transforms(self.transforms)
+        moved = np.nonzero(np.any(positions != self.previous_positions, axis=1) |
+                           np.any(rotations != self.previous_rotations, axis=1))[0]
+        if len(moved) == 0:
+            return
+
+        blended_positions = self.previous_positions[moved] + (positions[moved] - self.previous_positions[moved]) * alpha
+        # nlerp along the shorter arc is close enough to slerp for one step
+        previous_rotations = self.previous_rotations[moved]
+        current_rotations = rotations[moved]
+        signs = np.where(np.sum(previous_rotations * current_rotations, axis=1) < 0, -1.0, 1.0)[:, None]
+        blended_rotations = previous_rotations + (current_rotations * signs - previous_rotations) * alpha
+        blended_rotations /= np.linalg.norm(blended_rotations, axis=1, keepdims=True)
+
+        self._restore = (moved, positions[moved], rotations[moved])
+        self._write(moved, blended_positions, blended_rotations)
+
+    def restore(self):
+        if self._restore is not None:
+            self._write(*self._restore)
+            self._restore = None
+
+    def _write(self, indices, positions, rotations):
+        for index, position, rotation in zip(indices.tolist(), positions.tolist(), rotations.tolist()):
+            transform = self.transforms[index]
+            transform.set_position(glm.vec3(*position))
+            transform.set_rotation(glm.quat(*rotation))
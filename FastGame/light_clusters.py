@@ -0,0 +1,226 @@
+import math
+import numpy as np
+from OpenGL.GL import *
+
+
+CLUSTER_GRID = (16, 9, 24)
+CLUSTERED_LIGHT_MAX_NUM = 1024
+# a light stops counting where its attenuated brightness falls under this
+LIGHT_THRESHOLD = 1.0 / 256.0
+
+# rgba32f texels per light: position + constant, color + linear, direction + quadratic,
+# cutOff + outerCutOff + is spot + range, shadow index
+LIGHT_TEXELS = 5
+
+LIGHT_DATA_UNIT = 3
+LIGHT_GRID_UNIT = 4
+LIGHT_INDICES_UNIT = 5
+
+
+def light_ranges(constant, linear, quadratic, intensity, threshold=LIGHT_THRESHOLD):
+    # distance where intensity / (constant + linear * d + quadratic * d^2) reaches the threshold
+    k = intensity / threshold - constant
+    with np.errstate(divide='ignore', invalid='ignore'):
+        quadratic_range = (-linear + np.sqrt(linear * linear + 4 * quadratic * k)) / (2 * quadratic)
+        linear_range = k / linear
+    ranges = np.where(quadratic > 0, quadratic_range, np.where(linear > 0, linear_range, np.inf))
+    return np.where(k > 0, ranges, 0.0)
+
+
+def bounding_spheres(positions, directions, ranges, outer_cutoffs, is_spot):
+    # spheres around each point light's range and each spot light's cone
+    centers = positions.copy()
+    radii = ranges.copy()
+    cos_angle = np.clip(outer_cutoffs, 1e-4, 1.0)
+    wide = is_spot & (cos_angle < math.sqrt(0.5)) & (outer_cutoffs > 0)
+    narrow = is_spot & (cos_angle >= math.sqrt(0.5))
+    sin_angle = np.sqrt(1 - cos_angle * cos_angle)
+    centers[wide] += directions[wide] * (cos_angle[wide] * ranges[wide])[:, None]
+    radii[wide] = sin_angle[wide] * ranges[wide]
+    half_cone = ranges[narrow] / (2 * cos_angle[narrow])
+    centers[narrow] += directions[narrow] * half_cone[:, None]
+    radii[narrow] = half_cone
+    return centers, radii
+
+
+class LightClusters:
+    # forward+ light lists per view-space cluster, read by default.frag from texture buffers
+    def __init__(self, grid=CLUSTER_GRID, max_lights=CLUSTERED_LIGHT_MAX_NUM):
+        self.grid = grid
+        self.max_lights = max_lights
+        self.threshold = LIGHT_THRESHOLD
+        self.buffers = None
+        self.textures = None
+        self.light_count = 0
+        self.shadowed_count = 0
+        self.index_count = 0
+        self.slice_scale = 0.0
+        self.slice_bias = 0.0
+        self.logarithmic = True
+        # x, y, width, height in framebuffer pixels, which is what gl_FragCoord counts
+        self.viewport = (0, 0, 1, 1)
+        x, y, z = grid
+        self.cluster_ranges = np.zeros((z * y * x, 2), dtype=np.uint32)
+        self.light_indices = np.zeros(1, dtype=np.uint32)
+        self.light_data = np.zeros((1, LIGHT_TEXELS, 4), dtype=np.float32)
+
+    def generate(self):
+        from . import internal_data
+        self.delete()
+        self.buffers = [int(buffer) for buffer in glGenBuffers(3)]
+        self.textures = [int(texture) for texture in glGenTextures(3)]
+        for buffer, texture, gl_format in zip(self.buffers, self.textures, (GL_RGBA32F, GL_RG32UI, GL_R32UI)):
+            glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+            glBufferData(GL_TEXTURE_BUFFER, 16, None, GL_STREAM_DRAW)
+            internal_data.render_state.bind_texture(LIGHT_DATA_UNIT, GL_TEXTURE_BUFFER, texture)
+            glTexBuffer(GL_TEXTURE_BUFFER, gl_format, buffer)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+
+    def pack(self, lights, shadow_indices=None):
+        # the light records in texel order, plus what binning needs from them
+        if shadow_indices is None:
+            shadow_indices = {}
+        # shadow casting lights go first, the shader walks them on their own
+        lights = sorted(lights[:self.max_lights], key=lambda light: id(light) not in shadow_indices)
+        self.shadowed_count = sum(1 for light in lights if id(light) in shadow_indices)
+        count = len(lights)
+        data = np.zeros((max(count, 1), LIGHT_TEXELS, 4), dtype=np.float32)
+        for index, light in enumerate(lights):
+            values = {}
+            for component in light.renderer.get_rendered_components():
+                values.update(component.set_block_uniforms())
+            row = data[index]
+            row[0, :3] = values['position']
+            row[0, 3] = values['constant']
+            row[1, :3] = values['color']
+            row[1, 3] = values['linear']
+            row[2, 3] = values['quadratic']
+            if 'direction' in values:
+                row[2, :3] = values['direction']
+                row[3] = (values['cutOff'], values['outerCutOff'], 1.0, 0.0)
+            row[4, 0] = shadow_indices.get(id(light), -1)
+        self.light_data = data
+        self.light_count = count
+        return data[:count]
+
+    def set_depth_slices(self, lens):
+        slices = self.grid[2]
+        self.logarithmic = lens.perspective
+        if lens.perspective:
+            self.slice_scale = slices / math.log(lens.far / lens.near)
+            self.slice_bias = slices * math.log(lens.near) / math.log(lens.far / lens.near)
+        else:
+            self.slice_scale = slices / (lens.far - lens.near)
+            self.slice_bias = lens.near * self.slice_scale
+
+    def get_slices(self, depths):
+        if self.logarithmic:
+            depths = np.log(np.maximum(depths, 1e-4))
+        return np.clip(np.floor(depths * self.slice_scale - self.slice_bias), 0, self.grid[2] - 1).astype(np.int64)
+
+    def get_light_bounds(self, data, view, projection, lens):
+        # inclusive cluster ranges per light, lights touching no cluster are dropped
+        grid_x, grid_y, grid_z = self.grid
+        is_spot = data[:, 3, 2] > 0.5
+        intensity = data[:, 1, :3].max(axis=1)
+        ranges = light_ranges(data[:, 0, 3], data[:, 1, 3], data[:, 2, 3], intensity, self.threshold)
+        ones = np.ones((len(data), 1), dtype=np.float32)
+        view_positions = np.hstack([data[:, 0, :3], ones]) @ view.T
+        # an unbounded light still only has to reach the far plane
+        ranges = np.minimum(ranges, np.linalg.norm(view_positions[:, :3], axis=1) + lens.far)
+        # the shader cuts lights off at the same range, so lighting doesn't depend on the binning
+        data[:, 3, 3] = ranges
+        view_directions = data[:, 2, :3] @ view[:3, :3].T
+        centers, radii = bounding_spheres(view_positions[:, :3], view_directions, ranges, data[:, 3, 1], is_spot)
+
+        nearest = -centers[:, 2] - radii
+        farthest = -centers[:, 2] + radii
+        keep = (radii > 0) & (farthest >= lens.near) & (nearest <= lens.far)
+
+        corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float32)
+        points = centers[:, None, :] + corners[None, :, :] * radii[:, None, None]
+        clip = np.concatenate([points, np.ones(points.shape[:2] + (1,), dtype=np.float32)], axis=2) @ projection.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ndc = clip[:, :, :2] / clip[:, :, 3:4]
+        low = np.nan_to_num(ndc.min(axis=1), nan=-1.0)
+        high = np.nan_to_num(ndc.max(axis=1), nan=1.0)
+        # spheres reaching behind the near plane can cover any tile
+        crossing = nearest <= lens.near
+        low[crossing] = -1.0
+        high[crossing] = 1.0
+        keep &= (high > -1).all(axis=1) & (low < 1).all(axis=1)
+
+        tiles = np.array([grid_x, grid_y])
+        tile_low = np.clip(np.floor((low * 0.5 + 0.5) * tiles), 0, tiles - 1).astype(np.int64)
+        tile_high = np.clip(np.floor((high * 0.5 + 0.5) * tiles), 0, tiles - 1).astype(np.int64)
+        slice_low = self.get_slices(np.maximum(nearest, lens.near))
+        slice_high = self.get_slices(np.minimum(farthest, lens.far))
+        return keep, tile_low, tile_high, slice_low, slice_high
+
+    def bin(self, data, camera):
+        grid_x, grid_y, grid_z = self.grid
+        cluster_count = grid_x * grid_y * grid_z
+        if camera is None or len(data) == 0:
+            self.cluster_ranges[:] = 0
+            self.light_indices = np.zeros(1, dtype=np.uint32)
+            self.index_count = 0
+            return
+        lens = camera.lens
+        self.set_depth_slices(lens)
+        view = np.array(camera.transform.get_global_view_matrix(), dtype=np.float32)
+        projection = lens.get_projection_matrix()
+        keep, tile_low, tile_high, slice_low, slice_high = self.get_light_bounds(data, view, projection, lens)
+        keep[:self.shadowed_count] = False
+
+        # lights x clusters membership, transposed so nonzero walks it cluster by cluster
+        x = np.arange(grid_x)
+        y = np.arange(grid_y)
+        z = np.arange(grid_z)
+        in_x = (x >= tile_low[:, 0:1]) & (x <= tile_high[:, 0:1])
+        in_y = (y >= tile_low[:, 1:2]) & (y <= tile_high[:, 1:2])
+        in_z = (z >= slice_low[:, None]) & (z <= slice_high[:, None])
+        members = in_z[:, :, None, None] & in_y[:, None, :, None] & in_x[:, None, None, :] & keep[:, None, None, None]
+        members = members.reshape(len(data), cluster_count).T
+        clusters, lights = np.nonzero(members)
+        counts = np.bincount(clusters, minlength=cluster_count)
+        self.cluster_ranges[:, 0] = np.cumsum(counts) - counts
+        self.cluster_ranges[:, 1] = counts
+        self.index_count = len(lights)
+        self.light_indices = lights.astype(np.uint32) if len(lights) else np.zeros(1, dtype=np.uint32)
+
+    def update(self, camera, lights, shadow_indices=None):
+        # the window size is logical and shared between windows, the viewport is this framebuffer's
+        self.viewport = tuple(int(value) for value in glGetIntegerv(GL_VIEWPORT))
+        data = self.pack(lights, shadow_indices)
+        self.bin(data, camera)
+        self.upload()
+
+    def upload(self):
+        from . import internal_data
+        for buffer, array in zip(self.buffers, (self.light_data, self.cluster_ranges, self.light_indices)):
+            glBindBuffer(GL_TEXTURE_BUFFER, buffer)
+            # respecifying the store lets the driver hand out fresh memory instead of waiting on last frame
+            glBufferData(GL_TEXTURE_BUFFER, array.nbytes, array, GL_STREAM_DRAW)
+        glBindBuffer(GL_TEXTURE_BUFFER, 0)
+        for texture, unit in zip(self.textures, (LIGHT_DATA_UNIT, LIGHT_GRID_UNIT, LIGHT_INDICES_UNIT)):
+            internal_data.render_state.bind_texture(unit, GL_TEXTURE_BUFFER, texture)
+
+    def get_block_values(self):
+        grid_x, grid_y, grid_z = self.grid
+        x, y, width, height = self.viewport
+        return {
+            'clustered_light_num': self.light_count,
+            'shadowed_light_num': self.shadowed_count,
+            'cluster_grid': (grid_x, grid_y, grid_z, 0),
+            'cluster_depth': (self.slice_scale, self.slice_bias, 1.0 if self.logarithmic else 0.0, 0.0),
+            'cluster_tile_size': (width / grid_x, height / grid_y, x, y),
+        }
+
+    def delete(self):
+        from . import internal_data
+        if self.buffers is not None:
+            glDeleteBuffers(3, np.array(self.buffers, dtype=np.uint32))
+            glDeleteTextures(3, np.array(self.textures, dtype=np.uint32))
+            internal_data.render_state.invalidate()
+        self.buffers = None
+        self.textures = None
@@ -0,0 +1,144 @@
+import os
+import sys
+import struct
+import hashlib
+import threading
+import numpy as np
+
+
+CACHE_EXTENSION = '.fgmesh'
+CACHE_MAGIC = b'FGMESH\x00\x00'
+CACHE_VERSION = 1
+# magic, version, flags, vertex count, index count, source size, source mtime, source sha1, bounds
+CACHE_HEADER = struct.Struct('<8sIIIIQq20s6f')
+CACHE_DATA_OFFSET = 128
+VERTEX_SIZE = 8
+
+FLAG_3D = 1
+
+
+def cache_path(source_path):
+    return os.path.splitext(source_path)[0] + CACHE_EXTENSION
+
+
+def source_info(source_path):
+    stat = os.stat(source_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def source_digest(source_path):
+    with open(source_path, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+def refresh_header(path, header):
+    # the source content still matches, the new mtime spares later starts the hash
+    try:
+        with open(path, 'r+b') as f:
+            f.write(header)
+    except OSError:
+        pass
+
+
+def read_header(path, header_struct):
+    # the unpacked header, or None when there is no complete one
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        header = f.read(header_struct.size)
+    if len(header) < header_struct.size:
+        return None
+    return header_struct.unpack(header)
+
+
+def source_matches(path, source_path, size, mtime, digest, pack_header):
+    # pack_header(mtime) gives the cache's header with another source mtime
+    current_size, current_mtime = source_info(source_path)
+    if current_size != size:
+        return False
+    # checkouts and copies touch the mtime without changing the content
+    if current_mtime != mtime:
+        if source_digest(source_path) != digest:
+            return False
+        refresh_header(path, pack_header(current_mtime))
+    return True
+
+
+def write_cache_file(path, header, arrays, data_offset=CACHE_DATA_OFFSET):
+    # loader threads may write the same file, each through its own temporary
+    temp_path = f'{path}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(header.ljust(data_offset, b'\x00'))
+            for array in arrays:
+                f.write(array.tobytes())
+        os.replace(temp_path, path)
+    except OSError:
+        # a read-only asset directory only costs us the cache
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def read_mesh_cache(source_path):
+    path = cache_path(source_path)
+    header = read_header(path, CACHE_HEADER)
+    if header is None:
+        return None
+    magic, version, flags, vertex_count, index_count, size, mtime, digest, *bounds = header
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or vertex_count == 0 or index_count == 0:
+        return None
+    # a truncated file can't be mapped, it is parsed again instead
+    if os.path.getsize(path) != CACHE_DATA_OFFSET + vertex_count * VERTEX_SIZE * 4 + index_count * 4:
+        return None
+
+    if not source_matches(path, source_path, size, mtime, digest,
+                          lambda mtime: CACHE_HEADER.pack(magic, version, flags, vertex_count, index_count, size, mtime, digest, *bounds)):
+        return None
+
+    vertices = np.memmap(path, dtype=np.float32, mode='r', offset=CACHE_DATA_OFFSET, shape=(vertex_count, VERTEX_SIZE))
+    indices = np.memmap(path, dtype=np.int32, mode='r', offset=CACHE_DATA_OFFSET + vertices.nbytes, shape=(index_count // 3, 3))
+    return {
+        'vertices': vertices,
+        'indices': indices,
+        'bounds': np.array(bounds, dtype=np.float32).reshape(2, 3),
+        'is_3d': bool(flags & FLAG_3D),
+    }
+
+
+def write_mesh_cache(source_path, vertices, indices, bounds, is_3d):
+    path = cache_path(source_path)
+    vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+    indices = np.ascontiguousarray(indices, dtype=np.int32)
+    size, mtime = source_info(source_path)
+    header = CACHE_HEADER.pack(
+        CACHE_MAGIC, CACHE_VERSION, FLAG_3D if is_3d else 0,
+        len(vertices), indices.size, size, mtime, source_digest(source_path),
+        *np.asarray(bounds, dtype=np.float32).reshape(-1)
+    )
+    return write_cache_file(path, header, (vertices, indices))
+
+
+def build_mesh_cache(directory=None, force=False):
+    from .mesh_parser import MeshParser
+    if directory is None:
+        directory = os.path.join(os.path.dirname(__file__), 'meshes')
+    built = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.lower().endswith('.obj'):
+            continue
+        source_path = os.path.abspath(os.path.join(directory, filename))
+        if not force and read_mesh_cache(source_path) is not None:
+            continue
+        mesh = MeshParser()
+        mesh.parse(source_path)
+        if write_mesh_cache(source_path, mesh.vertices, mesh.indices, mesh.bounds, mesh.is_3d):
+            built.append(cache_path(source_path))
+    return built
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    for path in build_mesh_cache(args[0] if args else None, force='--force' in sys.argv):
+        print(f"built {path}")
@@ -1,43 +1,66 @@
 import os
 import numpy as np
-import trimesh
-from trimesh.exchange.obj import load_obj
+from .mesh_cache import read_mesh_cache, write_mesh_cache
 
 class MeshParser:
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, use_cache=True):
         self.vertex_positions = np.array([], dtype=np.float32)
         self.texture_coords = np.array([], dtype=np.float32)
         self.normals = np.array([], dtype=np.float32)
         self.indices = np.array([], dtype=np.int32)
         self.vertices = np.array([], dtype=np.float32)
+        self.bounds = np.zeros((2, 3), dtype=np.float32)
+        self.bounding_center = np.zeros(3, dtype=np.float32)
+        self.bounding_radius = 0.0
         self.is_3d = True
-        
+        self.use_cache = use_cache
+
         if filename:
             self.load(filename)
-    
+
     def load(self, filename):
         full_path = os.path.join(os.path.dirname(__file__), filename)
-        
+
+        if self.use_cache:
+            cached = read_mesh_cache(full_path)
+            if cached is not None:
+                self.set_vertices(cached['vertices'], cached['indices'], cached['bounds'], cached['is_3d'])
+                return
+
+        self.parse(full_path)
+        if self.use_cache:
+            write_mesh_cache(full_path, self.vertices, self.indices, self.bounds, self.is_3d)
+
+    def parse(self, full_path):
+        import trimesh
+
         mesh = trimesh.load(full_path, force='mesh', process=False)
-        self.vertex_positions = mesh.vertices.astype(np.float32)
-        self.indices = mesh.faces.astype(np.int32)
-        self.normals = mesh.vertex_normals.astype(np.float32)
-        
-        bounds_min, bounds_max = mesh.bounds
-        if bounds_max[1] == bounds_min[1]:
-            self.is_3d = False
-        else:
-            self.is_3d = True
-        
+        positions = mesh.vertices.astype(np.float32)
+        normals = mesh.vertex_normals.astype(np.float32)
+
         if hasattr(mesh.visual, 'uv') and mesh.visual.uv is not None and not np.allclose(mesh.visual.uv, 0):
-            self.texture_coords = mesh.visual.uv.astype(np.float32)
+            texture_coords = mesh.visual.uv.astype(np.float32)
+        else:
+            texture_coords = np.zeros((len(positions), 2), dtype=np.float32)
+
+        vertices = np.zeros((len(positions), 8), dtype=np.float32)
+        vertices[:, 0:3] = positions
+        vertices[:len(texture_coords), 3:5] = texture_coords[:len(positions)]
+        vertices[:len(normals), 5:8] = normals[:len(positions)]
+
+        bounds = np.array(mesh.bounds, dtype=np.float32)
+        self.set_vertices(vertices, mesh.faces.astype(np.int32), bounds, bounds[1][1] != bounds[0][1])
+
+    def set_vertices(self, vertices, indices, bounds, is_3d):
+        self.vertices = vertices
+        self.indices = indices
+        self.vertex_positions = vertices[:, 0:3]
+        self.texture_coords = vertices[:, 3:5]
+        self.normals = vertices[:, 5:8]
+        self.bounds = bounds
+        self.bounding_center = (bounds[0] + bounds[1]) / 2
+        if len(vertices):
+            self.bounding_radius = float(np.sqrt(((self.vertex_positions - self.bounding_center) ** 2).sum(axis=1).max()))
         else:
-            self.texture_coords = np.zeros((len(self.vertex_positions), 2), dtype=np.float32)
-        
-        vertices_list = []
-        for i, pos in enumerate(mesh.vertices):
-            tex = self.texture_coords[i] if i < len(self.texture_coords) else [0.0, 0.0]
-            norm = self.normals[i] if i < len(self.normals) else [0.0, 0.0, 0.0]
-            combined = np.concatenate((pos, tex, norm))
-            vertices_list.append(combined)
-        self.vertices = np.array(vertices_list, dtype=np.float32)
+            self.bounding_radius = 0.0
+        self.is_3d = bool(is_3d)
@@ -0,0 +1,91 @@
+import os
+import hashlib
+import numpy as np
+from OpenGL.GL import *
+from .mesh_parser import MeshParser
+
+
+class MeshBuffers:
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.VBO = None
+        self.EBO = None
+        self.index_size = 0
+        self.ref_count = 0
+
+    def upload(self):
+        vertices = self.mesh.vertices.reshape(-1)
+        indices = self.mesh.indices.reshape(-1)
+        self.VBO = glGenBuffers(1)
+        self.EBO = glGenBuffers(1)
+        # buffer objects are typeless, uploading the indices through GL_ARRAY_BUFFER
+        # keeps the currently bound VAO untouched
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, self.EBO)
+        glBufferData(GL_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.index_size = len(indices)
+
+    def delete(self):
+        if self.VBO:
+            glDeleteBuffers(1, np.array([self.VBO], dtype=np.uint32))
+        if self.EBO:
+            glDeleteBuffers(1, np.array([self.EBO], dtype=np.uint32))
+        self.VBO = None
+        self.EBO = None
+
+
+class MeshRegistry:
+    def __init__(self):
+        self._hashes = {}
+        self._meshes = {}
+        self._buffers = {}
+
+    def resolve_path(self, filename):
+        return os.path.join(os.path.dirname(__file__), filename)
+
+    def content_hash(self, full_path):
+        stat = os.stat(full_path)
+        cached = self._hashes.get(full_path)
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with open(full_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._hashes[full_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def get(self, filename):
+        digest = self.content_hash(self.resolve_path(filename))
+        mesh = self._meshes.get(digest)
+        if mesh is None:
+            # loader threads parsing the same file keep whichever finished first
+            mesh = self._meshes.setdefault(digest, MeshParser(filename))
+        return mesh
+
+    def acquire_buffers(self, mesh):
+        if not isinstance(mesh, MeshParser):
+            raise TypeError("mesh type must be MeshParser")
+        buffers = self._buffers.get(id(mesh))
+        if buffers is None:
+            buffers = MeshBuffers(mesh)
+            buffers.upload()
+            self._buffers[id(mesh)] = buffers
+        buffers.ref_count += 1
+        return buffers
+
+    def release_buffers(self, buffers):
+        buffers.ref_count -= 1
+        if buffers.ref_count <= 0:
+            self._buffers.pop(id(buffers.mesh), None)
+            buffers.delete()
+
+    def clear(self):
+        for buffers in self._buffers.values():
+            buffers.delete()
+        self._buffers.clear()
+        self._meshes.clear()
+        self._hashes.clear()
+
+
+mesh_registry = MeshRegistry()
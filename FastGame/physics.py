@@ -0,0 +1,179 @@
+import numpy as np
+from pyglm import glm
+from .transform_pool import get_shared_pool
+
+
+BODY_VECTOR_FIELDS = ('velocity', 'acceleration', 'gravity')
+BODY_SCALAR_FIELDS = ('mass', 'friction', 'bounciness', 'linear_damping', 'angular_damping', 'use_gravity')
+
+
+class BodyArrays:
+    # structure of arrays holding one row per rigid body
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.bodies = []
+        self.velocity = np.zeros((capacity, 3), dtype=np.float32)
+        self.acceleration = np.zeros((capacity, 3), dtype=np.float32)
+        self.gravity = np.zeros((capacity, 3), dtype=np.float32)
+        self.mass = np.ones(capacity, dtype=np.float32)
+        self.friction = np.zeros(capacity, dtype=np.float32)
+        self.bounciness = np.zeros(capacity, dtype=np.float32)
+        self.linear_damping = np.zeros(capacity, dtype=np.float32)
+        self.angular_damping = np.zeros(capacity, dtype=np.float32)
+        self.use_gravity = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        capacity = 2 * len(self.mass)
+        for field in BODY_VECTOR_FIELDS + BODY_SCALAR_FIELDS:
+            old = getattr(self, field)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, field, new)
+
+    def add(self, body):
+        if self.count == len(self.mass):
+            self._grow()
+        index = self.count
+        old_arrays, old_index = body._arrays, body._index
+        for field in BODY_VECTOR_FIELDS + BODY_SCALAR_FIELDS:
+            getattr(self, field)[index] = getattr(old_arrays, field)[old_index]
+        self.bodies.append(body)
+        self.count += 1
+        body._arrays = self
+        body._index = index
+
+    def remove(self, body):
+        index = body._index
+        last = self.count - 1
+        # hand the row back to a store of its own
+        own = BodyArrays(capacity=1)
+        own.add(body)
+        if index != last:
+            for field in BODY_VECTOR_FIELDS + BODY_SCALAR_FIELDS:
+                array = getattr(self, field)
+                array[index] = array[last]
+            moved = self.bodies[last]
+            self.bodies[index] = moved
+            moved._index = index
+        self.bodies.pop()
+        self.count -= 1
+
+
+class BodyField:
+    def __init__(self, scalar=False):
+        self.scalar = scalar
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, body, owner=None):
+        if body is None:
+            return self
+        value = getattr(body._arrays, self.name)[body._index]
+        return value.item() if self.scalar else value
+
+    def __set__(self, body, value):
+        getattr(body._arrays, self.name)[body._index] = value
+
+
+class PhysicsWorld:
+    def __init__(self, delta_time=1.0 / 60.0):
+        self.delta_time = delta_time
+        self.arrays = BodyArrays()
+        # bodies stored by another scene's world, stepped here through gather and scatter
+        self.shared_bodies = []
+        self.steps = 0
+
+    @property
+    def bodies(self):
+        return self.arrays.bodies + self.shared_bodies
+
+    def add(self, body):
+        if body._world is self or body in self.shared_bodies:
+            return
+        if body._world is None:
+            self.arrays.add(body)
+            body._world = self
+        else:
+            self.shared_bodies.append(body)
+
+    def remove(self, body):
+        if body in self.shared_bodies:
+            self.shared_bodies.remove(body)
+        elif body._world is self:
+            self.arrays.remove(body)
+            body._world = None
+
+    def clear(self):
+        for body in self.bodies:
+            self.remove(body)
+
+    def gather(self, field):
+        own = getattr(self.arrays, field)[:self.arrays.count]
+        if not self.shared_bodies:
+            return own
+        shared = np.array([getattr(body._arrays, field)[body._index] for body in self.shared_bodies], dtype=own.dtype)
+        return np.concatenate([own, shared.reshape((-1,) + own.shape[1:])])
+
+    def scatter(self, field, values):
+        count = self.arrays.count
+        getattr(self.arrays, field)[:count] = values[:count]
+        for body, value in zip(self.shared_bodies, values[count:]):
+            getattr(body._arrays, field)[body._index] = value
+
+    def get_positions(self, game_objects):
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            return pool.positions[indices].copy()
+        return np.array([game_object.transform.get_position() for game_object in game_objects], dtype=np.float32).reshape(-1, 3)
+
+    def set_positions(self, game_objects, positions):
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            pool.positions[indices] = positions
+            pool.mark_dirty()
+            return
+        for game_object, position in zip(game_objects, positions.tolist()):
+            game_object.transform.set_position(glm.vec3(*position))
+
+    def integrate(self, dt):
+        velocity = self.gather('velocity')
+        acceleration = self.gather('acceleration')
+        use_gravity = self.gather('use_gravity')
+        acceleration = acceleration + np.where(use_gravity[:, None], self.gather('gravity'), 0)
+        velocity += acceleration * dt
+        velocity *= (1.0 - self.gather('linear_damping') * dt)[:, None]
+        self.scatter('velocity', velocity)
+        return velocity
+
+    def step(self, collision_world=None):
+        dt = self.delta_time
+        bodies = self.bodies
+        if bodies:
+            velocity = self.integrate(dt)
+        if collision_world is not None:
+            # the broadphase sweeps the bodies by the velocities they will move with
+            collision_world.step()
+        if not bodies:
+            self.steps += 1
+            return
+
+        game_objects = [body.game_object for body in bodies]
+        current = self.get_positions(game_objects)
+        new_positions = current + velocity * dt
+
+        free = np.ones(len(bodies), dtype=bool)
+        if collision_world is not None:
+            for index, body in enumerate(bodies):
+                collider = body.game_object.components.get('collider')
+                if collider is not None and collision_world.get_candidates(collider):
+                    free[index] = False
+        free_indices = np.nonzero(free)[0]
+        self.set_positions([game_objects[index] for index in free_indices], new_positions[free_indices])
+
+        # contacts go body by body since each impulse changes the bodies after it
+        for index in np.nonzero(~free)[0].tolist():
+            bodies[index].resolve_collisions(current[index], dt, collision_world)
+
+        self.scatter('acceleration', np.zeros((len(bodies), 3), dtype=np.float32))
+        self.steps += 1
@@ -0,0 +1,156 @@
+import json
+import time
+import numpy as np
+
+
+class Profiler:
+    # nested spans in a preallocated ring buffer, call sites check enabled before timing anything
+    def __init__(self, capacity=1 << 16):
+        self.enabled = False
+        self.capacity = capacity
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.durations = np.zeros(capacity, dtype=np.int64)
+        self.names = np.zeros(capacity, dtype=np.int32)
+        self.targets = np.full(capacity, -1, dtype=np.int32)
+        self.depths = np.zeros(capacity, dtype=np.int16)
+        self.count = 0
+        self.frames = 0
+        self._depth = 0
+        self._labels = []
+        self._label_ids = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self._depth = 0
+
+    def clear(self):
+        self.count = 0
+        self.frames = 0
+        self._depth = 0
+
+    def intern(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            label_id = len(self._labels)
+            self._labels.append(label)
+            self._label_ids[label] = label_id
+        return label_id
+
+    def begin(self):
+        self._depth += 1
+        return time.perf_counter_ns()
+
+    def end(self, name, start, target=None):
+        end = time.perf_counter_ns()
+        self._depth -= 1
+        index = self.count % self.capacity
+        self.starts[index] = start
+        self.durations[index] = end - start
+        self.names[index] = self.intern(name)
+        self.targets[index] = -1 if target is None else self.intern(target)
+        self.depths[index] = self._depth
+        self.count += 1
+
+    def lap(self, name, start, target=None):
+        # closes one phase and opens the next at the same depth
+        self.end(name, start, target)
+        return self.begin()
+
+    def get_span_indices(self, last=None):
+        # ring positions from oldest to newest, in the order the spans ended
+        stored = min(self.count, self.capacity)
+        if last is not None:
+            stored = min(stored, last)
+        return (np.arange(self.count - stored, self.count) % self.capacity).astype(np.int64)
+
+    def get_self_times(self, indices):
+        # a span's own time is its duration minus its children's, which always end before it
+        self_times = self.durations[indices].copy()
+        child_time = {}
+        for position, depth in enumerate(self.depths[indices].tolist()):
+            children = child_time.pop(depth + 1, 0)
+            self_times[position] -= children
+            child_time[depth] = child_time.get(depth, 0) + int(self.durations[indices[position]])
+        return self_times
+
+    def get_hotspots(self, count=10, last=None):
+        indices = self.get_span_indices(last)
+        totals = {}
+        for name, target, self_time in zip(self.names[indices].tolist(), self.targets[indices].tolist(),
+                                           self.get_self_times(indices).tolist()):
+            key = (name, target)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [self_time, 1]
+            else:
+                total[0] += self_time
+                total[1] += 1
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:count]
+        return [{'name': self._labels[name], 'target': None if target < 0 else self._labels[target],
+                 'self_ms': total / 1e6, 'calls': calls} for (name, target), (total, calls) in ranked]
+
+    def get_totals_by(self, field='name', last=None):
+        # self time per span name, or per object with field='target'
+        indices = self.get_span_indices(last)
+        keys = (self.names if field == 'name' else self.targets)[indices].tolist()
+        totals = {}
+        for key, self_time in zip(keys, self.get_self_times(indices).tolist()):
+            if key >= 0:
+                totals[self._labels[key]] = totals.get(self._labels[key], 0) + self_time / 1e6
+        return totals
+
+    def export_chrome_trace(self, path):
+        # trace-event JSON, load it in chrome://tracing or Perfetto
+        indices = self.get_span_indices()
+        events = []
+        for start, duration, name, target in zip(self.starts[indices].tolist(), self.durations[indices].tolist(),
+                                                 self.names[indices].tolist(), self.targets[indices].tolist()):
+            event = {'name': self._labels[name], 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000, 'pid': 0, 'tid': 0}
+            if target >= 0:
+                event['args'] = {'object': self._labels[target]}
+            events.append(event)
+        events.sort(key=lambda event: event['ts'])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return len(events)
+
+
+class ProfilerOverlay:
+    # the top hotspots as text in a window corner, refreshed a few times a second
+    def __init__(self, profiler, count=8, interval=0.5, x=10, y=10, font_size=11):
+        self.profiler = profiler
+        self.count = count
+        self.interval = interval
+        self.x = x
+        self.y = y
+        self.font_size = font_size
+        self.label = None
+        self._last_refresh = 0.0
+        self._last_count = 0
+
+    def get_text(self):
+        spans = self.profiler.count - self._last_count
+        self._last_count = self.profiler.count
+        lines = ['self ms  calls  span']
+        for hotspot in self.profiler.get_hotspots(self.count, last=spans):
+            target = f" [{hotspot['target']}]" if hotspot['target'] else ''
+            lines.append(f"{hotspot['self_ms']:7.2f} {hotspot['calls']:6d}  {hotspot['name']}{target}")
+        return '\n'.join(lines)
+
+    def draw(self):
+        import pyglet
+        now = time.perf_counter()
+        if self.label is None:
+            self.label = pyglet.text.Label('', font_name='Courier New', font_size=self.font_size, x=self.x, y=self.y,
+                                           anchor_x='left', anchor_y='bottom', multiline=True, width=600,
+                                           color=(255, 255, 0, 255))
+        if now - self._last_refresh >= self.interval:
+            self._last_refresh = now
+            self.label.text = self.get_text()
+        self.label.draw()
+
+
+profiler = Profiler()
@@ -0,0 +1,128 @@
+import numpy as np
+from .game_objects import SkyBox
+from .transform_pool import get_shared_pool
+
+
+PASS_OPAQUE = 0
+PASS_SKYBOX = 1
+PASS_TRANSPARENT = 2
+
+PASS_BITS = 2
+SHADER_BITS = 8
+TEXTURE_BITS = 12
+MESH_BITS = 12
+DEPTH_BITS = 30
+
+PASS_SHIFT = 64 - PASS_BITS
+# opaque draws: pass | shader | texture | mesh | depth (front to back)
+OPAQUE_SHADER_SHIFT = PASS_SHIFT - SHADER_BITS
+OPAQUE_TEXTURE_SHIFT = OPAQUE_SHADER_SHIFT - TEXTURE_BITS
+OPAQUE_MESH_SHIFT = OPAQUE_TEXTURE_SHIFT - MESH_BITS
+# transparent draws: pass | inverted depth (back to front) | shader | texture | mesh
+TRANSPARENT_DEPTH_SHIFT = PASS_SHIFT - DEPTH_BITS
+TRANSPARENT_SHADER_SHIFT = TRANSPARENT_DEPTH_SHIFT - SHADER_BITS
+TRANSPARENT_TEXTURE_SHIFT = TRANSPARENT_SHADER_SHIFT - TEXTURE_BITS
+TRANSPARENT_MESH_SHIFT = TRANSPARENT_TEXTURE_SHIFT - MESH_BITS
+
+DEPTH_MAX = (1 << DEPTH_BITS) - 1
+
+
+class RenderQueue:
+    def __init__(self, reuse_order=True):
+        self.reuse_order = reuse_order
+        self.game_objects = []
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.order = np.zeros(0, dtype=np.int64)
+        self.reused_order = False
+        self._passes = {PASS_OPAQUE: [], PASS_SKYBOX: [], PASS_TRANSPARENT: []}
+        self._slot_ids = {}
+
+    def get_slot_id(self, value, bits):
+        slots = self._slot_ids.setdefault(bits, {})
+        slot = slots.get(value)
+        if slot is None:
+            slot = len(slots) & ((1 << bits) - 1)
+            slots[value] = slot
+        return slot
+
+    def get_pass(self, game_object):
+        if isinstance(game_object, SkyBox):
+            return PASS_SKYBOX
+        if game_object.material.alpha < 1:
+            return PASS_TRANSPARENT
+        return PASS_OPAQUE
+
+    def get_state(self, game_object, shader):
+        texture = game_object.texture
+        return (
+            self.get_slot_id(shader, SHADER_BITS),
+            self.get_slot_id(texture._texture_id if texture.active else None, TEXTURE_BITS),
+            self.get_slot_id(id(game_object.mesh.mesh), MESH_BITS),
+        )
+
+    def get_depths(self, game_objects, camera):
+        if camera is None or len(game_objects) == 0:
+            return np.zeros(len(game_objects), dtype=np.uint64)
+        camera_position = np.array(camera.transform.get_global_position(), dtype=np.float32)
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            positions = pool.global_positions[indices]
+        else:
+            positions = np.array([game_object.transform.get_global_position() for game_object in game_objects], dtype=np.float32)
+        distances = np.linalg.norm(positions - camera_position, axis=1)
+        depths = np.clip(distances / camera.lens.far, 0.0, 1.0) * DEPTH_MAX
+        return depths.astype(np.uint64)
+
+    def compute_keys(self, game_objects, camera, shader):
+        # slots are handed out again every build, from the states actually drawn. the same
+        # objects in the same order get the same slots, which keeps the previous order reusable
+        self._slot_ids = {}
+        count = len(game_objects)
+        passes = np.empty(count, dtype=np.uint64)
+        states = np.empty((count, 3), dtype=np.uint64)
+        for i, game_object in enumerate(game_objects):
+            passes[i] = self.get_pass(game_object)
+            states[i] = self.get_state(game_object, shader)
+        depths = self.get_depths(game_objects, camera)
+
+        transparent = passes == PASS_TRANSPARENT
+        shifts = np.where(transparent[:, None],
+                          np.array([TRANSPARENT_SHADER_SHIFT, TRANSPARENT_TEXTURE_SHIFT, TRANSPARENT_MESH_SHIFT], dtype=np.uint64),
+                          np.array([OPAQUE_SHADER_SHIFT, OPAQUE_TEXTURE_SHIFT, OPAQUE_MESH_SHIFT], dtype=np.uint64))
+        keys = passes << np.uint64(PASS_SHIFT)
+        keys |= np.bitwise_or.reduce(states << shifts, axis=1)
+        keys |= np.where(transparent, (np.uint64(DEPTH_MAX) - depths) << np.uint64(TRANSPARENT_DEPTH_SHIFT), depths)
+        return keys
+
+    def build(self, game_objects, camera, shader=None):
+        keys = self.compute_keys(game_objects, camera, shader)
+
+        self.reused_order = False
+        if self.reuse_order and len(keys) == len(self.keys) and game_objects == self.game_objects:
+            # nothing was added or removed, if the old order is still sorted keep it
+            sorted_keys = keys[self.order]
+            if np.all(sorted_keys[1:] >= sorted_keys[:-1]):
+                self.reused_order = True
+        if not self.reused_order:
+            self.order = np.argsort(keys, kind='stable')
+
+        self.game_objects = list(game_objects)
+        self.keys = keys
+        for render_pass in self._passes.values():
+            render_pass.clear()
+        render_passes = (keys[self.order] >> np.uint64(PASS_SHIFT)).tolist()
+        for index, render_pass in zip(self.order.tolist(), render_passes):
+            self._passes[render_pass].append(game_objects[index])
+        return [game_objects[index] for index in self.order]
+
+    @property
+    def opaque(self):
+        return self._passes[PASS_OPAQUE]
+
+    @property
+    def skybox(self):
+        return self._passes[PASS_SKYBOX]
+
+    @property
+    def transparent(self):
+        return self._passes[PASS_TRANSPARENT]
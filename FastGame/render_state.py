@@ -0,0 +1,106 @@
+from OpenGL.GL import *
+
+
+class RenderState:
+    def __init__(self):
+        self._state = {}
+        self._active_texture = None
+        self.state_changes = 0
+        self.elided_state_changes = 0
+        self.binds = 0
+        self.elided_binds = 0
+        self.last_frame_state_changes = 0
+        self.last_frame_elided_state_changes = 0
+        self.last_frame_binds = 0
+        self.last_frame_elided_binds = 0
+
+    def _change(self, key, value):
+        if key in self._state and self._state[key] == value:
+            self.elided_state_changes += 1
+            return False
+        self._state[key] = value
+        self.state_changes += 1
+        return True
+
+    def _bind(self, key, value):
+        if key in self._state and self._state[key] == value:
+            self.elided_binds += 1
+            return False
+        self._state[key] = value
+        self.binds += 1
+        return True
+
+    def enable(self, capability):
+        if self._change(('capability', capability), True):
+            glEnable(capability)
+
+    def disable(self, capability):
+        if self._change(('capability', capability), False):
+            glDisable(capability)
+
+    def set_capability(self, capability, enabled):
+        if enabled:
+            self.enable(capability)
+        else:
+            self.disable(capability)
+
+    def polygon_mode(self, face, mode):
+        if self._change(('polygon_mode', face), mode):
+            glPolygonMode(face, mode)
+
+    def depth_mask(self, flag):
+        if self._change('depth_mask', bool(flag)):
+            glDepthMask(flag)
+
+    def depth_func(self, func):
+        if self._change('depth_func', func):
+            glDepthFunc(func)
+
+    def cull_face(self, mode):
+        if self._change('cull_face', mode):
+            glCullFace(mode)
+
+    def blend_func(self, source, destination):
+        if self._change('blend_func', (source, destination)):
+            glBlendFunc(source, destination)
+
+    def viewport(self, x, y, width, height):
+        if self._change('viewport', (x, y, width, height)):
+            glViewport(x, y, width, height)
+
+    def use_program(self, program_id):
+        if self._bind('program', program_id):
+            glUseProgram(program_id)
+
+    def bind_vertex_array(self, vertex_array):
+        if self._bind('vertex_array', vertex_array):
+            glBindVertexArray(vertex_array)
+
+    def bind_framebuffer(self, framebuffer):
+        if self._bind('framebuffer', framebuffer):
+            glBindFramebuffer(GL_FRAMEBUFFER, framebuffer)
+
+    def active_texture(self, unit):
+        if self._active_texture != unit:
+            glActiveTexture(GL_TEXTURE0 + unit)
+            self._active_texture = unit
+            self.state_changes += 1
+
+    def bind_texture(self, unit, target, texture_id):
+        if self._bind(('texture', unit, target), texture_id):
+            self.active_texture(unit)
+            glBindTexture(target, texture_id)
+
+    def invalidate(self):
+        self._state.clear()
+        self._active_texture = None
+
+    def end_frame(self):
+        self.last_frame_state_changes = self.state_changes
+        self.last_frame_elided_state_changes = self.elided_state_changes
+        self.last_frame_binds = self.binds
+        self.last_frame_elided_binds = self.elided_binds
+        self.state_changes = 0
+        self.elided_state_changes = 0
+        self.binds = 0
+        self.elided_binds = 0
@@ -1,13 +1,90 @@
 from .game_objects import GameObject, VisibleGameObject, SkyBox, DirectionalLight, SpotLight
 from .shader import Shader
-from .components import Transform, Mesh, Material, RenderedComponent
+from .components import Transform, Mesh, Material, Texture, RenderedComponent
 from OpenGL.GL import *
 import numpy as np
 import pygame
 import ctypes
 from . import internal_data
+from .mesh_registry import mesh_registry
+from .transform_pool import get_shared_pool
+from .profiler import profiler
 
 
+MESH_VBO_LAYOUT = {
+    'stride': 8 * ctypes.sizeof(ctypes.c_float),
+    'data': [
+        {
+            'index': 0,
+            'size': 3,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': 0
+        },
+        {
+            'index': 1,
+            'size': 2,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': 3 * ctypes.sizeof(ctypes.c_float)
+        },
+        {
+            'index': 2,
+            'size': 3,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': 5 * ctypes.sizeof(ctypes.c_float)
+        }
+    ]
+}
+
+INSTANCE_DTYPE = np.dtype([
+    ('model', np.float32, (4, 4)),
+    ('color', np.float32, 4),
+    ('material', np.float32, 4),
+])
+
+# the model matrix takes one attribute location per column
+INSTANCE_VBO_LAYOUT = {
+    'stride': INSTANCE_DTYPE.itemsize,
+    'data': [
+        {
+            'index': 3 + column,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': INSTANCE_DTYPE.fields['model'][1] + column * 4 * ctypes.sizeof(ctypes.c_float),
+            'divisor': 1
+        } for column in range(4)
+    ] + [
+        {
+            'index': 7,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': INSTANCE_DTYPE.fields['color'][1],
+            'divisor': 1
+        },
+        {
+            'index': 8,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': INSTANCE_DTYPE.fields['material'][1],
+            'divisor': 1
+        }
+    ]
+}
+
+
+def set_VBO_layout(VBO_layout):
+    stride = VBO_layout['stride']
+    data = VBO_layout['data']
+    for i in data:
+        glVertexAttribPointer(i['index'], i['size'], i['type'], i['normalized'], stride, ctypes.c_void_p(i['offset'] ))
+        glEnableVertexAttribArray(i['index'])
+        if 'divisor' in i:
+            glVertexAttribDivisor(i['index'], i['divisor'])
 
 
 class Renderer:
@@ -20,35 +97,13 @@ class Renderer:
         self.game_object = game_object
         # self.shader = shader
         self.VBO = None
-        self.VAO = None
         self.EBO = None
+        self._mesh_buffers = None
+        # buffers are shared between windows but vertex arrays are not, so there is one per
+        # context, keyed by the context's render state, with the buffers it was last bound to
+        self._vertex_arrays = {}
         
-        self.VBO_layout = {
-            'stride': 8 * ctypes.sizeof(ctypes.c_float),
-            'data': [
-                {
-                    'index': 0,
-                    'size': 3,
-                    'type': GL_FLOAT,
-                    'normalized': GL_FALSE,
-                    'offset': 0
-                },
-                {
-                    'index': 1,
-                    'size': 2,
-                    'type': GL_FLOAT,
-                    'normalized': GL_FALSE,
-                    'offset': 3 * ctypes.sizeof(ctypes.c_float)
-                },
-                {
-                    'index': 2,
-                    'size': 3,
-                    'type': GL_FLOAT,
-                    'normalized': GL_FALSE,
-                    'offset': 5 * ctypes.sizeof(ctypes.c_float)
-                }
-            ]
-        }
+        self.VBO_layout = MESH_VBO_LAYOUT
         
         self._rendered_components = []
         self._mesh_component = None
@@ -56,6 +111,11 @@ class Renderer:
         self._index_size = 0
         
         
+    @property
+    def VAO(self):
+        entry = self._vertex_arrays.get(internal_data.render_state)
+        return entry[0] if entry is not None else None
+        
     def setup(self):
         self.get_rendered_components()
         if isinstance(self.game_object, VisibleGameObject):
@@ -70,7 +130,24 @@ class Renderer:
 
         return self._rendered_components
     
+    def buffers_current(self):
+        # meshes that finish loading later and windows that never ran setup catch up on the next draw
+        entry = self._vertex_arrays.get(internal_data.render_state)
+        return (entry is not None and entry[1] is self._mesh_buffers
+                and self._mesh_buffers.mesh is self._mesh_component.mesh)
+    
     def render(self):
+        if profiler.enabled:
+            start = profiler.begin()
+            self.render_components()
+            profiler.end('Renderer.render', start, self.game_object.name)
+        else:
+            self.render_components()
+
+    def render_components(self):
+        if isinstance(self.game_object, VisibleGameObject) and not self.buffers_current():
+            self.generate_buffers()
+            self.load_buffers()
         
         for component in self._rendered_components:
             component.setup()
@@ -86,9 +163,9 @@ class Renderer:
                 self.set_uniforms(uniforms) 
                 
     def render_directly(self):
-        glBindVertexArray(self.VAO)
+        internal_data.render_state.bind_vertex_array(self.VAO)
         glDrawElements(GL_TRIANGLES, self._index_size, GL_UNSIGNED_INT, None)
-        glBindVertexArray(0)
+        internal_data.draw_calls += 1
         
     def set_component_uniforms(self, component):
         uniforms = component.set_uniforms()
@@ -96,17 +173,33 @@ class Renderer:
             self.set_uniforms(uniforms)
     
     def load_buffers(self):
-        glBindVertexArray(self.VAO)
+        entry = self._vertex_arrays[internal_data.render_state]
+        internal_data.render_state.bind_vertex_array(entry[0])
         glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-        buffers = self._mesh_component.set_buffers()
-        if buffers:
-            self.set_buffers(buffers)
+        self.set_VBO_layout(self.VBO_layout)
+        entry[1] = self._mesh_buffers
+        self._index_size = self._mesh_buffers.index_size
+        internal_data.render_state.bind_vertex_array(0)
 
     def generate_buffers(self):
-        self.VAO = glGenVertexArrays(1)
-        self.VBO = glGenBuffers(1)
-        self.EBO = glGenBuffers(1)
+        if self._mesh_buffers is None or self._mesh_buffers.mesh is not self._mesh_component.mesh:
+            self.acquire_buffers()
+        if internal_data.render_state not in self._vertex_arrays:
+            self._vertex_arrays[internal_data.render_state] = [glGenVertexArrays(1), None]
+    
+    def acquire_buffers(self):
+        self.release_buffers()
+        self._mesh_buffers = mesh_registry.acquire_buffers(self._mesh_component.mesh)
+        self.VBO = self._mesh_buffers.VBO
+        self.EBO = self._mesh_buffers.EBO
+        
+    def release_buffers(self):
+        if self._mesh_buffers is not None:
+            mesh_registry.release_buffers(self._mesh_buffers)
+            self._mesh_buffers = None
+            self.VBO = None
+            self.EBO = None
         
     def set_VBO(self, vertices):
         glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
@@ -127,18 +220,142 @@ class Renderer:
             internal_data.uniform_manager.set(uniform, value)
             
     def set_VBO_layout(self, VBO_layout):
-        stride = VBO_layout['stride']
-        data = VBO_layout['data']
-        for i in data:
-            glVertexAttribPointer(i['index'], i['size'], i['type'], i['normalized'], stride, ctypes.c_void_p(i['offset'] ))
-            glEnableVertexAttribArray(i['index'])
+        set_VBO_layout(VBO_layout)
             
     def __del__(self):
-        if self.VBO:
-            glDeleteBuffers(1, np.array([self.VBO], dtype=np.uint32))
-        if self.EBO:
-            glDeleteBuffers(1, np.array([self.EBO], dtype=np.uint32))
+        self.release_buffers()
+        # only the current context's vertex array can be deleted from here
         if self.VAO:
             glDeleteVertexArrays(1, np.array([self.VAO], dtype=np.uint32))
             
 
+
+
+
+class InstanceBatch:
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.VAO = None
+        self.instance_VBO = None
+        self.instance_data = np.zeros(0, dtype=INSTANCE_DTYPE)
+        self._mesh_buffers = None
+        self._capacity = 0
+
+    def setup(self):
+        self._mesh_buffers = mesh_registry.acquire_buffers(self.mesh)
+        self.VAO = glGenVertexArrays(1)
+        self.instance_VBO = glGenBuffers(1)
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glBindBuffer(GL_ARRAY_BUFFER, self._mesh_buffers.VBO)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._mesh_buffers.EBO)
+        set_VBO_layout(MESH_VBO_LAYOUT)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_VBO)
+        set_VBO_layout(INSTANCE_VBO_LAYOUT)
+        internal_data.render_state.bind_vertex_array(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def load_instances(self, game_objects):
+        count = len(game_objects)
+        if count > len(self.instance_data):
+            self.instance_data = np.zeros(max(count, 2 * len(self.instance_data)), dtype=INSTANCE_DTYPE)
+        data = self.instance_data[:count]
+        pool, indices = get_shared_pool(game_objects)
+        if pool is not None:
+            models = pool.world_matrices[indices]
+        else:
+            models = np.array([game_object.transform.get_global_model_array() for game_object in game_objects], dtype=np.float32)
+        # the matrices are row-major, the attributes expect columns
+        data['model'] = models.transpose(0, 2, 1)
+        data['color'] = [(*game_object.material.color.color_in_rgb, game_object.material.alpha) for game_object in game_objects]
+        data['material'] = [(game_object.material.ambient_light, game_object.material.diffuse_reflection,
+                             game_object.material.specular_reflection, game_object.material.shininess) for game_object in game_objects]
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_VBO)
+        if len(self.instance_data) > self._capacity:
+            self._capacity = len(self.instance_data)
+            glBufferData(GL_ARRAY_BUFFER, self.instance_data.nbytes, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def render(self, game_objects):
+        self.load_instances(game_objects)
+        renderer = game_objects[0].renderer
+        components = [component for component in renderer._rendered_components if not isinstance(component, Transform)]
+        for component in components:
+            component.setup()
+            renderer.set_component_uniforms(component)
+        internal_data.uniform_manager.set('use_instancing', True)
+
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glDrawElementsInstanced(GL_TRIANGLES, self._mesh_buffers.index_size, GL_UNSIGNED_INT, None, len(game_objects))
+        internal_data.draw_calls += 1
+
+        internal_data.uniform_manager.set('use_instancing', False)
+        for component in components:
+            component.post_setup()
+            uniforms = component.post_uniforms()
+            if uniforms:
+                renderer.set_uniforms(uniforms)
+
+    def delete(self):
+        if self._mesh_buffers is not None:
+            mesh_registry.release_buffers(self._mesh_buffers)
+            self._mesh_buffers = None
+        if self.instance_VBO:
+            glDeleteBuffers(1, np.array([self.instance_VBO], dtype=np.uint32))
+            self.instance_VBO = None
+        if self.VAO:
+            glDeleteVertexArrays(1, np.array([self.VAO], dtype=np.uint32))
+            self.VAO = None
+
+
+class InstancedRenderer:
+    INSTANCED_COMPONENTS = (Transform, Mesh, Material, Texture)
+
+    def __init__(self, min_batch_size=2):
+        self.min_batch_size = min_batch_size
+        self.batches = {}
+
+    def can_instance(self, game_object):
+        if not isinstance(game_object, VisibleGameObject) or isinstance(game_object, SkyBox):
+            return False
+        if game_object.material.alpha < 1:
+            return False
+        # anything beyond the stock components may set uniforms the instance data can't carry
+        return all(type(component) in self.INSTANCED_COMPONENTS for component in game_object.renderer._rendered_components)
+
+    def get_batch_key(self, game_object):
+        texture = game_object.texture
+        return (
+            id(game_object.mesh.mesh),
+            texture._texture_id if texture.active else None,
+            texture.repeat_x,
+            texture.repeat_y,
+            game_object.material.wireframe,
+        )
+
+    def render(self, game_objects):
+        groups = {}
+        remaining = []
+        for game_object in game_objects:
+            if self.can_instance(game_object):
+                groups.setdefault(self.get_batch_key(game_object), []).append(game_object)
+            else:
+                remaining.append(game_object)
+
+        for key, group in groups.items():
+            if len(group) < self.min_batch_size:
+                remaining.extend(group)
+                continue
+            batch = self.batches.get(key)
+            if batch is None:
+                batch = InstanceBatch(group[0].mesh.mesh)
+                batch.setup()
+                self.batches[key] = batch
+            batch.render(group)
+        return remaining
+
+    def clear(self):
+        for batch in self.batches.values():
+            batch.delete()
+        self.batches.clear()
@@ -1,13 +1,26 @@
 from .utils import Color
-from .game_objects import GameObject, ObjectManager, InVisibleGameObject, SkyBox, Light, SpotLight, DirectionalLight
+from .game_objects import GameObject, ObjectManager, VisibleGameObject, InVisibleGameObject, SkyBox, Light, SpotLight, DirectionalLight, Camera
 from . import internal_data
 from .shader import Shader
 from .shadow_mapper import ShadowMapper
+from .uniform_buffer import FrameUniforms
+from .renderer import InstancedRenderer
+from .render_queue import RenderQueue
+from .transform_pool import TransformPool
+from .culling import FrustumCuller
+from .static_batching import StaticBatcher
+from .collision import CollisionWorld
+from .physics import PhysicsWorld
+from .interpolation import TransformInterpolator
+from .scheduler import Scheduler
+from .asset_loader import asset_loader
+from .profiler import profiler
+from .components import BoxCollider, RigidBody, Script
 from . import internal_data
 
 
 class Scene:
-    def __init__(self, name, shader, depth_shader):
+    def __init__(self, name, shader, depth_shader, use_transform_pool=False):
         if not isinstance(name, str):
             raise TypeError('Name must be a string')
         if not isinstance(shader, Shader):
@@ -16,41 +29,148 @@ class Scene:
         self.shader = shader
         self.depth_shader = depth_shader
         self.shadow_mapper = ShadowMapper()
+        self.frame_uniforms = FrameUniforms()
+        self.instanced_renderer = InstancedRenderer()
+        self.render_queue = RenderQueue()
+        self.frustum_culler = FrustumCuller()
+        self.static_batcher = StaticBatcher()
+        self.collision_world = CollisionWorld()
+        self.physics_world = PhysicsWorld()
+        self.interpolator = TransformInterpolator()
+        self.scheduler = Scheduler()
+        self.use_interpolation = True
+        self.use_instancing = True
+        self.use_frustum_culling = True
+        self.use_shadows = True
+        self.last_frame_draw_calls = 0
+        self.last_frame_visible_objects = 0
+        self.last_frame_culled_objects = 0
+        self.transform_pool = TransformPool() if use_transform_pool else None
         self.objects = ObjectManager()
+        self.objects.scene = self
         self.objects.start_lock = True
     
-    def render(self):
+    def register(self, game_object):
+        game_object.scene = self
+        if self.transform_pool is not None and game_object.transform._pool is None:
+            self.transform_pool.add(game_object.transform)
+        for component in game_object.components.get_all():
+            self.register_component(component)
+        for child in game_object.objects.get_all():
+            self.register(child)
+    
+    def unregister(self, game_object):
+        for child in game_object.objects.get_all():
+            self.unregister(child)
+        for component in game_object.components.get_all():
+            self.unregister_component(component)
+        if self.transform_pool is not None:
+            self.transform_pool.remove(game_object.transform)
+        if game_object.scene is self:
+            game_object.scene = None
+    
+    def register_component(self, component):
+        if isinstance(component, BoxCollider):
+            self.collision_world.add(component)
+        elif isinstance(component, RigidBody):
+            self.physics_world.add(component)
+        elif isinstance(component, Script):
+            self.scheduler.add(component)
+    
+    def unregister_component(self, component):
+        if isinstance(component, BoxCollider):
+            self.collision_world.remove(component)
+        elif isinstance(component, RigidBody):
+            self.physics_world.remove(component)
+        elif isinstance(component, Script):
+            self.scheduler.remove(component)
+    
+    def save_interpolation_state(self):
+        if self.use_interpolation:
+            # static objects are baked into their batches, blending them does nothing
+            self.interpolator.save([game_object.transform for game_object in self.objects.get_all(GameObject)
+                                    if not game_object.static])
+    
+    def render(self, alpha=None):
+        # draw the objects part way between the last two simulation steps
+        interpolate = self.use_interpolation and alpha is not None
+        if interpolate:
+            self.interpolator.apply(alpha)
+        try:
+            self.render_frame()
+        finally:
+            if interpolate:
+                self.interpolator.restore()
+    
+    def render_frame(self):
+        # pyglet draws (labels, flips) between frames without going through the cache
+        internal_data.render_state.invalidate()
+        profiling = profiler.enabled
+        if profiling:
+            frame_start = profiler.begin()
+            start = profiler.begin()
+        asset_loader.poll()
+        if profiling:
+            start = profiler.lap('AssetLoader.poll', start)
         
-        transparent_objects, opaque_objects = self.objects.get_transparent_opaque_objects(except_class_name=SkyBox)
         invisible_objects = self.objects.get_all(InVisibleGameObject)
+        cameras = self.objects.get_all(Camera)
+        camera = cameras[0] if cameras else None
+        lights = self.objects.get_all(Light)
         
-        transparent_objects = self.objects.sort_backtofront(transparent_objects)
-        opaque_objects = self.objects.sort_fronttoback(opaque_objects)
-        
-        
-        # lights = self.objects.get_all(Light)
-        
-        # self.depth_shader.bind()
-        # self.shadow_mapper.bind_depth_map()
-        # self.shadow_mapper.render(lights, opaque_objects)
-        # self.shadow_mapper.unbind_depth_map()
-        
-        # internal_data.uniform_manager.clear()
+        # static objects are drawn from their merged batches, the rest go through culling and the queue
+        visible_objects = self.static_batcher.update(self.objects.get_all(VisibleGameObject), self.objects.version)
+        if profiling:
+            start = profiler.lap('StaticBatcher.update', start)
+        # objects out of the camera's view still cast into it
+        if self.use_shadows:
+            self.shadow_mapper.render(self.depth_shader, lights, self.get_shadow_casters(visible_objects), self.static_batcher)
+        else:
+            self.shadow_mapper.render(self.depth_shader, [], [])
+        if profiling:
+            start = profiler.lap('ShadowMapper.render', start)
+        if self.use_frustum_culling:
+            visible_objects = self.frustum_culler.cull(visible_objects, camera)
+            self.last_frame_visible_objects = self.frustum_culler.visible_count
+            self.last_frame_culled_objects = self.frustum_culler.culled_count
+        else:
+            self.last_frame_visible_objects = len(visible_objects)
+            self.last_frame_culled_objects = 0
+        if profiling:
+            start = profiler.lap('FrustumCuller.cull', start)
+        self.render_queue.build(visible_objects, camera, self.shader)
+        if profiling:
+            start = profiler.lap('RenderQueue.build', start)
+        opaque_objects = self.render_queue.opaque
+        transparent_objects = self.render_queue.transparent
         
         self.shader.bind()
         
-        # self.shadow_mapper.set_depth_texture(2)
+        self.frame_uniforms.update(camera, lights, self.shadow_mapper.indices)
+        if profiling:
+            start = profiler.lap('FrameUniforms.update', start)
         
         # print(invisible_objects)
         for game_object in invisible_objects:
             if hasattr(game_object, 'renderer'):
                 game_object.render()
 
+        if self.use_instancing:
+            if profiling:
+                start = profiler.lap('Scene.draw', start)
+            opaque_objects = self.instanced_renderer.render(opaque_objects)
+            if profiling:
+                start = profiler.lap('InstancedRenderer.render', start)
+
+        self.static_batcher.render(camera, self.use_frustum_culling)
+        if profiling:
+            start = profiler.lap('StaticBatcher.render', start)
+
         for game_object in opaque_objects:
             if hasattr(game_object, 'renderer'):
                 game_object.render()
                 
-        skybox = self.objects.get_all(SkyBox)
+        skybox = self.render_queue.skybox
         if len(skybox) > 0:
             skybox[0].render()
             
@@ -59,17 +179,61 @@ class Scene:
                 game_object.render()
                 
         
+        if profiling:
+            start = profiler.lap('Scene.draw', start)
         internal_data.uniform_manager.clear()
+        internal_data.uniform_manager.end_frame()
+        self.last_frame_draw_calls = internal_data.draw_calls
+        internal_data.draw_calls = 0
+        internal_data.render_state.end_frame()
+        if profiling:
+            profiler.end('Scene.end_frame', start)
+            profiler.end('Scene.render', frame_start, self.name)
                 
     
+    def get_shadow_casters(self, game_objects):
+        return [game_object for game_object in game_objects
+                if game_object.cast_shadows and game_object.mesh.mesh is not None and game_object.material.alpha >= 1]
+    
     def start(self):
-        self.shader.compile()
-        self.depth_shader.compile()
-        self.shadow_mapper.generate_depth_map()
+        asset_loader.poll()
+        if not internal_data.headless:
+            self.shader.compile()
+            self.depth_shader.compile()
+            self.shadow_mapper.generate()
+            self.frame_uniforms.generate()
         self.objects.start_lock = False
-        self.shader.bind()
+        if not internal_data.headless:
+            self.shader.bind()
         self.objects.start()
+        if not internal_data.headless:
+            self.static_batcher.update(self.objects.get_all(VisibleGameObject), self.objects.version)
         
             
-    def update(self):
+    def delete(self):
+        # GL resources owned by the scene, start generates them again
+        self.shadow_mapper.delete()
+        self.frame_uniforms.delete()
+        self.static_batcher.clear()
+        self.instanced_renderer.clear()
+            
+    def update(self, delta_time=None):
+        if delta_time is not None:
+            self.physics_world.delta_time = delta_time
+        profiling = profiler.enabled
+        if profiling:
+            update_start = profiler.begin()
+            start = profiler.begin()
+        asset_loader.poll()
+        if profiling:
+            start = profiler.lap('AssetLoader.poll', start)
+        self.physics_world.step(self.collision_world)
+        if profiling:
+            start = profiler.lap('PhysicsWorld.step', start)
         self.objects.update()
+        if profiling:
+            start = profiler.lap('ObjectManager.update', start)
+        self.scheduler.update(self.physics_world.delta_time)
+        if profiling:
+            profiler.end('Scheduler.update', start)
+            profiler.end('Scene.update', update_start, self.name)
@@ -0,0 +1,206 @@
+import heapq
+import inspect
+from .profiler import profiler
+
+# tolerance so intervals that are a whole number of steps fire on the expected step
+TIME_EPSILON = 1e-9
+
+
+def get_call_name(call):
+    function = call.coroutine if call.coroutine is not None else call.callback
+    return getattr(function, '__qualname__', type(function).__name__)
+
+
+def get_owner_name(owner):
+    game_object = getattr(owner, 'game_object', None)
+    return game_object.name if game_object is not None else None
+
+
+class ScheduledCall:
+    # handle for a timer, a throttled update or a coroutine, cancelling it drops the entry lazily
+    def __init__(self, callback, delay=0.0, interval=None, frames=False, coroutine=None, owner=None):
+        self.callback = callback
+        self.delay = delay
+        self.interval = interval
+        self.frames = frames
+        self.coroutine = coroutine
+        self.owner = owner
+        self.due = 0.0
+        self.last_time = None
+        self.cancelled = False
+
+    @property
+    def is_coroutine(self):
+        return self.coroutine is not None or inspect.isgeneratorfunction(self.callback)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self):
+        self.time = 0.0
+        self.frame = 0
+        self.calls_last_frame = 0
+        self._sequence = 0
+        # scripts updated every frame, a dict keeps them in registration order
+        self._every_frame = {}
+        # (due time, sequence, call) and (due frame, sequence, call) heaps
+        self._timed = []
+        self._framed = []
+        self._updates = {}
+
+    @property
+    def pending_count(self):
+        return len(self._every_frame) + len(self._timed) + len(self._framed)
+
+    def add(self, script):
+        if script in self._updates or script in self._every_frame:
+            return
+        script._schedulers.append(self)
+        if script._scheduler is None:
+            script._scheduler = self
+            for call in script._calls:
+                if not call.cancelled:
+                    self.schedule(call)
+
+        if not script.has_update():
+            # scripts without an update cost nothing until they set a timer
+            return
+        if inspect.isgeneratorfunction(type(script).update):
+            call = ScheduledCall(script.update, owner=script)
+        elif script.update_interval is not None:
+            call = ScheduledCall(script.update, delay=script.update_interval, interval=script.update_interval, owner=script)
+        elif script.update_frames > 1:
+            call = ScheduledCall(script.update, delay=script.update_frames, interval=script.update_frames, frames=True, owner=script)
+        else:
+            self._every_frame[script] = None
+            return
+        self._updates[script] = call
+        self.schedule(call)
+
+    def remove(self, script):
+        if self not in script._schedulers:
+            return
+        script._schedulers.remove(self)
+        self._every_frame.pop(script, None)
+        call = self._updates.pop(script, None)
+        if call is not None:
+            call.cancel()
+        if script._scheduler is self:
+            for call in script._calls:
+                call.cancel()
+            script._calls = []
+            script._scheduler = None
+
+    def schedule(self, call):
+        self._sequence += 1
+        if call.frames:
+            call.due = self.frame + call.delay
+            heapq.heappush(self._framed, (call.due, self._sequence, call))
+        else:
+            call.due = self.time + call.delay
+            heapq.heappush(self._timed, (call.due, self._sequence, call))
+        if call.last_time is None:
+            call.last_time = self.time
+        return call
+
+    def after(self, delay, callback, owner=None):
+        return self.schedule(ScheduledCall(callback, delay=delay, owner=owner))
+
+    def every(self, interval, callback, owner=None):
+        if interval <= 0:
+            raise ValueError('Timer interval must be positive')
+        return self.schedule(ScheduledCall(callback, delay=interval, interval=interval, owner=owner))
+
+    def start_coroutine(self, coroutine, owner=None):
+        return self.schedule(ScheduledCall(None, coroutine=coroutine, owner=owner))
+
+    def clear(self):
+        for script in list(self._every_frame) + list(self._updates):
+            self.remove(script)
+        self._timed = []
+        self._framed = []
+
+    def update(self, delta_time):
+        self.time += delta_time
+        self.frame += 1
+        calls = 0
+        profiling = profiler.enabled
+        for script in list(self._every_frame):
+            if script in self._every_frame:
+                if profiling:
+                    start = profiler.begin()
+                    script.update()
+                    profiler.end(type(script).__name__, start, get_owner_name(script))
+                else:
+                    script.update()
+                calls += 1
+
+        framed = self._framed
+        while framed and framed[0][0] <= self.frame:
+            call = heapq.heappop(framed)[2]
+            if not call.cancelled:
+                self._run(call)
+                calls += 1
+
+        timed = self._timed
+        while timed and timed[0][0] <= self.time + TIME_EPSILON:
+            call = heapq.heappop(timed)[2]
+            if not call.cancelled:
+                self._run(call)
+                calls += 1
+        self.calls_last_frame = calls
+
+    def _run(self, call):
+        owner = call.owner
+        if owner is not None:
+            # scripts updated less often see the time since their last run
+            owner._delta_time = self.time - call.last_time
+        call.last_time = self.time
+        profiling = profiler.enabled
+        if profiling:
+            start = profiler.begin()
+        try:
+            if call.is_coroutine:
+                self._resume(call)
+                return
+            call.callback()
+        finally:
+            if owner is not None:
+                owner._delta_time = None
+            if profiling:
+                profiler.end(get_call_name(call), start, get_owner_name(owner))
+
+        if call.interval is None or call.cancelled:
+            call.cancelled = True
+            return
+        self._sequence += 1
+        if call.frames:
+            call.due += call.interval
+            heapq.heappush(self._framed, (call.due, self._sequence, call))
+        else:
+            call.due += call.interval
+            if call.due <= self.time + TIME_EPSILON:
+                # never fire more than once a step to catch up
+                call.due = self.time + call.interval
+            heapq.heappush(self._timed, (call.due, self._sequence, call))
+
+    def _resume(self, call):
+        if call.coroutine is None:
+            call.coroutine = call.callback()
+        try:
+            wait = next(call.coroutine)
+        except StopIteration:
+            call.cancelled = True
+            return
+        self._sequence += 1
+        if wait is None or wait <= 0:
+            # a bare yield waits for the next frame
+            call.frames = True
+            call.due = self.frame + 1
+            heapq.heappush(self._framed, (call.due, self._sequence, call))
+        else:
+            call.frames = False
+            call.due = self.time + wait
+            heapq.heappush(self._timed, (call.due, self._sequence, call))
@@ -2,11 +2,67 @@ from OpenGL.GL import *
 import numpy as np  
 import os
 import regex as re
+from .uniform_buffer import UNIFORM_BLOCK_BINDINGS
+from .shader_cache import program_cache, compile_shader, ShaderCompileError
+
+
+def _scalar_setter(function, cast):
+    def upload(location, value):
+        function(location, cast(value))
+    return upload
+
+
+def _vector_setter(function):
+    def upload(location, value):
+        function(location, *value)
+    return upload
+
+
+def _matrix_setter(function):
+    def upload(location, value):
+        # numpy matrices come from pyglm in row-major order
+        transpose = GL_TRUE if isinstance(value, np.ndarray) else GL_FALSE
+        function(location, 1, transpose, np.asarray(value, dtype=np.float32))
+    return upload
+
+
+UNIFORM_SETTERS = {
+    GL_FLOAT: _scalar_setter(glUniform1f, float),
+    GL_FLOAT_VEC2: _vector_setter(glUniform2f),
+    GL_FLOAT_VEC3: _vector_setter(glUniform3f),
+    GL_FLOAT_VEC4: _vector_setter(glUniform4f),
+    GL_INT: _scalar_setter(glUniform1i, int),
+    GL_INT_VEC2: _vector_setter(glUniform2i),
+    GL_INT_VEC3: _vector_setter(glUniform3i),
+    GL_INT_VEC4: _vector_setter(glUniform4i),
+    GL_BOOL: _scalar_setter(glUniform1i, int),
+    GL_FLOAT_MAT2: _matrix_setter(glUniformMatrix2fv),
+    GL_FLOAT_MAT3: _matrix_setter(glUniformMatrix3fv),
+    GL_FLOAT_MAT4: _matrix_setter(glUniformMatrix4fv),
+}
+for _sampler_type in (GL_SAMPLER_2D, GL_SAMPLER_3D, GL_SAMPLER_CUBE, GL_SAMPLER_2D_SHADOW,
+                      GL_SAMPLER_BUFFER, GL_INT_SAMPLER_BUFFER, GL_UNSIGNED_INT_SAMPLER_BUFFER):
+    UNIFORM_SETTERS[_sampler_type] = _scalar_setter(glUniform1i, int)
+
+
+# samplers of different types must never share a texture unit, even when unused
+SAMPLER_UNITS = {
+    'diffuse_texture': 0,
+    'skybox': 1,
+    'shadow_map': 2,
+    'light_data': 3,
+    'light_grid': 4,
+    'light_indices': 5,
+}
 
 
 class UniformManager:
     def __init__(self):
         self._list_key_indexes = {}
+        self.uploads = 0
+        self.elided_uploads = 0
+        self.last_frame_uploads = 0
+        self.last_frame_elided_uploads = 0
     
         
     def set(self, uniform:str, value):
@@ -29,58 +85,35 @@ class UniformManager:
             
     def set_directly(self, uniform_name, value):
         from . import internal_data
-        location = glGetUniformLocation(internal_data.current_shader.program_id, uniform_name)
-        # print(f"Uniform: {uniform_name}, Location: {location}")
-        if isinstance(value, int):
-            glUniform1i(location, value)
-        elif isinstance(value, float):
-            glUniform1f(location, value)
-        elif isinstance(value, bool):
-            glUniform1i(location, int(value))
-        elif isinstance(value, np.ndarray):
-            if value.ndim == 2:
-                if value.shape == (2, 2):
-                    glUniformMatrix2fv(location, 1, GL_TRUE, value)
-                elif value.shape == (3, 3):
-                    glUniformMatrix3fv(location, 1, GL_TRUE, value)
-                elif value.shape == (4, 4):
-                    glUniformMatrix4fv(location, 1, GL_TRUE, value)
-                else:
-                    raise ValueError("Unsupported matrix shape: " + str(value.shape))
-            elif value.ndim == 1:
-                if value.shape[0] == 2:
-                    glUniform2f(location, *value)
-                elif value.shape[0] == 3:
-                    glUniform3f(location, *value)
-                elif value.shape[0] == 4:
-                    glUniform4f(location, *value)
-                else:
-                    raise ValueError("Unsupported vector length: " + str(value.shape[0]))
-            else:
-                raise ValueError("Unsupported numpy array dimension: " + str(value.ndim))
-        elif isinstance(value, (list, tuple)):
-            arr = np.array(value)
-            if arr.ndim == 1:
-                if arr.shape[0] == 2:
-                    glUniform2f(location, *arr)
-                elif arr.shape[0] == 3:
-                    glUniform3f(location, *arr)
-                elif arr.shape[0] == 4:
-                    glUniform4f(location, *arr)
-                else:
-                    raise ValueError("Unsupported vector length: " + str(arr.shape[0]))
-            elif arr.ndim == 2:
-                if arr.shape == (2, 2):
-                    glUniformMatrix2fv(location, 1, GL_FALSE, arr)
-                elif arr.shape == (3, 3):
-                    glUniformMatrix3fv(location, 1, GL_FALSE, arr)
-                elif arr.shape == (4, 4):
-                    glUniformMatrix4fv(location, 1, GL_FALSE, arr)
-                else:
-                    raise ValueError("Unsupported matrix shape: " + str(arr.shape))
-        else:
-            raise TypeError("Unsupported uniform type: " + str(type(value)))
+        shader = internal_data.current_shader
+        uniform = shader.uniforms.get(uniform_name)
+        if uniform is None:
+            return
+        location, uniform_type, size = uniform
+        key = self.get_value_key(value)
+        if location in shader.uniform_values and shader.uniform_values[location] == key:
+            self.elided_uploads += 1
+            return
+        upload = UNIFORM_SETTERS.get(uniform_type)
+        if upload is None:
+            raise TypeError("Unsupported uniform type: " + str(uniform_type))
+        upload(location, value)
+        shader.uniform_values[location] = key
+        self.uploads += 1
+        
+    def get_value_key(self, value):
+        if isinstance(value, np.ndarray):
+            return (value.shape, value.tobytes())
+        if isinstance(value, (list, tuple)):
+            return tuple(value)
+        return value
             
+    def end_frame(self):
+        self.last_frame_uploads = self.uploads
+        self.last_frame_elided_uploads = self.elided_uploads
+        self.uploads = 0
+        self.elided_uploads = 0
+        
     def clear(self):
         self._list_key_indexes.clear()
             
@@ -95,7 +128,10 @@ class Shader:
         self.fragement_shader_path = os.path.join(os.path.dirname(__file__), fragment_shader_path)
         self.vertex_shader_source = ''
         self.fragement_shader_source = ''
+        self.program = None
         self.program_id = None
+        self.uniforms = {}
+        self.uniform_values = {}
         # self.compile()
         # self.uniforms = UniformManager(self.program_id)
         
@@ -113,42 +149,63 @@ class Shader:
         self.fragement_shader_source = self.read_shader(self.fragement_shader_path)
         
     def compile_shader(self, source, shader_type):
-        shader_id = glCreateShader(shader_type)
-        glShaderSource(shader_id, source)
-        glCompileShader(shader_id)
-        
-        compile_status = glGetShaderiv(shader_id, GL_COMPILE_STATUS)
-        if not compile_status:
-            info_log = glGetShaderInfoLog(shader_id)
-            shader_type_str = "vertex" if shader_type == GL_VERTEX_SHADER else "fragment"
-            print(f"ERROR: {shader_type_str} shader compilation failed:\n{info_log.decode()}")
-        return shader_id
+        return compile_shader(source, shader_type)
     
     def compile(self):
         self.read_vertex_shader()
         self.read_fragement_shader()
         
-        vertex_shader = self.compile_shader(self.vertex_shader_source, GL_VERTEX_SHADER)
-        fragment_shader = self.compile_shader(self.fragement_shader_source, GL_FRAGMENT_SHADER)
-        
-        self.program_id = glCreateProgram()
-        glAttachShader(self.program_id, vertex_shader)
-        glAttachShader(self.program_id, fragment_shader)
-        glLinkProgram(self.program_id)
+        # identical sources share one program, linked once or loaded from a saved binary
+        program = program_cache.acquire(self.vertex_shader_source, self.fragement_shader_source)
+        if self.program is not None:
+            program_cache.release(self.program)
+        self.program = program
+        self.program_id = program.program_id
+        self.uniforms = program.uniforms
+        self.uniform_values = program.uniform_values
         
-        link_status = glGetProgramiv(self.program_id, GL_LINK_STATUS)
-        if not link_status:
-            info_log = glGetProgramInfoLog(self.program_id)
-            print(f"ERROR: Shader program linking failed:\n{info_log.decode()}")
-        
-        glDeleteShader(vertex_shader)
-        glDeleteShader(fragment_shader)
+        if not program.introspected:
+            self.load_uniforms()
+            self.bind_uniform_blocks()
+            self.bind_sampler_units()
+            program.introspected = True
         
+    def load_uniforms(self):
+        self.uniforms.clear()
+        self.uniform_values.clear()
+        uniform_count = glGetProgramiv(self.program_id, GL_ACTIVE_UNIFORMS)
+        for index in range(uniform_count):
+            name, size, uniform_type = glGetActiveUniform(self.program_id, index)
+            name = name.decode()
+            location = glGetUniformLocation(self.program_id, name)
+            if location < 0:
+                continue
+            self.uniforms[name] = (location, uniform_type, size)
+            if name.endswith('[0]'):
+                base_name = name[:-3]
+                self.uniforms[base_name] = (location, uniform_type, size)
+                for i in range(1, size):
+                    self.uniforms[f'{base_name}[{i}]'] = (location + i, uniform_type, 1)
+    
     
+    def bind_uniform_blocks(self):
+        for block_name, binding in UNIFORM_BLOCK_BINDINGS.items():
+            block_index = glGetUniformBlockIndex(self.program_id, block_name)
+            if block_index != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.program_id, block_index, binding)
+    
+    def bind_sampler_units(self):
+        from . import internal_data
+        internal_data.render_state.use_program(self.program_id)
+        for sampler_name, unit in SAMPLER_UNITS.items():
+            uniform = self.uniforms.get(sampler_name)
+            if uniform is not None:
+                glUniform1i(uniform[0], unit)
+                self.uniform_values[uniform[0]] = unit
     
     def bind(self):
         from . import internal_data
-        glUseProgram(self.program_id)
+        internal_data.render_state.use_program(self.program_id)
         internal_data.current_shader = self
         if hasattr(internal_data, 'uniform_manager'):
             self.uniform_manager = internal_data.uniform_manager
@@ -156,9 +213,13 @@ class Shader:
             self.uniform_manager = None
         
     def unbind(self):
-        glUseProgram(0)
+        from . import internal_data
+        internal_data.render_state.use_program(0)
     
     def delete(self):
-        glDeleteProgram(self.program_id)
+        if self.program is not None:
+            program_cache.release(self.program)
+            self.program = None
+            self.program_id = None
 
 
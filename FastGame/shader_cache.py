@@ -0,0 +1,197 @@
+import os
+import time
+import struct
+import hashlib
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.error import GLError, NullFunctionError
+
+
+CACHE_EXTENSION = '.fgprog'
+CACHE_MAGIC = b'FGPROG\x00\x00'
+CACHE_VERSION = 1
+# magic, version, binary format, binary length, driver sha1
+CACHE_HEADER = struct.Struct('<8sIII20s')
+CACHE_DIRECTORY = os.path.join(os.path.dirname(__file__), 'shaders', 'program_cache')
+
+SHADER_TYPE_NAMES = {GL_VERTEX_SHADER: 'vertex', GL_FRAGMENT_SHADER: 'fragment'}
+
+
+class ShaderCompileError(RuntimeError):
+    pass
+
+
+def source_key(vertex_source, fragment_source):
+    return hashlib.sha1(f'{vertex_source}\0{fragment_source}'.encode()).hexdigest()
+
+
+def driver_key():
+    # binaries only load on the exact driver that produced them
+    parts = [glGetString(name) or b'' for name in (GL_VENDOR, GL_RENDERER, GL_VERSION)]
+    return hashlib.sha1(b'\0'.join(parts)).digest()
+
+
+def compile_shader(source, shader_type):
+    shader_id = glCreateShader(shader_type)
+    glShaderSource(shader_id, source)
+    glCompileShader(shader_id)
+    if not glGetShaderiv(shader_id, GL_COMPILE_STATUS):
+        info_log = glGetShaderInfoLog(shader_id)
+        glDeleteShader(shader_id)
+        raise ShaderCompileError(f"{SHADER_TYPE_NAMES.get(shader_type, shader_type)} shader compilation failed:\n{info_log.decode()}")
+    return shader_id
+
+
+def link_program(vertex_source, fragment_source, retrievable=False):
+    vertex_shader = compile_shader(vertex_source, GL_VERTEX_SHADER)
+    try:
+        fragment_shader = compile_shader(fragment_source, GL_FRAGMENT_SHADER)
+    except ShaderCompileError:
+        glDeleteShader(vertex_shader)
+        raise
+    program_id = glCreateProgram()
+    if retrievable:
+        glProgramParameteri(program_id, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+    glAttachShader(program_id, vertex_shader)
+    glAttachShader(program_id, fragment_shader)
+    glLinkProgram(program_id)
+    glDeleteShader(vertex_shader)
+    glDeleteShader(fragment_shader)
+    if not glGetProgramiv(program_id, GL_LINK_STATUS):
+        info_log = glGetProgramInfoLog(program_id)
+        glDeleteProgram(program_id)
+        raise ShaderCompileError(f"Shader program linking failed:\n{info_log.decode()}")
+    return program_id
+
+
+class ShaderProgram:
+    # one linked program with the uniform table and value cache every Shader using it shares
+    def __init__(self, key, program_id, source):
+        self.key = key
+        self.program_id = program_id
+        self.source = source
+        self.uniforms = {}
+        self.uniform_values = {}
+        self.introspected = False
+        self.ref_count = 0
+
+    def delete(self):
+        if self.program_id:
+            glDeleteProgram(self.program_id)
+        self.program_id = None
+
+
+class ProgramCache:
+    def __init__(self, directory=CACHE_DIRECTORY):
+        self.directory = directory
+        self.use_binaries = True
+        self._programs = {}
+        self._driver_key = None
+        self.memory_hits = 0
+        self.binary_hits = 0
+        self.compiles = 0
+        # (source key, 'memory' / 'binary' / 'source', seconds) per acquire
+        self.load_times = []
+
+    def binaries_supported(self):
+        # the entry points are missing where the driver doesn't expose ARB_get_program_binary
+        return (self.use_binaries and bool(glProgramBinary) and bool(glGetProgramBinary)
+                and glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0)
+
+    def get_driver_key(self):
+        if self._driver_key is None:
+            self._driver_key = driver_key()
+        return self._driver_key
+
+    def binary_path(self, key):
+        return os.path.join(self.directory, f'{key}-{self.get_driver_key().hex()[:16]}{CACHE_EXTENSION}')
+
+    def acquire(self, vertex_source, fragment_source):
+        start = time.perf_counter()
+        key = source_key(vertex_source, fragment_source)
+        program = self._programs.get(key)
+        if program is not None:
+            self.memory_hits += 1
+            source = 'memory'
+        else:
+            binaries = self.binaries_supported()
+            program_id = self.load_binary(key) if binaries else None
+            if program_id is not None:
+                self.binary_hits += 1
+                source = 'binary'
+            else:
+                program_id = link_program(vertex_source, fragment_source, retrievable=binaries)
+                self.compiles += 1
+                source = 'source'
+                if binaries:
+                    self.save_binary(key, program_id)
+            program = ShaderProgram(key, program_id, source)
+            self._programs[key] = program
+        program.ref_count += 1
+        self.load_times.append((key, source, time.perf_counter() - start))
+        return program
+
+    def release(self, program):
+        program.ref_count -= 1
+        if program.ref_count <= 0:
+            self._programs.pop(program.key, None)
+            program.delete()
+
+    def load_binary(self, key):
+        path = self.binary_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) < CACHE_HEADER.size:
+            return None
+        magic, version, binary_format, length, digest = CACHE_HEADER.unpack_from(data)
+        binary = data[CACHE_HEADER.size:]
+        if magic != CACHE_MAGIC or version != CACHE_VERSION or digest != self.get_driver_key() or len(binary) != length:
+            return None
+        program_id = glCreateProgram()
+        try:
+            glProgramBinary(program_id, binary_format, binary, length)
+            linked = glGetProgramiv(program_id, GL_LINK_STATUS)
+        except (GLError, NullFunctionError):
+            linked = False
+        if not linked:
+            # a driver update can reject old binaries or their format, compiling from source replaces the file
+            glDeleteProgram(program_id)
+            return None
+        return program_id
+
+    def save_binary(self, key, program_id):
+        length = glGetProgramiv(program_id, GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return False
+        binary = np.zeros(length, dtype=np.uint8)
+        written = np.zeros(1, dtype=np.int32)
+        binary_format = np.zeros(1, dtype=np.uint32)
+        glGetProgramBinary(program_id, length, written, binary_format, binary)
+        path = self.binary_path(key)
+        temp_path = path + '.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, int(binary_format[0]), int(written[0]), self.get_driver_key()))
+                f.write(binary[:written[0]].tobytes())
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        return True
+
+    def clear(self, binaries=False):
+        for program in self._programs.values():
+            program.delete()
+        self._programs.clear()
+        self._driver_key = None
+        if binaries and os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith(CACHE_EXTENSION):
+                    os.remove(os.path.join(self.directory, filename))
+
+
+program_cache = ProgramCache()
@@ -4,7 +4,8 @@ in vec2 tex_coord;
 in vec3 frag_normal;
 in vec3 frag_position;
 in vec3 skyboxTexCoords;
-in vec4 frag_pos_light_space;
+flat in vec4 frag_material_color;
+flat in vec4 frag_material_params;
 
 out vec4 FragColor;
 
@@ -16,80 +17,108 @@ struct Material {
     float shininess;
 };
 
+// member order keeps the std140 layout tight, see uniform_buffer.py
 struct DirLight {
     vec3 direction;
     vec3 color;
+    int shadow;
 };
 
 struct PointLight {
     vec3 position;
-    vec3 color;
     float constant;
+    vec3 color;
     float linear;
     float quadratic;
 };
 
 struct SpotLight {
     vec3 position;
-    vec3 direction;
-    vec3 color;
     float constant;
+    vec3 direction;
     float linear;
+    vec3 color;
     float quadratic;
     float cutOff;
     float outerCutOff;
 };
 
-const int POINT_LIGHT_MAX_NUM = 50;
-const int SPOT_LIGHT_MAX_NUM = 50;
 const int DIRECTIONAL_LIGHT_MAX_NUM = 1;
+const int SHADOW_MAX_NUM = 16;
+const int LIGHT_TEXELS = 5;
+
+layout(std140, row_major) uniform CameraBlock {
+    mat4 view;
+    mat4 projection;
+    vec3 view_position;
+    bool perspective_projection;
+};
 
-uniform int directional_light_num;
-uniform int point_light_num;
-uniform int spot_light_num;
+layout(std140) uniform LightBlock {
+    int directional_light_num;
+    int clustered_light_num;
+    int shadowed_light_num;
+    ivec4 cluster_grid;
+    // slice scale, slice bias, logarithmic slices
+    vec4 cluster_depth;
+    // tile width and height, viewport origin
+    vec4 cluster_tile_size;
+    DirLight directional_light[DIRECTIONAL_LIGHT_MAX_NUM];
+};
 
-uniform DirLight directional_light[DIRECTIONAL_LIGHT_MAX_NUM];
-uniform PointLight point_light[POINT_LIGHT_MAX_NUM];
-uniform SpotLight spot_light[SPOT_LIGHT_MAX_NUM];
+// squares of the shadow atlas, see shadow_mapper.py
+layout(std140, row_major) uniform ShadowBlock {
+    mat4 shadow_matrix[SHADOW_MAX_NUM];
+    vec4 shadow_rect[SHADOW_MAX_NUM];
+    // bias
+    vec4 shadow_params[SHADOW_MAX_NUM];
+};
+
+// point and spot lights, binned per view-space cluster on the CPU, see light_clusters.py
+uniform samplerBuffer light_data;
+uniform usamplerBuffer light_grid;
+uniform usamplerBuffer light_indices;
 
-uniform Material material;
-uniform vec3 view_position;
+// filled from the per-object uniforms or the instance attributes by the vertex shader
+Material material;
 uniform sampler2D diffuse_texture;
 uniform bool use_texture;
 
 uniform bool use_skybox;
 uniform samplerCube skybox;
 
-uniform sampler2D shadow_map;
+uniform sampler2DShadow shadow_map;
 
 
 
-float ShadowCalculation(vec4 fragPosLightSpace)
+float ShadowCalculation(int index)
 {
+    vec4 fragPosLightSpace = shadow_matrix[index] * vec4(frag_position, 1.0);
     vec3 projCoords = fragPosLightSpace.xyz / fragPosLightSpace.w;
-    projCoords = projCoords * 0.5 + 0.5;
-    float closestDepth = texture(shadow_map, projCoords.xy).r; 
-    float currentDepth = projCoords.z;
-
-    float bias = 0.0002;
-
-    float shadow = 0.0;
+    vec4 rect = shadow_rect[index];
+    // outside the light's square nothing was drawn
+    if (fragPosLightSpace.w <= 0.0 || projCoords.z > 1.0 || any(lessThan(projCoords.xy, rect.xy)) || any(greaterThan(projCoords.xy, rect.zw)))
+        return 0.0;
+    float currentDepth = projCoords.z - shadow_params[index].x;
+
+    // the compare sampler filters 2x2 depth tests per lookup, four lookups cover a 3x3 area.
+    // the filter must not read the neighbouring squares
     vec2 texelSize = 1.0 / textureSize(shadow_map, 0);
-    for(int x = -1; x <= 1; ++x)
+    vec2 low = rect.xy + texelSize;
+    vec2 high = rect.zw - texelSize;
+    float lit = 0.0;
+    for(int x = 0; x < 2; ++x)
     {
-        for(int y = -1; y <= 1; ++y)
+        for(int y = 0; y < 2; ++y)
         {
-            float pcfDepth = texture(shadow_map, projCoords.xy + vec2(x, y) * texelSize).r; 
-            shadow += currentDepth - bias > pcfDepth ? 1.0 : 0.0;        
-        }    
+            vec2 offset = (vec2(x, y) - 0.5) * texelSize;
+            lit += texture(shadow_map, vec3(clamp(projCoords.xy + offset, low, high), currentDepth));
+        }
     }
-    shadow /= 9.0;
-    
-    if(projCoords.z > 1.0)
-        shadow = 0.0;
-    return shadow;
+    return 1.0 - lit / 4.0;
 }
 
+
 vec3 CalcAmbient(vec3 lightColor, float ambientIntensity) {
     return ambientIntensity * lightColor;
 }
@@ -114,7 +143,11 @@ vec3 CalcDirectionalLight(DirLight light, vec3 normal, vec3 viewDir) {
     vec3 diffuse = CalcDiffuse(normal, lightDir, light.color, material.diffuse_reflection);
     vec3 specular = CalcSpecular(normal, lightDir, viewDir, light.color, material.specular_reflection, material.shininess);
     
-    return diffuse + specular;
+    vec3 lighting = diffuse + specular;
+    // unlit fragments skip the shadow lookups
+    if (light.shadow >= 0 && any(greaterThan(lighting, vec3(0.0))))
+        lighting *= 1.0 - ShadowCalculation(light.shadow);
+    return lighting;
 }
 
 
@@ -148,7 +181,60 @@ vec3 CalcSpotLight(SpotLight light, vec3 normal, vec3 viewDir) {
 }
 
 
+vec3 CalcClusteredLights(vec3 normal, vec3 viewDir) {
+    float depth = -(view * vec4(frag_position, 1.0)).z;
+    float slice_depth = cluster_depth.z > 0.5 ? log(max(depth, 1e-4)) : depth;
+    ivec3 cluster = ivec3(ivec2((gl_FragCoord.xy - cluster_tile_size.zw) / cluster_tile_size.xy), int(floor(slice_depth * cluster_depth.x - cluster_depth.y)));
+    cluster = clamp(cluster, ivec3(0), cluster_grid.xyz - 1);
+    uvec2 range = texelFetch(light_grid, (cluster.z * cluster_grid.y + cluster.y) * cluster_grid.x + cluster.x).xy;
+
+    vec3 lighting = vec3(0.0);
+    for (uint i = 0u; i < range.y; i++) {
+        int light = int(texelFetch(light_indices, int(range.x + i)).x) * LIGHT_TEXELS;
+        vec4 position = texelFetch(light_data, light);
+        vec4 cone = texelFetch(light_data, light + 3);
+        // w holds the range where the light fades under the cutoff
+        if (distance(position.xyz, frag_position) > cone.w) {
+            continue;
+        }
+        vec4 color = texelFetch(light_data, light + 1);
+        vec4 direction = texelFetch(light_data, light + 2);
+        if (cone.z > 0.5) {
+            lighting += CalcSpotLight(SpotLight(position.xyz, position.w, direction.xyz, color.w, color.rgb, direction.w, cone.x, cone.y), normal, viewDir);
+        } else {
+            lighting += CalcPointLight(PointLight(position.xyz, position.w, color.rgb, color.w, direction.w), normal, viewDir);
+        }
+    }
+    return lighting;
+}
+
+
+// shadow casting spot lights come first in light_data and are left out of the clusters,
+// every fragment walks the same few, which keeps the shadow block lookups uniform
+vec3 CalcShadowedLights(vec3 normal, vec3 viewDir) {
+    vec3 lighting = vec3(0.0);
+    for (int i = 0; i < shadowed_light_num; i++) {
+        int light = i * LIGHT_TEXELS;
+        vec4 position = texelFetch(light_data, light);
+        vec4 cone = texelFetch(light_data, light + 3);
+        if (distance(position.xyz, frag_position) > cone.w) {
+            continue;
+        }
+        vec4 color = texelFetch(light_data, light + 1);
+        vec4 direction = texelFetch(light_data, light + 2);
+        vec3 spot = CalcSpotLight(SpotLight(position.xyz, position.w, direction.xyz, color.w, color.rgb, direction.w, cone.x, cone.y), normal, viewDir);
+        // unlit fragments skip the shadow lookups
+        if (any(greaterThan(spot, vec3(0.0)))) {
+            spot *= 1.0 - ShadowCalculation(int(texelFetch(light_data, light + 4).x));
+        }
+        lighting += spot;
+    }
+    return lighting;
+}
+
+
 void main() {
+    material = Material(frag_material_color, frag_material_params.x, frag_material_params.y, frag_material_params.z, frag_material_params.w);
 
     if (use_skybox) {
         FragColor = texture(skybox, skyboxTexCoords);
@@ -163,17 +249,12 @@ void main() {
             lighting += CalcDirectionalLight(directional_light[i], norm, viewDir);
         }
         
-        for (int i = 0; i < point_light_num; i++) {
-            lighting += CalcPointLight(point_light[i], norm, viewDir);
-        }
-        
-        for (int i = 0; i < spot_light_num; i++) {
-            lighting += CalcSpotLight(spot_light[i], norm, viewDir);
+        if (clustered_light_num > 0) {
+            lighting += CalcClusteredLights(norm, viewDir);
         }
+        lighting += CalcShadowedLights(norm, viewDir);
 
-        float shadow = ShadowCalculation(frag_pos_light_space); 
         vec3 ambient = CalcAmbient(material.vertex_color.rgb, material.ambient_light);
-        // lighting *= (1-shadow);
         lighting += ambient;
     
         
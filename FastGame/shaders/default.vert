@@ -2,26 +2,49 @@
 layout(location = 0) in vec3 a_vertex_position;
 layout(location = 1) in vec2 a_texture_coordinate;
 layout(location = 2) in vec3 a_vertex_normal;
+layout(location = 3) in mat4 a_instance_model;
+layout(location = 7) in vec4 a_instance_color;
+layout(location = 8) in vec4 a_instance_material;
+
+struct Material {
+    vec4 vertex_color;
+    float ambient_light;
+    float diffuse_reflection;
+    float specular_reflection;
+    float shininess;
+};
+
+layout(std140, row_major) uniform CameraBlock {
+    mat4 view;
+    mat4 projection;
+    vec3 view_position;
+    bool perspective_projection;
+};
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
-uniform bool perspective_projection=true;
+uniform Material material;
+uniform bool use_instancing;
 
 uniform vec2 texture_repeat;
 uniform bool use_skybox;
 
-uniform mat4 light_projection;
-uniform mat4 light_view;
-
 out vec2 tex_coord;
 out vec3 frag_normal;
 out vec3 frag_position;
 out vec3 skyboxTexCoords;
 
-out vec4 frag_pos_light_space;
+flat out vec4 frag_material_color;
+flat out vec4 frag_material_params;
 
 void main() {
+    if (use_instancing) {
+        frag_material_color = a_instance_color;
+        frag_material_params = a_instance_material;
+    } else {
+        frag_material_color = material.vertex_color;
+        frag_material_params = vec4(material.ambient_light, material.diffuse_reflection, material.specular_reflection, material.shininess);
+    }
+
     if (use_skybox) {
         mat4 view_no_translation = mat4(mat3(view));
         vec4 skybox_pos;
@@ -33,11 +56,11 @@ void main() {
         gl_Position = skybox_pos.xyww;
         skyboxTexCoords = a_vertex_position;
     } else {
-        vec4 world_pos = model * vec4(a_vertex_position, 1.0);
+        mat4 object_model = use_instancing ? a_instance_model : model;
+        vec4 world_pos = object_model * vec4(a_vertex_position, 1.0);
         frag_position = world_pos.xyz;
         gl_Position = projection * view * world_pos;
         tex_coord = a_texture_coordinate * texture_repeat;
-        frag_normal = mat3(transpose(inverse(model))) * a_vertex_normal;
-        frag_pos_light_space = light_projection * light_view * vec4(frag_position, 1.0);
+        frag_normal = mat3(transpose(inverse(object_model))) * a_vertex_normal;
     }
 }
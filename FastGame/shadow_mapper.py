@@ -1,92 +1,344 @@
+import ctypes
+import numpy as np
 from OpenGL.GL import *
-from .shader import Shader
-from .game_objects import GameObject
-from .components import Transform, Mesh, LightSourceShadow
+from .culling import FrustumCuller, get_frustum_planes, get_box_mask
+from .components import LightSourceShadow
+from .renderer import MESH_VBO_LAYOUT, set_VBO_layout
+from .uniform_buffer import SHADOW_BLOCK, SHADOW_BLOCK_BINDING, SHADOW_MAX_NUM
+from .mesh_registry import mesh_registry
 from . import internal_data
-from .utils import check_gl_error
 
 
+SHADOW_ATLAS_UNIT = 2
+MIN_TILE_SIZE = 64
+
+# casters only need their model matrix, the same attribute locations as the instanced main pass
+SHADOW_INSTANCE_VBO_LAYOUT = {
+    'stride': 16 * ctypes.sizeof(ctypes.c_float),
+    'data': [
+        {
+            'index': 3 + column,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': column * 4 * ctypes.sizeof(ctypes.c_float),
+            'divisor': 1
+        } for column in range(4)
+    ]
+}
+
+
+def get_tile_size(resolution, atlas_size):
+    size = 1 << max(int(resolution) - 1, 0).bit_length()
+    return min(max(size, MIN_TILE_SIZE), atlas_size)
+
+
+def get_atlas_size(sizes, max_atlas_size):
+    # the smallest power of two square with room for every tile, past the maximum the tiles shrink instead
+    if not sizes:
+        return 0
+    atlas_size = max(sizes)
+    area = sum(size * size for size in sizes)
+    while atlas_size * atlas_size < area and atlas_size < max_atlas_size:
+        atlas_size *= 2
+    return atlas_size
+
+
+def allocate_tiles(sizes, atlas_size):
+    # when the squares don't fit, the largest are halved first. power of two squares
+    # whose areas add up to the atlas always pack when placed largest first, a free square
+    # is split in four until it matches
+    sizes = list(sizes)
+    while sum(size * size for size in sizes) > atlas_size * atlas_size and max(sizes) > MIN_TILE_SIZE:
+        largest = max(sizes)
+        sizes = [size // 2 if size == largest else size for size in sizes]
+    free = [(0, 0, atlas_size)]
+    tiles = [None] * len(sizes)
+    for index in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+        size = sizes[index]
+        fitting = [square for square in free if square[2] >= size]
+        if not fitting:
+            continue
+        square = min(fitting, key=lambda square: square[2])
+        free.remove(square)
+        x, y, side = square
+        while side > size:
+            side //= 2
+            free.extend([(x + side, y, side), (x, y + side, side), (x + side, y + side, side)])
+        tiles[index] = (x, y, size)
+    return tiles
+
+
+def get_atlas_matrix(tile, atlas_size):
+    # clip space of the light to the tile's texture coordinates, depth to [0, 1]
+    x, y, size = tile
+    scale = size / atlas_size
+    return np.array([
+        [0.5 * scale, 0, 0, 0.5 * scale + x / atlas_size],
+        [0, 0.5 * scale, 0, 0.5 * scale + y / atlas_size],
+        [0, 0, 0.5, 0.5],
+        [0, 0, 0, 1],
+    ], dtype=np.float32)
+
+
+class ShadowBatch:
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.VAO = None
+        self.instance_VBO = None
+        self._mesh_buffers = None
+        self._capacity = 0
+
+    def setup(self):
+        self._mesh_buffers = mesh_registry.acquire_buffers(self.mesh)
+        self.VAO = glGenVertexArrays(1)
+        self.instance_VBO = glGenBuffers(1)
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glBindBuffer(GL_ARRAY_BUFFER, self._mesh_buffers.VBO)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._mesh_buffers.EBO)
+        set_VBO_layout(MESH_VBO_LAYOUT)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_VBO)
+        set_VBO_layout(SHADOW_INSTANCE_VBO_LAYOUT)
+        internal_data.render_state.bind_vertex_array(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def render(self, models):
+        # the matrices are row-major, the attributes expect columns
+        data = np.ascontiguousarray(models.transpose(0, 2, 1))
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_VBO)
+        if len(data) > self._capacity:
+            self._capacity = max(len(data), 2 * self._capacity)
+            glBufferData(GL_ARRAY_BUFFER, self._capacity * data.itemsize * 16, None, GL_STREAM_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glDrawElementsInstanced(GL_TRIANGLES, self._mesh_buffers.index_size, GL_UNSIGNED_INT, None, len(data))
+        internal_data.draw_calls += 1
+
+    def delete(self):
+        if self._mesh_buffers is not None:
+            mesh_registry.release_buffers(self._mesh_buffers)
+            self._mesh_buffers = None
+        if self.instance_VBO:
+            glDeleteBuffers(1, np.array([self.instance_VBO], dtype=np.uint32))
+            self.instance_VBO = None
+        if self.VAO:
+            glDeleteVertexArrays(1, np.array([self.VAO], dtype=np.uint32))
+            self.VAO = None
+
 
 class ShadowMapper:
-    def __init__(self):
-        
+    # every shadow casting light gets a square of one depth atlas, a square is only
+    # redrawn when the light or the casters inside its frustum moved. the atlas holds
+    # those cached squares, so unlike the other textures each scene owns its own. it is only
+    # allocated once a light casts, at the size its squares need
+    def __init__(self, max_atlas_size=4096):
+        self.max_atlas_size = max_atlas_size
+        self.atlas_size = 0
         self.depth_map_fbo = None
         self.depth_map = None
-        
-        self._shadow_width = 2048
-        self._shadow_height = 2048
-        
-        self._shadow_bias = 0.005
-        # self.generate_depth_map()
-    
-    def generate_depth_map(self):
-        if self.depth_map:
-            glDeleteTextures([self.depth_map])
-        if self.depth_map_fbo:
-            glDeleteFramebuffers([self.depth_map_fbo])
+        self.buffer_id = None
+        self.data = np.zeros(1, dtype=SHADOW_BLOCK)
+        self.culler = FrustumCuller()
+        self.batches = {}
+        self.layout = None
+        self.tiles = {}
+        self.cache = {}
+        # light id -> index into the shadow block, read by FrameUniforms
+        self.indices = {}
+        self.frame = 0
+        self.rendered_count = 0
+        self.cached_count = 0
+        self._dirty = False
+        self._viewport = None
+
+    def generate(self):
+        self.delete()
+        self.buffer_id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, self.data, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    def generate_atlas(self, atlas_size):
+        self.delete_atlas()
+        self.atlas_size = atlas_size
+        if atlas_size == 0:
+            return
 
-        self.depth_map_fbo = glGenFramebuffers(1)
-        
         self.depth_map = glGenTextures(1)
-        glBindTexture(GL_TEXTURE_2D, self.depth_map)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT24, self._shadow_width, self._shadow_height, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
-        
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_BORDER)
-        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_BORDER)
-        borderColor = [ 1.0, 1.0, 1.0, 1.0 ]
-        glTexParameterfv(GL_TEXTURE_2D, GL_TEXTURE_BORDER_COLOR, borderColor)
-
-
-        glBindFramebuffer(GL_FRAMEBUFFER, self.depth_map_fbo)
-        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth_map, 0)
+        internal_data.render_state.bind_texture(SHADOW_ATLAS_UNIT, GL_TEXTURE_2D, self.depth_map)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_DEPTH_COMPONENT24, atlas_size, atlas_size, 0, GL_DEPTH_COMPONENT, GL_FLOAT, None)
+        # linear filtering of a compared depth texture blends four depth tests
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_MODE, GL_COMPARE_REF_TO_TEXTURE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_COMPARE_FUNC, GL_LEQUAL)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
 
+        self.depth_map_fbo = glGenFramebuffers(1)
+        internal_data.render_state.bind_framebuffer(self.depth_map_fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_TEXTURE_2D, self.depth_map, 0)
         glDrawBuffer(GL_NONE)
         glReadBuffer(GL_NONE)
-        
-        
+
         status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
         if status != GL_FRAMEBUFFER_COMPLETE:
             raise RuntimeError(f"Framebuffer incomplete: {hex(status)}")
-        
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
-        # glBindTexture(GL_TEXTURE_2D, 0)
-        
-    def bind_depth_map(self):
-        glViewport(0, 0, self._shadow_width, self._shadow_height)
-        glBindFramebuffer(GL_FRAMEBUFFER, self.depth_map_fbo)
+        internal_data.render_state.depth_mask(True)
         glClear(GL_DEPTH_BUFFER_BIT)
-        glEnable(GL_DEPTH_TEST)
-        glDepthFunc(GL_LESS)
-        glCullFace(GL_FRONT)
-        
-    def unbind_depth_map(self):
-        glViewport(0, 0, internal_data.window_width, internal_data.window_height)
-        glBindFramebuffer(GL_FRAMEBUFFER, 0)
-        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-        glCullFace(GL_BACK)
-        # glDepthFunc(GL_GREATER)
-        
-    def render(self, lights, game_objects):
+        internal_data.render_state.bind_framebuffer(0)
+
+    def get_shadow_lights(self, lights):
+        shadow_lights = []
         for light in lights:
-            shadow_component = light.components.get_all(LightSourceShadow)
-            transform = light.components.get_all(Transform)[0]
-            if len(shadow_component) == 0:
-                pass
-            light.renderer.set_component_uniforms(shadow_component[0])
-            light.renderer.set_component_uniforms(transform)
-            for game_object in game_objects:
-                transform = game_object.components.get_all(Transform)[0]
-                game_object.renderer.set_component_uniforms(transform)
-                game_object.renderer.render_directly()
-        
-    def set_depth_texture(self, texture_unit=0):
-        # print(self.depth_map)
-        glActiveTexture(GL_TEXTURE0 + texture_unit)
-        glBindTexture(GL_TEXTURE_2D, self.depth_map)
-        internal_data.uniform_manager.set("shadow_map", texture_unit)
-        
-        
- 
-        
\ No newline at end of file
+            shadows = getattr(light, 'shadows', None)
+            if isinstance(shadows, LightSourceShadow) and shadows.enabled:
+                shadow_lights.append(light)
+        return shadow_lights[:SHADOW_MAX_NUM]
+
+    def update_layout(self, lights):
+        layout = tuple((id(light), light.shadows.resolution) for light in lights)
+        if layout == self.layout:
+            return
+        # any moved square has to be drawn again
+        self.layout = layout
+        self.cache.clear()
+        self.indices.clear()
+        sizes = [get_tile_size(light.shadows.resolution, self.max_atlas_size) for light in lights]
+        atlas_size = get_atlas_size(sizes, self.max_atlas_size)
+        if atlas_size != self.atlas_size:
+            self.generate_atlas(atlas_size)
+        tiles = allocate_tiles(sizes, atlas_size)
+        self.tiles = {id(light): tile for light, tile in zip(lights, tiles) if tile is not None}
+
+    def get_casters(self, game_objects):
+        models = self.culler.get_world_matrices(game_objects) if game_objects else np.zeros((0, 4, 4), dtype=np.float32)
+        # what a shadow depends on besides the matrices, an object swapping its mesh changes it too
+        keys = np.array([(id(game_object), id(game_object.mesh.mesh)) for game_object in game_objects], dtype=np.int64).reshape(-1, 2)
+        return models, keys
+
+    def render_tile(self, tile, matrix, game_objects, models, static_batches):
+        x, y, size = tile
+        render_state = internal_data.render_state
+        render_state.viewport(x, y, size, size)
+        glScissor(x, y, size, size)
+        glClear(GL_DEPTH_BUFFER_BIT)
+        if len(game_objects) == 0 and len(static_batches) == 0:
+            return
+        internal_data.uniform_manager.set('light_space', matrix)
+        # static batches are already in world space, their one instance carries the identity
+        for batch in static_batches:
+            batch.draw()
+        meshes = {}
+        for index, game_object in enumerate(game_objects):
+            meshes.setdefault(id(game_object.mesh.mesh), (game_object.mesh.mesh, []))[1].append(index)
+        for key, (mesh, indices) in meshes.items():
+            batch = self.batches.get(key)
+            if batch is None:
+                batch = self.batches[key] = ShadowBatch(mesh)
+                batch.setup()
+            batch.render(models[indices])
+
+    def begin(self, depth_shader):
+        render_state = internal_data.render_state
+        # pyglet sizes the window's viewport to its framebuffer, which can differ from the window size
+        self._viewport = [int(value) for value in glGetIntegerv(GL_VIEWPORT)]
+        depth_shader.bind()
+        render_state.bind_framebuffer(self.depth_map_fbo)
+        render_state.enable(GL_SCISSOR_TEST)
+        render_state.enable(GL_DEPTH_TEST)
+        render_state.depth_func(GL_LESS)
+        render_state.depth_mask(True)
+        # thin and open meshes have to cast from both sides
+        render_state.disable(GL_CULL_FACE)
+        render_state.enable(GL_POLYGON_OFFSET_FILL)
+        glPolygonOffset(1.5, 4.0)
+
+    def end(self):
+        render_state = internal_data.render_state
+        render_state.disable(GL_POLYGON_OFFSET_FILL)
+        render_state.disable(GL_SCISSOR_TEST)
+        render_state.bind_framebuffer(0)
+        render_state.viewport(*self._viewport)
+
+    def render(self, depth_shader, lights, game_objects, static_batcher=None):
+        self.frame += 1
+        self.rendered_count = 0
+        self.cached_count = 0
+        lights = self.get_shadow_lights(lights)
+        self.update_layout(lights)
+        models, keys = self.get_casters(game_objects)
+        static_batches = static_batcher.shadow_batches if static_batcher is not None else []
+
+        started = False
+        for index, light in enumerate(lights):
+            tile = self.tiles.get(id(light))
+            if tile is None:
+                continue
+            shadows = light.shadows
+            matrix = shadows.get_light_space_matrix()
+            planes = get_frustum_planes(matrix)
+            mask = self.culler.get_visible_mask(game_objects, planes, models) if game_objects else np.zeros(0, dtype=bool)
+            static_mask = get_box_mask(static_batcher.shadow_bounds, planes).tolist() if static_batches else []
+            static = [batch for batch, inside in zip(static_batches, static_mask) if inside]
+            signature = (matrix.tobytes() + keys[mask].tobytes() + models[mask].tobytes()
+                         + np.array([batch.serial for batch in static], dtype=np.int64).tobytes())
+            cached = self.cache.get(id(light))
+            if cached is not None and (cached[0] == signature or self.frame - cached[1] < shadows.update_frames):
+                self.cached_count += 1
+                continue
+            if not started:
+                self.begin(depth_shader)
+                started = True
+            self.render_tile(tile, matrix, [game_object for game_object, inside in zip(game_objects, mask.tolist()) if inside], models[mask], static)
+            self.cache[id(light)] = (signature, self.frame)
+            self.indices[id(light)] = index
+            row = self.data[0]
+            row['shadow_matrix'][index] = get_atlas_matrix(tile, self.atlas_size) @ matrix
+            x, y, size = tile
+            row['shadow_rect'][index] = np.array([x, y, x + size, y + size], dtype=np.float32) / self.atlas_size
+            row['shadow_params'][index] = (shadows.bias, 0.0, 0.0, 0.0)
+            self._dirty = True
+            self.rendered_count += 1
+        if started:
+            self.end()
+
+        if self._dirty:
+            glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+            glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+            glBindBuffer(GL_UNIFORM_BUFFER, 0)
+            self._dirty = False
+        self.bind()
+
+    def bind(self):
+        glBindBufferBase(GL_UNIFORM_BUFFER, SHADOW_BLOCK_BINDING, self.buffer_id)
+        internal_data.render_state.bind_texture(SHADOW_ATLAS_UNIT, GL_TEXTURE_2D, self.depth_map or 0)
+
+    def clear(self):
+        for batch in self.batches.values():
+            batch.delete()
+        self.batches.clear()
+        self.layout = None
+        self.tiles.clear()
+        self.cache.clear()
+        self.indices.clear()
+
+    def delete_atlas(self):
+        if self.depth_map_fbo:
+            glDeleteFramebuffers(1, np.array([self.depth_map_fbo], dtype=np.uint32))
+            self.depth_map_fbo = None
+        if self.depth_map:
+            glDeleteTextures(1, np.array([self.depth_map], dtype=np.uint32))
+            self.depth_map = None
+        self.atlas_size = 0
+        internal_data.render_state.invalidate()
+
+    def delete(self):
+        self.clear()
+        self.delete_atlas()
+        if self.buffer_id is not None:
+            glDeleteBuffers(1, np.array([self.buffer_id], dtype=np.uint32))
+            self.buffer_id = None
+        # deleting unbinds the names, which the cached state doesn't know about
+        internal_data.render_state.invalidate()
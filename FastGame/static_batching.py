@@ -0,0 +1,273 @@
+import itertools
+import numpy as np
+from OpenGL.GL import *
+from .culling import get_frustum_planes, get_box_mask
+from .game_objects import VisibleGameObject, SkyBox
+from .components import Transform
+from .renderer import MESH_VBO_LAYOUT, INSTANCE_DTYPE, INSTANCE_VBO_LAYOUT, InstancedRenderer, set_VBO_layout
+from .texture_registry import texture_registry
+from . import internal_data
+
+
+# keeps batches small enough to be culled as a unit
+STATIC_BATCH_MAX_VERTICES = 1 << 16
+
+_serials = itertools.count(1)
+
+# the instance colour and material attributes, fed per vertex so one batch can mix materials
+STATIC_VERTEX_DTYPE = np.dtype([
+    ('color', np.float32, 4),
+    ('material', np.float32, 4),
+])
+
+STATIC_VERTEX_VBO_LAYOUT = {
+    'stride': STATIC_VERTEX_DTYPE.itemsize,
+    'data': [
+        {
+            'index': 7,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': STATIC_VERTEX_DTYPE.fields['color'][1],
+            'divisor': 0
+        },
+        {
+            'index': 8,
+            'size': 4,
+            'type': GL_FLOAT,
+            'normalized': GL_FALSE,
+            'offset': STATIC_VERTEX_DTYPE.fields['material'][1],
+            'divisor': 0
+        }
+    ]
+}
+
+# only the model matrix columns are left per instance
+STATIC_INSTANCE_VBO_LAYOUT = {
+    'stride': INSTANCE_VBO_LAYOUT['stride'],
+    'data': INSTANCE_VBO_LAYOUT['data'][:4],
+}
+
+
+class StaticBatch:
+    # the meshes of objects sharing a texture and render state, merged in world space. they are
+    # drawn through the instanced path with a single instance, whose model matrix is the identity
+    def __init__(self, members):
+        self.members = members
+        self.game_objects = [game_object for game_object, _ in members]
+        # identifies the geometry, for the shadow caches
+        self.serial = next(_serials)
+        self.cast_shadows = self.game_objects[0].cast_shadows
+        self.bounds = np.zeros((2, 3), dtype=np.float32)
+        self.index_count = 0
+        self.vertex_counts = [len(mesh.vertices) for _, mesh in members]
+        self.VAO = None
+        self.VBO = None
+        self.EBO = None
+        self.material_VBO = None
+        self.instance_VBO = None
+        self.instance_data = np.zeros(1, dtype=INSTANCE_DTYPE)
+        self.instance_data['model'] = np.eye(4, dtype=np.float32)
+
+    def merge(self):
+        vertices = []
+        indices = []
+        base = 0
+        for game_object in self.game_objects:
+            mesh = game_object.mesh.mesh
+            model = game_object.transform.get_global_model_array()
+            merged = mesh.vertices.copy()
+            merged[:, 0:3] = mesh.vertices[:, 0:3] @ model[:3, :3].T + model[:3, 3]
+            # the same normal matrix default.vert would have used
+            merged[:, 5:8] = mesh.vertices[:, 5:8] @ np.linalg.inv(model[:3, :3])
+            vertices.append(merged)
+            indices.append(mesh.indices.reshape(-1) + base)
+            base += len(merged)
+        vertices = np.concatenate(vertices).astype(np.float32)
+        indices = np.concatenate(indices).astype(np.uint32)
+        if len(vertices):
+            self.bounds = np.array([vertices[:, 0:3].min(axis=0), vertices[:, 0:3].max(axis=0)], dtype=np.float32)
+        return vertices, indices
+
+    def setup(self):
+        vertices, indices = self.merge()
+        self.index_count = len(indices)
+        self.VAO = glGenVertexArrays(1)
+        self.VBO, self.EBO, self.material_VBO, self.instance_VBO = [int(buffer) for buffer in glGenBuffers(4)]
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        set_VBO_layout(MESH_VBO_LAYOUT)
+        glBindBuffer(GL_ARRAY_BUFFER, self.material_VBO)
+        glBufferData(GL_ARRAY_BUFFER, len(vertices) * STATIC_VERTEX_DTYPE.itemsize, None, GL_DYNAMIC_DRAW)
+        set_VBO_layout(STATIC_VERTEX_VBO_LAYOUT)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_VBO)
+        glBufferData(GL_ARRAY_BUFFER, self.instance_data.nbytes, self.instance_data, GL_STATIC_DRAW)
+        set_VBO_layout(STATIC_INSTANCE_VBO_LAYOUT)
+        internal_data.render_state.bind_vertex_array(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def load_material(self):
+        materials = np.zeros(len(self.game_objects), dtype=STATIC_VERTEX_DTYPE)
+        for index, game_object in enumerate(self.game_objects):
+            material = game_object.material
+            materials[index] = ((*material.color.color_in_rgb, material.alpha),
+                                (material.ambient_light, material.diffuse_reflection, material.specular_reflection, material.shininess))
+        data = np.repeat(materials, self.vertex_counts)
+        glBindBuffer(GL_ARRAY_BUFFER, self.material_VBO)
+        glBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self):
+        internal_data.render_state.bind_vertex_array(self.VAO)
+        glDrawElementsInstanced(GL_TRIANGLES, self.index_count, GL_UNSIGNED_INT, None, 1)
+        internal_data.draw_calls += 1
+
+    def render(self):
+        # the first member's mesh, material and texture components stand for the whole batch
+        renderer = self.game_objects[0].renderer
+        components = [component for component in renderer._rendered_components if not isinstance(component, Transform)]
+        for component in components:
+            component.setup()
+            renderer.set_component_uniforms(component)
+        internal_data.uniform_manager.set('use_instancing', True)
+        self.draw()
+        internal_data.uniform_manager.set('use_instancing', False)
+        for component in components:
+            component.post_setup()
+            uniforms = component.post_uniforms()
+            if uniforms:
+                renderer.set_uniforms(uniforms)
+
+    def delete(self):
+        if self.VBO is not None:
+            glDeleteBuffers(4, np.array([self.VBO, self.EBO, self.material_VBO, self.instance_VBO], dtype=np.uint32))
+            self.VBO = self.EBO = self.material_VBO = self.instance_VBO = None
+        if self.VAO is not None:
+            glDeleteVertexArrays(1, np.array([self.VAO], dtype=np.uint32))
+            self.VAO = None
+
+
+class StaticBatcher:
+    def __init__(self, max_vertices=STATIC_BATCH_MAX_VERTICES):
+        self.max_vertices = max_vertices
+        self.batches = []
+        self.bounds = np.zeros((0, 2, 3), dtype=np.float32)
+        self.shadow_batches = []
+        self.shadow_bounds = np.zeros((0, 2, 3), dtype=np.float32)
+        self.dynamic_objects = []
+        self.static_count = 0
+        self.visible_count = 0
+        self.culled_count = 0
+        self.rebuilds = 0
+        self._version = None
+        self._material_version = None
+
+    def can_batch(self, game_object):
+        if not game_object.static or isinstance(game_object, SkyBox) or game_object.mesh.mesh is None:
+            return False
+        if game_object.material.alpha < 1:
+            return False
+        return all(type(component) in InstancedRenderer.INSTANCED_COMPONENTS for component in game_object.renderer._rendered_components)
+
+    def get_batch_key(self, game_object):
+        material = game_object.material
+        texture = game_object.texture
+        # colours and lighting coefficients are per vertex, they don't split batches
+        return (
+            material.wireframe,
+            texture_registry.get_key(texture._texture_path, texture.sampler) if texture._texture_path is not None else None,
+            texture.repeat_x,
+            texture.repeat_y,
+            game_object.mesh.mesh.is_3d,
+            game_object.cast_shadows,
+        )
+
+    def split(self, group):
+        chunk = []
+        vertices = 0
+        for game_object in group:
+            count = len(game_object.mesh.mesh.vertices)
+            if chunk and vertices + count > self.max_vertices:
+                yield chunk
+                chunk = []
+                vertices = 0
+            chunk.append(game_object)
+            vertices += count
+        if chunk:
+            yield chunk
+
+    def update(self, game_objects, objects_version):
+        # the merge only runs again when objects were added, removed, marked static or had their
+        # mesh or render state changed, otherwise the previous split is returned as it is
+        version = (objects_version, internal_data.static_version)
+        material_version = internal_data.static_material_version
+        if version == self._version:
+            if material_version != self._material_version:
+                self._material_version = material_version
+                for batch in self.batches:
+                    batch.load_material()
+            return self.dynamic_objects
+        self._version = version
+        self._material_version = material_version
+        static_objects = []
+        dynamic_objects = []
+        for game_object in game_objects:
+            if self.can_batch(game_object):
+                static_objects.append(game_object)
+            else:
+                dynamic_objects.append(game_object)
+        groups = {}
+        for game_object in static_objects:
+            groups.setdefault(self.get_batch_key(game_object), []).append(game_object)
+
+        # batches with the same objects and meshes keep their buffers, only their materials are reloaded
+        previous = {batch.members: batch for batch in self.batches}
+        batches = []
+        for group in groups.values():
+            for chunk in self.split(group):
+                members = tuple((game_object, game_object.mesh.mesh) for game_object in chunk)
+                batch = previous.pop(members, None)
+                if batch is None:
+                    batch = StaticBatch(members)
+                    batch.setup()
+                    self.rebuilds += 1
+                batch.load_material()
+                batches.append(batch)
+        for batch in previous.values():
+            batch.delete()
+        self.batches = batches
+        self.bounds = np.array([batch.bounds for batch in batches], dtype=np.float32).reshape(-1, 2, 3)
+        self.shadow_batches = [batch for batch in batches if batch.cast_shadows]
+        self.shadow_bounds = np.array([batch.bounds for batch in self.shadow_batches], dtype=np.float32).reshape(-1, 2, 3)
+        self.dynamic_objects = dynamic_objects
+        self.static_count = len(static_objects)
+        return dynamic_objects
+
+    def get_visible(self, projection_view):
+        if projection_view is None or len(self.batches) == 0:
+            return self.batches
+        mask = get_box_mask(self.bounds, get_frustum_planes(projection_view))
+        return [batch for batch, inside in zip(self.batches, mask.tolist()) if inside]
+
+    def render(self, camera, use_culling=True):
+        projection_view = None
+        if camera is not None and use_culling:
+            projection_view = camera.lens.get_projection_matrix() @ np.array(camera.transform.get_global_view_matrix(), dtype=np.float32)
+        visible = self.get_visible(projection_view)
+        self.visible_count = len(visible)
+        self.culled_count = len(self.batches) - len(visible)
+        for batch in visible:
+            batch.render()
+
+    def clear(self):
+        for batch in self.batches:
+            batch.delete()
+        self.batches = []
+        self.bounds = np.zeros((0, 2, 3), dtype=np.float32)
+        self.shadow_batches = []
+        self.shadow_bounds = np.zeros((0, 2, 3), dtype=np.float32)
+        self._version = None
+        self._material_version = None
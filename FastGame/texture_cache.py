@@ -0,0 +1,109 @@
+import os
+import sys
+import struct
+import numpy as np
+from PIL import Image
+from .mesh_cache import source_info, source_digest, read_header, source_matches, write_cache_file
+
+
+CACHE_EXTENSION = '.fgtex'
+CACHE_MAGIC = b'FGTEX\x00\x00\x00'
+CACHE_VERSION = 1
+# magic, version, flags, channels, levels, width, height, source size, source mtime, source sha1
+CACHE_HEADER = struct.Struct('<8sIIIIIIQq20s')
+CACHE_DATA_OFFSET = 128
+
+FLAG_MIPMAPS = 1
+FLAG_FLIPPED = 2
+
+CHANNELS = {'RGB': 3, 'RGBA': 4}
+
+
+def get_flags(mipmaps, flip):
+    return (FLAG_MIPMAPS if mipmaps else 0) | (FLAG_FLIPPED if flip else 0)
+
+
+def cache_path(source_path, mode='RGBA', mipmaps=True, flip=True):
+    # the extension stays in the name so right.jpg and right.png don't collide, the mode and
+    # flags too, so one image loaded two ways keeps two caches
+    return f'{source_path}.{mode.lower()}{get_flags(mipmaps, flip)}{CACHE_EXTENSION}'
+
+
+def mip_sizes(width, height, levels):
+    sizes = []
+    for _ in range(levels):
+        sizes.append((width, height))
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+    return sizes
+
+
+def mip_level_count(width, height):
+    return max(width, height).bit_length()
+
+
+def build_mip_chain(image, mipmaps):
+    levels = [np.asarray(image, dtype=np.uint8)]
+    if mipmaps:
+        for width, height in mip_sizes(image.width, image.height, mip_level_count(image.width, image.height))[1:]:
+            image = image.resize((width, height), Image.BOX)
+            levels.append(np.asarray(image, dtype=np.uint8))
+    return levels
+
+
+def read_texture_cache(source_path, mode, mipmaps, flip):
+    path = cache_path(source_path, mode, mipmaps, flip)
+    header = read_header(path, CACHE_HEADER)
+    if header is None:
+        return None
+    magic, version, flags, channels, levels, width, height, size, mtime, digest = header
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or flags != get_flags(mipmaps, flip) or channels != CHANNELS[mode]:
+        return None
+    # a truncated file can't be mapped, the image is decoded again instead
+    sizes = mip_sizes(width, height, levels)
+    if os.path.getsize(path) != CACHE_DATA_OFFSET + sum(level_width * level_height * channels for level_width, level_height in sizes):
+        return None
+
+    if not source_matches(path, source_path, size, mtime, digest,
+                          lambda mtime: CACHE_HEADER.pack(magic, version, flags, channels, levels, width, height, size, mtime, digest)):
+        return None
+
+    result = []
+    offset = CACHE_DATA_OFFSET
+    for level_width, level_height in sizes:
+        level = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(level_height, level_width, channels))
+        result.append(level)
+        offset += level.nbytes
+    return result
+
+
+def write_texture_cache(source_path, mode, levels, mipmaps, flip):
+    path = cache_path(source_path, mode, mipmaps, flip)
+    height, width, channels = levels[0].shape
+    size, mtime = source_info(source_path)
+    header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, get_flags(mipmaps, flip), channels, len(levels), width, height,
+                               size, mtime, source_digest(source_path))
+    return write_cache_file(path, header, [np.ascontiguousarray(level, dtype=np.uint8) for level in levels], CACHE_DATA_OFFSET)
+
+
+def load_texture_levels(source_path, mode, mipmaps=True, flip=True, use_cache=True):
+    # decoded and mip-chained pixels, rows ordered bottom up when flipped like GL expects
+    if use_cache:
+        cached = read_texture_cache(source_path, mode, mipmaps, flip)
+        if cached is not None:
+            return cached
+    with Image.open(source_path) as image:
+        image = image.convert(mode)
+        if flip:
+            image = image.transpose(Image.FLIP_TOP_BOTTOM)
+        levels = build_mip_chain(image, mipmaps)
+    if use_cache:
+        write_texture_cache(source_path, mode, levels, mipmaps, flip)
+    return levels
+
+
+if __name__ == '__main__':
+    # prebuilds the cache for 2D textures, python -m FastGame.texture_cache image.png ...
+    for source_path in sys.argv[1:]:
+        load_texture_levels(os.path.abspath(source_path), 'RGBA')
+        print(f"built {cache_path(source_path)}")
@@ -0,0 +1,78 @@
+import numpy as np
+from OpenGL.GL import *
+from . import internal_data
+
+
+GL_FORMATS = {3: GL_RGB, 4: GL_RGBA}
+
+
+class GLTexture:
+    def __init__(self, key, target):
+        self.key = key
+        self.target = target
+        self.texture_id = None
+        self.width = 0
+        self.height = 0
+        self.ref_count = 0
+
+    def upload(self, faces, sampler, unit=0):
+        # faces holds one mip chain for 2D textures and six for cube maps
+        self.texture_id = glGenTextures(1)
+        internal_data.render_state.bind_texture(unit, self.target, self.texture_id)
+        for parameter, value in sampler:
+            glTexParameteri(self.target, parameter, value)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        face_target = GL_TEXTURE_CUBE_MAP_POSITIVE_X if self.target == GL_TEXTURE_CUBE_MAP else GL_TEXTURE_2D
+        for face, levels in enumerate(faces):
+            for level, data in enumerate(levels):
+                height, width, channels = data.shape
+                gl_format = GL_FORMATS[channels]
+                glTexImage2D(face_target + face, level, gl_format, width, height, 0, gl_format, GL_UNSIGNED_BYTE,
+                             np.ascontiguousarray(data))
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+        glTexParameteri(self.target, GL_TEXTURE_MAX_LEVEL, len(faces[0]) - 1)
+        self.height, self.width = faces[0][0].shape[:2]
+
+    def delete(self):
+        if self.texture_id:
+            glDeleteTextures(1, np.array([self.texture_id], dtype=np.uint32))
+            # a recycled name must not look bound already
+            internal_data.render_state.invalidate()
+        self.texture_id = None
+
+
+class TextureRegistry:
+    # GL textures shared by every object using the same files and sampler, the windows share one object space
+    def __init__(self):
+        self._textures = {}
+
+    def get_key(self, paths, sampler):
+        if isinstance(paths, str):
+            paths = (paths,)
+        return tuple(paths), tuple(sampler)
+
+    def find(self, key):
+        return self._textures.get(key)
+
+    def acquire(self, key, target, get_faces, unit=0):
+        texture = self._textures.get(key)
+        if texture is None:
+            texture = GLTexture(key, target)
+            texture.upload(get_faces(), key[1], unit)
+            self._textures[key] = texture
+        texture.ref_count += 1
+        return texture
+
+    def release(self, texture):
+        texture.ref_count -= 1
+        if texture.ref_count <= 0:
+            self._textures.pop(texture.key, None)
+            texture.delete()
+
+    def clear(self):
+        for texture in self._textures.values():
+            texture.delete()
+        self._textures.clear()
+
+
+texture_registry = TextureRegistry()
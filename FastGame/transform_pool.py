@@ -0,0 +1,209 @@
+import numpy as np
+from pyglm import glm
+
+
+def quat_to_matrices(quats):
+    # quats are stored (w, x, y, z) like np.array(glm.quat)
+    w, x, y, z = quats.T
+    matrices = np.empty((len(quats), 3, 3), dtype=np.float32)
+    matrices[:, 0, 0] = 1 - 2 * (y * y + z * z)
+    matrices[:, 0, 1] = 2 * (x * y - w * z)
+    matrices[:, 0, 2] = 2 * (x * z + w * y)
+    matrices[:, 1, 0] = 2 * (x * y + w * z)
+    matrices[:, 1, 1] = 1 - 2 * (x * x + z * z)
+    matrices[:, 1, 2] = 2 * (y * z - w * x)
+    matrices[:, 2, 0] = 2 * (x * z - w * y)
+    matrices[:, 2, 1] = 2 * (y * z + w * x)
+    matrices[:, 2, 2] = 1 - 2 * (x * x + y * y)
+    return matrices
+
+
+def quat_multiply(a, b):
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b.T
+    result = np.empty_like(a)
+    result[:, 0] = aw * bw - ax * bx - ay * by - az * bz
+    result[:, 1] = aw * bx + ax * bw + ay * bz - az * by
+    result[:, 2] = aw * by - ax * bz + ay * bw + az * bx
+    result[:, 3] = aw * bz + ax * by - ay * bx + az * bw
+    result /= np.linalg.norm(result, axis=1, keepdims=True)
+    return result
+
+
+def get_shared_pool(game_objects):
+    # the pool and row indices when every object lives in the same pool
+    if len(game_objects) == 0:
+        return None, None
+    pool = game_objects[0].transform._pool
+    if pool is None:
+        return None, None
+    indices = []
+    for game_object in game_objects:
+        transform = game_object.transform
+        if transform._pool is not pool:
+            return None, None
+        indices.append(transform._pool_index)
+    pool.update()
+    return pool, np.array(indices, dtype=np.int64)
+
+
+class TransformPool:
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.transforms = []
+        self.version = 0
+        self.dirty = True
+        self._hierarchy_dirty = True
+        self._levels = []
+        self._external = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        count = self.count
+        positions = np.zeros((capacity, 3), dtype=np.float32)
+        rotations = np.zeros((capacity, 4), dtype=np.float32)
+        rotations[:, 0] = 1
+        scales = np.ones((capacity, 3), dtype=np.float32)
+        if count:
+            positions[:count] = self.positions[:count]
+            rotations[:count] = self.rotations[:count]
+            scales[:count] = self.scales[:count]
+        self.positions = positions
+        self.rotations = rotations
+        self.scales = scales
+        self.parents = np.full(capacity, -1, dtype=np.int64)
+        self.local_matrices = np.zeros((capacity, 4, 4), dtype=np.float32)
+        self.world_matrices = np.zeros((capacity, 4, 4), dtype=np.float32)
+        self.global_positions = np.zeros((capacity, 3), dtype=np.float32)
+        self.global_rotations = np.zeros((capacity, 4), dtype=np.float32)
+        self.mark_hierarchy_dirty()
+
+    def add(self, transform):
+        if transform._pool is self:
+            return transform._pool_index
+        if transform._pool is not None:
+            raise ValueError('Transform already belongs to another pool')
+        if self.count == len(self.positions):
+            self._allocate(2 * len(self.positions))
+        index = self.count
+        self.positions[index] = transform.get_position()
+        self.rotations[index] = transform.get_rotation()
+        self.scales[index] = transform.get_scale()
+        self.transforms.append(transform)
+        self.count += 1
+        transform._pool = self
+        transform._pool_index = index
+        transform.invalidate()
+        self.mark_hierarchy_dirty()
+        return index
+
+    def remove(self, transform):
+        if transform._pool is not self:
+            return
+        index = transform._pool_index
+        # hand the values back so the transform keeps working on its own
+        transform._pool = None
+        transform._pool_index = -1
+        transform.set_position(glm.vec3(*self.positions[index]))
+        transform.set_rotation(glm.quat(*self.rotations[index]))
+        transform.set_scale(glm.vec3(*self.scales[index]))
+
+        last = self.count - 1
+        if index != last:
+            moved = self.transforms[last]
+            self.positions[index] = self.positions[last]
+            self.rotations[index] = self.rotations[last]
+            self.scales[index] = self.scales[last]
+            self.transforms[index] = moved
+            moved._pool_index = index
+        self.transforms.pop()
+        self.count -= 1
+        self.mark_hierarchy_dirty()
+        if transform.game_object is not None:
+            for child in transform.game_object.objects.get_all():
+                self.remove(child.transform)
+
+    def clear(self):
+        for transform in list(self.transforms):
+            self.remove(transform)
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def mark_hierarchy_dirty(self):
+        self._hierarchy_dirty = True
+        self.dirty = True
+
+    def _build_levels(self):
+        count = self.count
+        parents = self.parents[:count]
+        parents[:] = -1
+        self._external = []
+        for index, transform in enumerate(self.transforms):
+            game_object = transform.game_object
+            parent = game_object.parent if game_object is not None else None
+            if parent is None:
+                continue
+            if parent.transform._pool is self:
+                parents[index] = parent.transform._pool_index
+            else:
+                self._external.append(index)
+
+        # a node's depth is the number of pooled ancestors above it
+        depths = np.zeros(count, dtype=np.int64)
+        ancestors = parents.copy()
+        active = ancestors >= 0
+        while active.any():
+            depths[active] += 1
+            ancestors[active] = parents[ancestors[active]]
+            active = ancestors >= 0
+        order = np.argsort(depths, kind='stable')
+        splits = np.searchsorted(depths[order], np.arange(1, depths.max() + 1 if count else 0))
+        self._levels = np.split(order, splits) if count else []
+        self._hierarchy_dirty = False
+
+    def update(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        if self._hierarchy_dirty:
+            self._build_levels()
+        count = self.count
+        positions = self.positions[:count]
+        rotations = self.rotations[:count]
+        local = self.local_matrices[:count]
+        local[:, 3] = (0, 0, 0, 1)
+        local[:, :3, :3] = quat_to_matrices(rotations) * self.scales[:count, None, :]
+        local[:, :3, 3] = positions
+
+        world = self.world_matrices
+        global_positions = self.global_positions
+        global_rotations = self.global_rotations
+        for depth, level in enumerate(self._levels):
+            if depth == 0:
+                world[level] = local[level]
+                global_positions[level] = positions[level]
+                global_rotations[level] = rotations[level]
+                if len(self._external):
+                    self._update_external()
+                continue
+            parents = self.parents[level]
+            world[level] = world[parents] @ local[level]
+            global_positions[level] = global_positions[parents] + positions[level]
+            global_rotations[level] = quat_multiply(global_rotations[parents], rotations[level])
+        self.version += 1
+
+    def _update_external(self):
+        # roots whose parent lives outside the pool go through the parent's own transform
+        for index in self._external:
+            parent_transform = self.transforms[index].game_object.parent.transform
+            self.world_matrices[index] = np.array(parent_transform.get_global_model_matrix(), dtype=np.float32) @ self.local_matrices[index]
+            self.global_positions[index] = np.array(parent_transform.get_global_position()) + self.positions[index]
+            self.global_rotations[index] = quat_multiply(np.array([parent_transform.get_global_rotation()], dtype=np.float32),
+                                                         self.rotations[index:index + 1])[0]
+
+    def get_world_matrices(self, indices=None):
+        self.update()
+        if indices is None:
+            return self.world_matrices[:self.count]
+        return self.world_matrices[indices]
@@ -0,0 +1,132 @@
+from OpenGL.GL import *
+import numpy as np
+from .light_clusters import LightClusters
+
+
+DIRECTIONAL_LIGHT_MAX_NUM = 1
+SHADOW_MAX_NUM = 16
+
+CAMERA_BLOCK_BINDING = 0
+LIGHT_BLOCK_BINDING = 1
+SHADOW_BLOCK_BINDING = 2
+
+UNIFORM_BLOCK_BINDINGS = {
+    'CameraBlock': CAMERA_BLOCK_BINDING,
+    'LightBlock': LIGHT_BLOCK_BINDING,
+    'ShadowBlock': SHADOW_BLOCK_BINDING,
+}
+
+
+# std140 layouts of the blocks declared in default.vert / default.frag,
+# matrices are declared row_major so pyglm matrices can be copied as they are
+CAMERA_BLOCK = np.dtype({
+    'names': ['view', 'projection', 'view_position', 'perspective_projection'],
+    'formats': [(np.float32, (4, 4)), (np.float32, (4, 4)), (np.float32, 3), np.int32],
+    'offsets': [0, 64, 128, 140],
+    'itemsize': 144,
+})
+
+DIRECTIONAL_LIGHT = np.dtype({
+    'names': ['direction', 'color', 'shadow'],
+    'formats': [(np.float32, 3), (np.float32, 3), np.int32],
+    'offsets': [0, 16, 28],
+    'itemsize': 32,
+})
+
+# filled by the shadow mapper, the matrices take world space to the light's square of the atlas
+SHADOW_BLOCK = np.dtype({
+    'names': ['shadow_matrix', 'shadow_rect', 'shadow_params'],
+    'formats': [(np.float32, (SHADOW_MAX_NUM, 4, 4)), (np.float32, (SHADOW_MAX_NUM, 4)), (np.float32, (SHADOW_MAX_NUM, 4))],
+    'offsets': [0, 64 * SHADOW_MAX_NUM, 80 * SHADOW_MAX_NUM],
+    'itemsize': 96 * SHADOW_MAX_NUM,
+})
+
+
+# point and spot lights live in the cluster texture buffers, see light_clusters.py
+def light_block_dtype():
+    return np.dtype({
+        'names': ['directional_light_num', 'clustered_light_num', 'shadowed_light_num', 'cluster_grid',
+                  'cluster_depth', 'cluster_tile_size', 'directional_light'],
+        'formats': [np.int32, np.int32, np.int32, (np.int32, 4), (np.float32, 4), (np.float32, 4),
+                    (DIRECTIONAL_LIGHT, (DIRECTIONAL_LIGHT_MAX_NUM,))],
+        'offsets': [0, 4, 8, 16, 32, 48, 64],
+        'itemsize': 64 + DIRECTIONAL_LIGHT.itemsize * DIRECTIONAL_LIGHT_MAX_NUM,
+    })
+
+
+class FrameUniforms:
+    def __init__(self):
+        self.buffer_id = None
+        self.data = None
+        self.light_offset = 0
+        self.uploads = 0
+        self.light_clusters = LightClusters()
+
+    def generate(self):
+        if self.buffer_id is not None:
+            glDeleteBuffers(1, np.array([self.buffer_id], dtype=np.uint32))
+        # both blocks live in one buffer so a frame needs a single upload,
+        # the light block has to start on a valid binding offset
+        alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+        self.light_offset = -(-CAMERA_BLOCK.itemsize // alignment) * alignment
+        lights = light_block_dtype()
+        self.data = np.zeros(1, dtype=np.dtype({
+            'names': ['camera', 'lights'],
+            'formats': [CAMERA_BLOCK, lights],
+            'offsets': [0, self.light_offset],
+            'itemsize': self.light_offset + lights.itemsize,
+        }))
+        self.buffer_id = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        self.light_clusters.generate()
+
+    def pack_camera(self, camera):
+        data = self.data[0]['camera']
+        for component in camera.renderer.get_rendered_components():
+            for field, value in component.set_block_uniforms().items():
+                data[field] = value
+
+    def pack_lights(self, lights, shadow_indices):
+        data = self.data[0]['lights']
+        count = 0
+        for light in lights:
+            if light.block_array != 'directional_light' or count >= DIRECTIONAL_LIGHT_MAX_NUM:
+                continue
+            row = data['directional_light'][count]
+            for component in light.renderer.get_rendered_components():
+                for field, value in component.set_block_uniforms().items():
+                    row[field] = value
+            row['shadow'] = shadow_indices.get(id(light), -1)
+            count += 1
+        data['directional_light_num'] = count
+
+    def pack_clusters(self, camera, lights, shadow_indices):
+        self.light_clusters.update(camera, [light for light in lights if light.block_array != 'directional_light'], shadow_indices)
+        data = self.data[0]['lights']
+        for field, value in self.light_clusters.get_block_values().items():
+            data[field] = value
+
+    def upload(self):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer_id)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glBindBufferRange(GL_UNIFORM_BUFFER, CAMERA_BLOCK_BINDING, self.buffer_id, 0, CAMERA_BLOCK.itemsize)
+        glBindBufferRange(GL_UNIFORM_BUFFER, LIGHT_BLOCK_BINDING, self.buffer_id, self.light_offset, self.data.nbytes - self.light_offset)
+        self.uploads += 1
+
+    def update(self, camera, lights, shadow_indices=None):
+        if shadow_indices is None:
+            shadow_indices = {}
+        if camera is not None:
+            self.pack_camera(camera)
+        self.pack_lights(lights, shadow_indices)
+        self.pack_clusters(camera, lights, shadow_indices)
+        self.upload()
+
+    def delete(self):
+        if self.buffer_id is not None:
+            glDeleteBuffers(1, np.array([self.buffer_id], dtype=np.uint32))
+            self.buffer_id = None
+        self.light_clusters.delete()
@@ -0,0 +1,88 @@
+import os
+import sys
+import math
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pyglet
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Draw calls and frame time of N cuboids, instanced versus not')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--transform-pool', action='store_true', help='keep the transforms in a scene TransformPool')
+    parser.add_argument('--headless', action='store_true', help='render through an EGL context without a display')
+    return parser.parse_args()
+
+
+def build_scene(count, use_transform_pool=False):
+    from pyglm.glm import vec3
+    from FastGame.scene import Scene
+    from FastGame.shader import Shader
+    from FastGame.game_objects import Cuboid, Camera, DirectionalLight
+    from FastGame.utils import Color
+
+    shader = Shader('shaders/default.vert', 'shaders/default.frag')
+    depth_shader = Shader('shaders/simple_depth_shader.vert', 'shaders/simple_depth_shader.frag')
+    scene = Scene('instancing', shader, depth_shader, use_transform_pool=use_transform_pool)
+
+    side = math.ceil(math.sqrt(count))
+    spacing = 3
+    for i in range(count):
+        cuboid = Cuboid(f'cuboid_{i}')
+        x = (i % side - side / 2) * spacing
+        z = (i // side - side / 2) * spacing
+        cuboid.transform.set_position(vec3(x, 0, z))
+        cuboid.material.color = Color(color_in_rgb=((i * 37) % 255, (i * 91) % 255, (i * 53) % 255))
+        scene.objects.add(cuboid)
+
+    light = DirectionalLight('sun')
+    light.transform.rotate_euler(vec3(-60, 30, 0))
+    scene.objects.add(light)
+
+    camera = Camera('camera')
+    camera.transform.set_position(vec3(0, side * spacing * 0.8, side * spacing * 0.8))
+    camera.transform.look_at(vec3(0, 0, 0), vec3(0, 1, 0))
+    scene.objects.add(camera)
+    return scene
+
+
+def run_frames(game, frames):
+    from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        game.update(1 / 60)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        game.render()
+        glFinish()
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def main():
+    args = parse_args()
+    if args.headless:
+        pyglet.options['headless'] = True
+    from FastGame.core import Game
+
+    game = Game(options={'display': (800, 600), 'show_title_bar': False, 'title': 'instancing benchmark', 'fps': 60, 'visible': False})
+
+    print(f"{'cuboids':>8} {'instanced':>10} {'draw calls':>11} {'mean ms':>9} {'p95 ms':>8}")
+    for count in args.counts:
+        game.scene = build_scene(count, args.transform_pool)
+        for use_instancing in (False, True):
+            game.scene.use_instancing = use_instancing
+            run_frames(game, args.warmup)
+            times = run_frames(game, args.frames)
+            print(f"{count:>8} {str(use_instancing):>10} {game.scene.last_frame_draw_calls:>11} "
+                  f"{times.mean():>9.2f} {np.percentile(times, 95):>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Physics steps per second for N rigid bodies')
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--colliders', action='store_true', help='give every body a BoxCollider so the broadphase runs too')
+    parser.add_argument('--transform-pool', action='store_true', help='keep the transforms in a scene TransformPool')
+    return parser.parse_args()
+
+
+def build_scene(count, colliders=False, use_transform_pool=False):
+    from pyglm.glm import vec3
+    from FastGame.scene import Scene
+    from FastGame.shader import Shader
+    from FastGame.game_objects import GameObject
+    from FastGame.components import RigidBody, BoxCollider
+
+    # shaders are never compiled, the scene only steps physics
+    shader = Shader('shaders/default.vert', 'shaders/default.frag')
+    scene = Scene('physics', shader, shader, use_transform_pool=use_transform_pool)
+    rng = np.random.default_rng(0)
+    side = 2 * count ** 0.5 * 4
+    positions = rng.uniform(-side, side, (count, 3))
+    velocities = rng.uniform(-5, 5, (count, 3))
+    for i in range(count):
+        body = GameObject(f'body_{i}')
+        body.transform.set_position(vec3(*positions[i]))
+        body.components.add('rigidbody', RigidBody(use_gravity=True))
+        body.components.get('rigidbody').velocity = velocities[i]
+        if colliders:
+            body.components.add('collider', BoxCollider(size=[1, 1, 1]))
+        scene.objects.add(body)
+    return scene
+
+
+def main():
+    args = parse_args()
+    from FastGame import internal_data
+
+    print(f"{'bodies':>8} {'steps/s':>10} {'ms/step':>9}")
+    for count in args.counts:
+        scene = build_scene(count, args.colliders, args.transform_pool)
+        internal_data.current_scene = scene
+        scene.physics_world.step(scene.collision_world)
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            scene.physics_world.step(scene.collision_world)
+        elapsed = time.perf_counter() - start
+        print(f"{count:>8} {args.steps / elapsed:>10.1f} {elapsed / args.steps * 1000:>9.3f}")
+
+
+if __name__ == '__main__':
+    main()
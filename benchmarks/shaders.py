@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyglet
+
+
+SHADER_PAIRS = [
+    ('shaders/default.vert', 'shaders/default.frag'),
+    ('shaders/simple_depth_shader.vert', 'shaders/simple_depth_shader.frag'),
+    ('shaders/simple.vert', 'shaders/simple.frag'),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Shader startup time with a cold, warm and in-process program cache')
+    parser.add_argument('--scenes', type=int, default=2, help='shaders are created once per scene like the soccer demo')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--headless', action='store_true', help='create the context through EGL without a display')
+    return parser.parse_args()
+
+
+def compile_all(scenes):
+    from FastGame.shader import Shader
+    start = time.perf_counter()
+    shaders = []
+    for _ in range(scenes):
+        for vertex_path, fragment_path in SHADER_PAIRS:
+            shader = Shader(vertex_path, fragment_path)
+            shader.compile()
+            shaders.append(shader)
+    from OpenGL.GL import glFinish
+    glFinish()
+    return time.perf_counter() - start, shaders
+
+
+def main():
+    args = parse_args()
+    if args.headless:
+        pyglet.options['headless'] = True
+    from pyglet import gl
+    window = pyglet.window.Window(visible=False, config=gl.Config(major_version=3, minor_version=3, depth_size=24))
+    from FastGame import internal_data
+    from FastGame.render_state import RenderState
+    from FastGame.shader_cache import program_cache
+    internal_data.render_state = RenderState()
+
+    print(f"binaries supported: {program_cache.binaries_supported()}")
+    # link ms only counts building the programs, the total also has the driver's work on first use
+    print(f"{'cache':>8} {'mean ms':>9} {'min ms':>8} {'link ms':>8}")
+    for label, clear_binaries, clear_memory in (('cold', True, True), ('warm', False, True), ('memory', False, False)):
+        times = []
+        link_times = []
+        for _ in range(args.repeats):
+            if clear_memory:
+                program_cache.clear(binaries=clear_binaries)
+            first = len(program_cache.load_times)
+            elapsed, shaders = compile_all(args.scenes)
+            times.append(elapsed * 1000)
+            link_times.append(sum(seconds for _, _, seconds in program_cache.load_times[first:]) * 1000)
+        print(f"{label:>8} {sum(times) / len(times):>9.2f} {min(times):>8.2f} {sum(link_times) / len(link_times):>8.2f}")
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
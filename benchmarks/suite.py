@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIRECTORY))
+
+import numpy as np
+import pyglet
+
+
+SCENARIOS = ('cuboids', 'static', 'spheres', 'lights', 'hierarchy', 'loading')
+PERCENTILES = (50, 90, 95, 99)
+# metrics where any increase is a regression, the rest are timings compared against the threshold
+COUNT_METRICS = ('draw_calls', 'gl_calls')
+# reported but too noisy or descriptive to fail a comparison
+INFORMATIONAL_METRICS = ('objects', 'frame_ms_max')
+
+gl_calls = {'count': 0}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Stress scenes for rendering, physics and loading with JSON results')
+    parser.add_argument('--mode', choices=('offscreen', 'simulation'), default='offscreen',
+                        help='offscreen renders into a hidden window, simulation runs a headless Game without GL')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000], help='objects in the cuboid, sphere and hierarchy scenes')
+    parser.add_argument('--light-counts', type=int, nargs='+', default=[8, 50])
+    parser.add_argument('--depth', type=int, default=8, help='length of each parent chain in the hierarchy scene')
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--alloc-frames', type=int, default=10, help='frames traced with tracemalloc after timing')
+    parser.add_argument('--repeats', type=int, default=3, help='loads per cache state in the loading scene')
+    parser.add_argument('--no-gl-calls', action='store_true', help='skip wrapping the GL functions to count calls')
+    parser.add_argument('--headless', action='store_true', help='render through an EGL context without a display')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare against the JSON written by an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    return parser.parse_args()
+
+
+def install_gl_counter():
+    # the engine imports the GL functions by name, so they are wrapped before FastGame is imported
+    import OpenGL.GL as GL
+    def wrap(function):
+        def counted(*args, **kwargs):
+            gl_calls['count'] += 1
+            return function(*args, **kwargs)
+        return counted
+    for name in dir(GL):
+        value = getattr(GL, name)
+        if name.startswith('gl') and callable(value):
+            setattr(GL, name, wrap(value))
+
+
+def new_scene(name):
+    from FastGame.scene import Scene
+    from FastGame.shader import Shader
+    shader = Shader('shaders/default.vert', 'shaders/default.frag')
+    depth_shader = Shader('shaders/simple_depth_shader.vert', 'shaders/simple_depth_shader.frag')
+    return Scene(name, shader, depth_shader)
+
+
+def add_camera(scene, distance, sun=True):
+    from pyglm.glm import vec3
+    from FastGame.game_objects import Camera, DirectionalLight
+    if sun:
+        light = DirectionalLight('sun')
+        light.transform.rotate_euler(vec3(-60, 30, 0))
+        scene.objects.add(light)
+    camera = Camera('camera')
+    camera.transform.set_position(vec3(0, distance * 0.8, distance * 0.8))
+    camera.transform.look_at(vec3(0, 0, 0), vec3(0, 1, 0))
+    scene.objects.add(camera)
+
+
+def grid_position(index, side, spacing):
+    return (index % side - side / 2) * spacing, (index // side - side / 2) * spacing
+
+
+def build_cuboids(count):
+    from instancing import build_scene
+    return build_scene(count)
+
+
+def build_static(count):
+    # the cuboid grid, merged into static batches
+    from FastGame.game_objects import Cuboid
+    scene = build_cuboids(count)
+    for cuboid in scene.objects.get_all(Cuboid):
+        cuboid.static = True
+    return scene
+
+
+def build_spheres(count):
+    from pyglm.glm import vec3
+    from FastGame.game_objects import Sphere
+    from FastGame.components import RigidBody, BoxCollider
+    scene = new_scene('spheres')
+    rng = np.random.default_rng(0)
+    side = math.ceil(math.sqrt(count))
+    velocities = rng.uniform(-5, 5, (count, 3))
+    for i in range(count):
+        sphere = Sphere(f'sphere_{i}')
+        x, z = grid_position(i, side, 3)
+        sphere.transform.set_position(vec3(x, 10 + (i % 7), z))
+        sphere.components.add('rigidbody', RigidBody(use_gravity=True))
+        sphere.components.get('rigidbody').velocity = velocities[i]
+        sphere.components.add('collider', BoxCollider(size=[1, 1, 1]))
+        scene.objects.add(sphere)
+    add_camera(scene, side * 3)
+    return scene
+
+
+def build_lights(count):
+    from pyglm.glm import vec3
+    from FastGame.game_objects import Cuboid, PointLight, SpotLight
+    scene = new_scene('lights')
+    for i in range(100):
+        cuboid = Cuboid(f'cuboid_{i}')
+        x, z = grid_position(i, 10, 3)
+        cuboid.transform.set_position(vec3(x, 0, z))
+        scene.objects.add(cuboid)
+    # half point and half spot lights on a ring above the grid
+    for i in range(count):
+        angle = 2 * math.pi * i / count
+        light = PointLight(f'point_{i}') if i % 2 == 0 else SpotLight(f'spot_{i}')
+        light.transform.set_position(vec3(12 * math.cos(angle), 4, 12 * math.sin(angle)))
+        if isinstance(light, SpotLight):
+            light.transform.look_at(vec3(0, 0, 0), vec3(0, 1, 0))
+        scene.objects.add(light)
+    add_camera(scene, 30)
+    return scene
+
+
+def build_hierarchy(count, depth):
+    from pyglm.glm import vec3
+    from FastGame.game_objects import Cuboid
+    from FastGame.components import Script
+
+    class Spin(Script):
+        def update(self):
+            self.game_object.transform.rotate_euler(vec3(0, 90 * self.delta_time, 0))
+
+    scene = new_scene('hierarchy')
+    chains = max(1, count // depth)
+    side = math.ceil(math.sqrt(chains))
+    for chain in range(chains):
+        root = Cuboid(f'chain_{chain}_0')
+        x, z = grid_position(chain, side, 6)
+        root.transform.set_position(vec3(x, 0, z))
+        root.components.add('spin', Spin())
+        scene.objects.add(root)
+        parent = root
+        for level in range(1, depth):
+            child = Cuboid(f'chain_{chain}_{level}')
+            child.transform.set_position(vec3(0.6, 1.2, 0))
+            child.transform.rotate_euler(vec3(0, 15, 0))
+            parent.objects.add(child)
+            parent = child
+    add_camera(scene, side * 6)
+    return scene
+
+
+class Runner:
+    def __init__(self, args):
+        from FastGame.core import Game
+        self.args = args
+        self.simulation = args.mode == 'simulation'
+        start = time.perf_counter()
+        options = {'display': (800, 600), 'show_title_bar': False, 'title': 'benchmark suite', 'fps': 60,
+                   'visible': False, 'headless': self.simulation}
+        self.game = Game(options=options)
+        self.window_ms = (time.perf_counter() - start) * 1000
+
+    def frame(self):
+        game = self.game
+        if self.simulation:
+            game.fixed_step(game.fixed_delta_time)
+            return
+        from OpenGL.GL import glClear, glFinish, GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT
+        game.update(game.fixed_delta_time)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        game.render()
+        glFinish()
+
+    def start_scene(self, build):
+        # startup covers building the objects, starting the scene and the first frame's uploads
+        start = time.perf_counter()
+        self.game.scene = build()
+        self.frame()
+        return (time.perf_counter() - start) * 1000
+
+    def measure(self, build):
+        from FastGame.game_objects import GameObject
+        result = {'startup_ms': self.start_scene(build)}
+        for _ in range(self.args.warmup):
+            self.frame()
+
+        times = []
+        gl_calls['count'] = 0
+        for _ in range(self.args.frames):
+            start = time.perf_counter()
+            self.frame()
+            times.append(time.perf_counter() - start)
+        times = np.array(times) * 1000
+        result['frame_ms_mean'] = float(times.mean())
+        result['frame_ms_max'] = float(times.max())
+        for percentile in PERCENTILES:
+            result[f'frame_ms_p{percentile}'] = float(np.percentile(times, percentile))
+        scene = self.game.scene
+        if not self.simulation:
+            result['draw_calls'] = scene.last_frame_draw_calls
+            if not self.args.no_gl_calls:
+                result['gl_calls'] = gl_calls['count'] / self.args.frames
+        result['objects'] = len(scene.objects.get_all(GameObject))
+        result.update(self.measure_allocations())
+        return result
+
+    def measure_allocations(self):
+        tracemalloc.start()
+        first, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for _ in range(self.args.alloc_frames):
+            self.frame()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        frames = max(1, self.args.alloc_frames)
+        return {'alloc_peak_kb': (peak - first) / 1024, 'alloc_net_kb_per_frame': (current - first) / 1024 / frames}
+
+    def measure_loading(self):
+        # cold parses the .obj and rebuilds the .fgmesh cache, warm reads the cache, both upload again
+        from FastGame.mesh_registry import mesh_registry
+        from FastGame.mesh_cache import cache_path
+        from FastGame.game_objects import FootballGoal
+
+        def build():
+            scene = new_scene('loading')
+            scene.objects.add(FootballGoal('goal'))
+            add_camera(scene, 20)
+            return scene
+
+        result = {}
+        for state in ('cold', 'warm'):
+            times = []
+            for _ in range(self.args.repeats):
+                mesh_registry.clear()
+                path = cache_path(mesh_registry.resolve_path('meshes/football_goal.obj'))
+                if state == 'cold' and os.path.exists(path):
+                    os.remove(path)
+                times.append(self.start_scene(build))
+            result[f'{state}_startup_ms'] = float(np.mean(times))
+            result[f'{state}_startup_ms_min'] = float(np.min(times))
+        return result
+
+    def run(self):
+        args = self.args
+        results = {}
+        builders = {
+            'cuboids': [(f'cuboids-{count}', lambda count=count: build_cuboids(count)) for count in args.counts],
+            'static': [(f'static-{count}', lambda count=count: build_static(count)) for count in args.counts],
+            'spheres': [(f'spheres-{count}', lambda count=count: build_spheres(count)) for count in args.counts],
+            'lights': [(f'lights-{count}', lambda count=count: build_lights(count)) for count in args.light_counts],
+            'hierarchy': [(f'hierarchy-{count}x{args.depth}', lambda count=count: build_hierarchy(count, args.depth))
+                          for count in args.counts],
+        }
+        for scenario in args.scenarios:
+            if scenario == 'loading':
+                results['loading'] = self.measure_loading()
+                self.report('loading', results['loading'])
+                continue
+            for key, build in builders[scenario]:
+                results[key] = self.measure(build)
+                self.report(key, results[key])
+        return results
+
+    def report(self, key, result):
+        if 'frame_ms_mean' in result:
+            print(f"{key:>24} {result['frame_ms_mean']:>9.2f} {result['frame_ms_p95']:>8.2f} {result['frame_ms_p99']:>8.2f} "
+                  f"{result.get('draw_calls', '-'):>6} {result['startup_ms']:>10.1f}")
+        else:
+            print(f"{key:>24} " + ' '.join(f"{name} {value:.1f}" for name, value in result.items()))
+
+
+def get_environment(args):
+    environment = {'mode': args.mode, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'numpy': np.__version__, 'pyglet': pyglet.version, 'frames': args.frames, 'warmup': args.warmup}
+    if args.mode == 'offscreen':
+        from OpenGL.GL import glGetString, GL_RENDERER, GL_VERSION
+        environment['gl_renderer'] = (glGetString(GL_RENDERER) or b'').decode()
+        environment['gl_version'] = (glGetString(GL_VERSION) or b'').decode()
+    try:
+        environment['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                               cwd=BENCHMARK_DIRECTORY, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return environment
+
+
+def compare(results, baseline, threshold):
+    # every metric is lower-is-better, counts regress on any increase and timings past the threshold
+    regressions = []
+    print(f"{'benchmark':>24} {'metric':>24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for key, result in results.items():
+        for metric, value in result.items():
+            old = baseline.get('results', {}).get(key, {}).get(metric)
+            if old is None or metric in INFORMATIONAL_METRICS:
+                continue
+            change = (value - old) / old if old else 0.0
+            if metric in COUNT_METRICS:
+                regressed = value > old
+            elif metric.startswith('alloc'):
+                regressed = value > old * (1 + threshold) and value - old > 64
+            else:
+                regressed = change > threshold
+            flag = ' !' if regressed else ''
+            print(f"{key:>24} {metric:>24} {old:>10.2f} {value:>10.2f} {change * 100:>7.1f}%{flag}")
+            if regressed:
+                regressions.append((key, metric))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    if args.headless:
+        pyglet.options['headless'] = True
+    if args.mode == 'simulation':
+        args.no_gl_calls = True
+    elif not args.no_gl_calls:
+        install_gl_counter()
+    # the engine resolves shader and mesh paths relative to FastGame, the demo assets from the repo root
+    os.chdir(os.path.dirname(BENCHMARK_DIRECTORY))
+    sys.path.insert(0, BENCHMARK_DIRECTORY)
+
+    start = time.perf_counter()
+    import FastGame.core
+    import_ms = (time.perf_counter() - start) * 1000
+    runner = Runner(args)
+    print(f"import {import_ms:.1f} ms, game {runner.window_ms:.1f} ms")
+    print(f"{'benchmark':>24} {'mean ms':>9} {'p95 ms':>8} {'p99 ms':>8} {'draws':>6} {'startup ms':>10}")
+    results = runner.run()
+
+    output = {'environment': get_environment(args), 'startup': {'import_ms': import_ms, 'game_ms': runner.window_ms},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('environment', {}).get('mode') != args.mode:
+            print(f"baseline was recorded in {baseline.get('environment', {}).get('mode')} mode")
+        regressions = compare(results, baseline, args.threshold)
+        print(f"{len(regressions)} regressions")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
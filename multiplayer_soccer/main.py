@@ -15,6 +15,8 @@ player2_vertical = InputAxis(['left'], ['right'])
 player2_horizontal = InputAxis(['down'], ['up'])
 
 class RoadColorController(Script):
+    update_interval = 0.05
+
     def generate_color_gradient(self, start_color: Color, end_color: Color, steps: int):
         gradient = []    
         start_rgb = np.array(start_color.color_in_rgb, dtype=np.float32)
@@ -42,18 +44,12 @@ class RoadColorController(Script):
             self.colors.append(color)
             
         self.current_color = 0
-        self.time_passed = 0
         
     def update(self):
-        self.time_passed += self.delta_time
-        # print(self.time_passed)
-        if self.time_passed >= 0.05:
-            if self.current_color >= len(self.colors):
-                self.current_color = 0
-            # print(self.game_object.name)
-            self.game_object.material.color = self.colors[self.current_color]
-            self.current_color += 1
-            self.time_passed = 0
+        if self.current_color >= len(self.colors):
+            self.current_color = 0
+        self.game_object.material.color = self.colors[self.current_color]
+        self.current_color += 1
 
 
 
@@ -146,6 +142,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     road.material.diffuse_reflection = 0.8
     road.material.specular_reflection = 0.8
     road.material.shininess = 60
+    road.static = True
     scene.objects.add(road)
     
     
@@ -180,7 +177,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
         'skybox_textures/bottom.jpg',
         'skybox_textures/front.jpg',
         'skybox_textures/back.jpg',
-    ])
+    ], asynchronous=True)
     scene.objects.add(skybox)
     
     
@@ -189,6 +186,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     left_wall_top.transform.set_position(vec3(-road_width, road_y + wall_height/2, (road_depth + goal_gap) / 2))
     left_wall_top.material.color = Color('#8B5CF6')
     left_wall_top.components.add('collider', BoxCollider(size=[2,2,2]))
+    left_wall_top.static = True
     scene.objects.add(left_wall_top)
     
     
@@ -197,6 +195,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     left_wall_bottom.transform.set_position(vec3(-road_width, road_y + wall_height/2, -(road_depth + goal_gap) / 2))
     left_wall_bottom.material.color = Color('#8B5CF6')
     left_wall_bottom.components.add('collider', BoxCollider(size=[2,2,2]))
+    left_wall_bottom.static = True
     scene.objects.add(left_wall_bottom)
     
     
@@ -205,6 +204,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     right_wall_top.transform.set_position(vec3(road_width, road_y + wall_height/2, (road_depth + goal_gap) / 2))
     right_wall_top.material.color = Color('#8B5CF6')
     right_wall_top.components.add('collider', BoxCollider(size=[2,2,2]))
+    right_wall_top.static = True
     scene.objects.add(right_wall_top)
     
     
@@ -213,6 +213,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     right_wall_bottom.transform.set_position(vec3(road_width, road_y + wall_height/2, -(road_depth + goal_gap) / 2))
     right_wall_bottom.material.color = Color('#8B5CF6')
     right_wall_bottom.components.add('collider', BoxCollider(size=[2,2,2]))
+    right_wall_bottom.static = True
     scene.objects.add(right_wall_bottom)
     
     
@@ -221,6 +222,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     top_wall.transform.set_position(vec3(0, road_y + wall_height/2, road_depth))
     top_wall.material.color = Color('#F59E42')
     top_wall.components.add('collider', BoxCollider(size=[2,2,2]))
+    top_wall.static = True
     scene.objects.add(top_wall)
     
     
@@ -229,13 +231,14 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     bottom_wall.transform.set_position(vec3(0, road_y + wall_height/2, -road_depth))
     bottom_wall.material.color = Color('#F59E42')
     bottom_wall.components.add('collider', BoxCollider(size=[2,2,2]))
+    bottom_wall.static = True
     scene.objects.add(bottom_wall)
     
     scene.objects.add(player1)
     scene.objects.add(player2)
     scene.objects.add(ball)
     
-    goal1 = FootballGoal('goal1')
+    goal1 = FootballGoal('goal1', asynchronous=True)
     goal1.transform.set_scale(vec3(0.03, 0.04, 0.04))
     goal1.transform.set_position(vec3(40, 0, 7))
     goal1.transform.rotate_euler(vec3(0, 90, 0))
@@ -244,9 +247,10 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     goal1.material.specular_reflection = 0.9
     goal1.material.shininess = 80
     goal1.material.color = Color('#00CFFF')
+    goal1.static = True
     scene.objects.add(goal1)
     
-    goal2 = FootballGoal('goal2')
+    goal2 = FootballGoal('goal2', asynchronous=True)
     goal2.transform.set_scale(vec3(0.03, 0.04, 0.04))
     goal2.transform.set_position(vec3(-40, 0, -7))
     goal2.transform.rotate_euler(vec3(0, -90, 0))
@@ -255,6 +259,7 @@ def create_scene(win_score_callback, player1, player2, ball, camera=None):
     goal2.material.specular_reflection = 0.9
     goal2.material.shininess = 80
     goal2.material.color = Color('#FF4B2B')
+    goal2.static = True
     scene.objects.add(goal2)
     
     